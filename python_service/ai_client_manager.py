@@ -27,6 +27,8 @@ except ImportError:
     init_custom_ai_client = None
     get_custom_ai_client = None
 
+from embedding_cache import get_embedding_cache
+
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -122,6 +124,14 @@ class AIClientManager:
             available.append("custom")
         return available
     
+    def default_chat_model(self) -> Optional[str]:
+        """当前API未指定模型时使用的聊天模型"""
+        if self.current_api == "geekai":
+            return DEFAULT_CHAT_MODEL
+        if self.current_api == "custom":
+            return CUSTOM_AI_CHAT_MODEL
+        return None
+    
     def chat_completion(self, 
                        messages: List[Dict[str, str]], 
                        model: str = None,
@@ -222,14 +232,46 @@ class AIClientManager:
             elif self.current_api == "custom":
                 model = CUSTOM_AI_EMBEDDING_MODEL
         
-        try:
-            if hasattr(client, 'get_embeddings'):
+        if not hasattr(client, 'get_embeddings'):
+            return {"error": f"客户端 {self.current_api} 不支持向量化功能"}
+
+        cache = get_embedding_cache()
+        if not cache:
+            try:
                 return client.get_embeddings(texts, model)
-            else:
-                return {"error": f"客户端 {self.current_api} 不支持向量化功能"}
-        except Exception as e:
-            logger.error(f"向量化API调用异常: {e}")
-            return {"error": f"向量化API调用异常: {str(e)}"}
+            except Exception as e:
+                logger.error(f"向量化API调用异常: {e}")
+                return {"error": f"向量化API调用异常: {str(e)}"}
+
+        # 先查缓存，只对未命中的文本调用接口
+        vectors = cache.get_many(model, texts)
+        missing = [i for i, v in enumerate(vectors) if not v]
+        result: Dict[str, Any] = {"object": "list", "model": model}
+        if missing:
+            try:
+                result = client.get_embeddings([texts[i] for i in missing], model)
+            except Exception as e:
+                logger.error(f"向量化API调用异常: {e}")
+                return {"error": f"向量化API调用异常: {str(e)}"}
+            if "error" in result:
+                return result
+            fetched: List[Optional[List[float]]] = [None] * len(missing)
+            for pos, item in enumerate(result.get("data", []) or []):
+                idx = item.get("index", pos)
+                if isinstance(idx, int) and 0 <= idx < len(missing):
+                    fetched[idx] = item.get("embedding")
+            cache.put_many(model, [texts[i] for i in missing], fetched)
+            for i, vector in zip(missing, fetched):
+                vectors[i] = vector
+
+        # 按原始输入顺序组装与接口一致的返回结构
+        result = dict(result)
+        result["data"] = [
+            {"object": "embedding", "index": i, "embedding": v}
+            for i, v in enumerate(vectors)
+        ]
+        result["cached_count"] = len(texts) - len(missing)
+        return result
     
     def simple_chat(self, message: str, model: str = None) -> str:
         """
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+RAG问答的语义答案缓存
+- 新问题的向量与同一检索范围内已缓存问题的余弦相似度达到阈值时，直接返回缓存的答案与引用，不再调用大模型
+- 检索范围（scope）：ES索引、向量模型、source_file 过滤、检索方式；只在同一范围内比较
+- 索引代次（generation）：整库重建/清空缓存时加一，旧代次的条目不再命中
+- 入库/改挂某个知识ID时，作废引用了该知识、或限定在相关文件上的条目；
+  未限定文件的问题可能因新内容而得到不同答案，默认一并作废（invalidate_unscoped_on_ingest）
+- 存储：sqlite 持久化（重启后恢复），内存中按范围维护归一化后的 NumPy 向量矩阵，一次矩阵乘法完成比较
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from config import ANSWER_CACHE_CONFIG
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def make_answer_scope(index: str, model: str, source_file: Optional[str], retrieval_mode: str,
+                      chat_model: str = "") -> str:
+    """检索范围键：只有范围相同、且答案由同一聊天模型生成的问题才互相命中"""
+    return json.dumps({
+        "index": index,
+        "model": model,
+        "chat_model": chat_model,
+        "source_file": source_file or "",
+        "mode": retrieval_mode,
+    }, ensure_ascii=False, sort_keys=True)
+
+
+class AnswerCache:
+    """语义答案缓存（sqlite + 内存向量矩阵）"""
+
+    # 命中记录（last_hit/hits）先暂存在内存，攒够条数或间隔到期后在锁外批量写入
+    HIT_FLUSH_BATCH = 200
+    HIT_FLUSH_SECONDS = 10.0
+
+    def __init__(self, db_path: str, threshold: float = 0.95, max_entries: int = 5000,
+                 ttl_seconds: float = 7 * 86400, invalidate_unscoped_on_ingest: bool = True):
+        self.db_path = db_path
+        self.threshold = float(threshold)
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_seconds = float(ttl_seconds)
+        self.invalidate_unscoped_on_ingest = invalidate_unscoped_on_ingest
+
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "puts": 0, "stale_puts": 0, "invalidated": 0, "expired": 0, "evictions": 0}
+        # 作废次数（进程内递增）：检索前取快照，写入时已变化说明期间有入库/删除，答案可能基于旧内容
+        self._invalidations = 0
+        # 条目元数据：id → {"scope", "source_file", "knowledge_ids", "created_at", "last_hit"}
+        self._entries: Dict[int, Dict] = {}
+        # 归一化向量：id → ndarray(float32)
+        self._vectors: Dict[int, "np.ndarray"] = {}
+        # 范围 → (条目id数组, 向量矩阵)；条目变化时置为None，下次查询时重建
+        self._matrices: Dict[str, Optional[tuple]] = {}
+        # 待写入的命中记录：id → (最近命中时间, 命中次数)
+        self._pending_hits: Dict[int, tuple] = {}
+        self._hits_flushed_at = time.time()
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS answer_cache (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                scope TEXT NOT NULL,
+                generation INTEGER NOT NULL,
+                source_file TEXT NOT NULL,
+                question TEXT NOT NULL,
+                dims INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                answer TEXT NOT NULL,
+                refs TEXT NOT NULL,
+                knowledge_ids TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_hit REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS answer_cache_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.commit()
+        row = self._conn.execute("SELECT value FROM answer_cache_meta WHERE key = 'generation'").fetchone()
+        self.generation = int(row[0]) if row else 0
+        self._load()
+        # 命中记录单独用一个连接写入，写盘时不占用 _lock
+        self._hit_lock = threading.Lock()
+        self._hit_conn = sqlite3.connect(db_path, check_same_thread=False)
+
+    @staticmethod
+    def _normalize(vector: Sequence[float]) -> Optional["np.ndarray"]:
+        vec = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(vec))
+        return vec / norm if norm > 0 else None
+
+    def _load(self):
+        """启动时载入当前代次、未过期的条目；其余直接删除"""
+        now = time.time()
+        self._conn.execute(
+            "DELETE FROM answer_cache WHERE generation != ? OR created_at < ?",
+            (self.generation, now - self.ttl_seconds),
+        )
+        self._conn.commit()
+        rows = self._conn.execute(
+            "SELECT id, scope, source_file, vector, knowledge_ids, created_at, last_hit FROM answer_cache"
+        ).fetchall()
+        for entry_id, scope, source_file, blob, kids, created_at, last_hit in rows:
+            vec = self._normalize(np.frombuffer(blob, dtype=np.float32))
+            if vec is None:
+                continue
+            self._remember(entry_id, scope, source_file, vec, json.loads(kids), created_at, last_hit)
+        logger.info(f"答案缓存载入 {len(self._entries)} 条（代次 {self.generation}）")
+
+    def _remember(self, entry_id: int, scope: str, source_file: str, vec: "np.ndarray",
+                  knowledge_ids: List[int], created_at: float, last_hit: float):
+        self._entries[entry_id] = {
+            "scope": scope,
+            "source_file": source_file,
+            "knowledge_ids": set(knowledge_ids),
+            "created_at": created_at,
+            "last_hit": last_hit,
+        }
+        self._vectors[entry_id] = vec
+        self._matrices[scope] = None
+
+    def _matrix(self, scope: str) -> Optional[tuple]:
+        if scope not in self._matrices:
+            return None
+        cached = self._matrices[scope]
+        if cached is None:
+            ids = [i for i, e in self._entries.items() if e["scope"] == scope]
+            if not ids:
+                del self._matrices[scope]
+                return None
+            cached = (np.asarray(ids, dtype=np.int64), np.vstack([self._vectors[i] for i in ids]))
+            self._matrices[scope] = cached
+        return cached
+
+    def _drop(self, entry_ids: Iterable[int]) -> int:
+        """删除条目（调用方持有锁）"""
+        ids = [i for i in entry_ids if i in self._entries]
+        for i in ids:
+            entry = self._entries.pop(i)
+            self._vectors.pop(i, None)
+            self._matrices[entry["scope"]] = None
+        if ids:
+            for start in range(0, len(ids), 500):
+                part = ids[start:start + 500]
+                self._conn.execute(f"DELETE FROM answer_cache WHERE id IN ({','.join('?' * len(part))})", part)
+            self._conn.commit()
+        return len(ids)
+
+    def lookup(self, scope: str, vector: Sequence[float]) -> Optional[Dict]:
+        """
+        查找同一范围内最相似的已缓存问题，相似度达到阈值时返回
+        {"answer", "references", "question", "similarity"}，否则返回None
+        """
+        query = self._normalize(vector)
+        with self._lock:
+            matrix = self._matrix(scope) if query is not None else None
+            if matrix is None or matrix[1].shape[1] != query.shape[0]:
+                self._stats["misses"] += 1
+                return None
+            ids, vectors = matrix
+            sims = vectors @ query
+            now = time.time()
+            row = None
+            expired, missing = [], []
+            # 按相似度从高到低依次尝试，跳过已过期的条目，直到低于阈值
+            for pos in np.argsort(-sims):
+                similarity = float(sims[pos])
+                if similarity < self.threshold:
+                    break
+                entry_id = int(ids[pos])
+                if self._entries[entry_id]["created_at"] + self.ttl_seconds < now:
+                    expired.append(entry_id)
+                    continue
+                row = self._conn.execute(
+                    "SELECT question, answer, refs FROM answer_cache WHERE id = ?", (entry_id,)
+                ).fetchone()
+                if row is not None:
+                    break
+                missing.append(entry_id)
+            if expired:
+                self._stats["expired"] += self._drop(expired)
+            if missing:
+                self._drop(missing)
+            if row is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries[entry_id]["last_hit"] = now
+            _, hits = self._pending_hits.get(entry_id, (now, 0))
+            self._pending_hits[entry_id] = (now, hits + 1)
+            self._stats["hits"] += 1
+            flush = (len(self._pending_hits) >= self.HIT_FLUSH_BATCH
+                     or now - self._hits_flushed_at >= self.HIT_FLUSH_SECONDS)
+        if flush:
+            self.flush_hits()
+        return {"question": row[0], "answer": row[1], "references": json.loads(row[2]), "similarity": similarity}
+
+    def flush_hits(self):
+        """把暂存的命中记录批量写入sqlite（不持有 _lock）"""
+        with self._lock:
+            pending, self._pending_hits = self._pending_hits, {}
+            self._hits_flushed_at = time.time()
+        if not pending:
+            return
+        try:
+            with self._hit_lock:
+                self._hit_conn.executemany(
+                    "UPDATE answer_cache SET last_hit = ?, hits = hits + ? WHERE id = ?",
+                    [(last_hit, hits, entry_id) for entry_id, (last_hit, hits) in pending.items()],
+                )
+                self._hit_conn.commit()
+        except Exception as e:
+            logger.warning(f"写入答案缓存命中记录失败: {e}")
+
+    def snapshot(self) -> int:
+        """检索前调用，结果传给 put 的 snapshot"""
+        with self._lock:
+            return self._invalidations
+
+    def put(self, scope: str, source_file: Optional[str], question: str, vector: Sequence[float],
+            answer: str, references: List[Dict], knowledge_ids: Iterable[int], snapshot: Optional[int] = None):
+        """
+        缓存一次成功的问答；引用到的知识ID用于入库时作废
+        snapshot 为检索前 snapshot() 的结果，其后发生过作废（检索与生成期间有入库/删除）时不写入
+        """
+        vec = self._normalize(vector)
+        if vec is None or not answer:
+            return
+        kids = sorted({int(k) for k in knowledge_ids if k is not None})
+        now = time.time()
+        with self._lock:
+            if snapshot is not None and snapshot != self._invalidations:
+                self._stats["stale_puts"] += 1
+                logger.info(f"问答期间知识库有变化，答案不写入缓存: {question}")
+                return
+            try:
+                cursor = self._conn.execute(
+                    "INSERT INTO answer_cache (scope, generation, source_file, question, dims, vector, answer, refs,"
+                    " knowledge_ids, created_at, last_hit) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (scope, self.generation, source_file or "", question, int(vec.shape[0]), vec.tobytes(), answer,
+                     json.dumps(references, ensure_ascii=False), json.dumps(kids), now, now),
+                )
+                self._conn.commit()
+            except Exception as e:
+                logger.error(f"写入答案缓存失败: {e}")
+                return
+            self._remember(cursor.lastrowid, scope, source_file or "", vec, kids, now, now)
+            self._stats["puts"] += 1
+            if len(self._entries) > self.max_entries:
+                # 按最近命中时间淘汰到上限的90%
+                victims = sorted(self._entries, key=lambda i: self._entries[i]["last_hit"])
+                self._stats["evictions"] += self._drop(victims[:len(self._entries) - int(self.max_entries * 0.9)])
+
+    def invalidate_knowledge(self, knowledge_ids: Iterable[Optional[int]],
+                             source_files: Iterable[str] = (),
+                             include_unscoped: Optional[bool] = None) -> int:
+        """
+        入库/改挂/删除后作废受影响的条目，返回作废条数
+        include_unscoped 为None时按 invalidate_unscoped_on_ingest；删除时只需作废引用了被删内容的条目
+        """
+        kids = {int(k) for k in knowledge_ids if k is not None}
+        files = {f for f in source_files if f}
+        if include_unscoped is None:
+            include_unscoped = self.invalidate_unscoped_on_ingest
+        with self._lock:
+            self._invalidations += 1
+            victims = [
+                i for i, e in self._entries.items()
+                if e["knowledge_ids"] & kids
+                or (e["source_file"] and e["source_file"] in files)
+                or (not e["source_file"] and include_unscoped)
+            ]
+            removed = self._drop(victims)
+            self._stats["invalidated"] += removed
+        if removed:
+            logger.info(f"答案缓存作废 {removed} 条（知识ID {sorted(kids)}）")
+        return removed
+
+    def bump_generation(self) -> int:
+        """索引代次加一（整库重建后调用），清空全部条目"""
+        with self._lock:
+            self._invalidations += 1
+            self.generation += 1
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answer_cache_meta (key, value) VALUES ('generation', ?)", (str(self.generation),)
+            )
+            self._conn.execute("DELETE FROM answer_cache")
+            self._conn.commit()
+            removed = len(self._entries)
+            self._entries.clear()
+            self._vectors.clear()
+            self._matrices.clear()
+            self._stats["invalidated"] += removed
+        logger.info(f"答案缓存代次更新为 {self.generation}，清空 {removed} 条")
+        return self.generation
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_rate": round(self._stats["hits"] / total, 4) if total else 0.0,
+                "entries": len(self._entries),
+                "scopes": len(self._matrices),
+                "generation": self.generation,
+                "threshold": self.threshold,
+            }
+
+
+# 全局答案缓存实例
+answer_cache = None
+_answer_cache_initialized = False
+_answer_cache_lock = threading.Lock()
+
+def init_answer_cache() -> Optional[AnswerCache]:
+    """初始化答案缓存（配置关闭、缺少NumPy或初始化失败时返回None）"""
+    global answer_cache, _answer_cache_initialized
+    with _answer_cache_lock:
+        answer_cache = _build_answer_cache()
+        _answer_cache_initialized = True
+    return answer_cache
+
+def _build_answer_cache() -> Optional[AnswerCache]:
+    if not ANSWER_CACHE_CONFIG.get("enabled", True):
+        logger.info("答案缓存已关闭")
+        return None
+    if not NUMPY_AVAILABLE:
+        logger.warning("未安装NumPy，答案缓存不可用。请安装: pip install numpy")
+        return None
+    try:
+        return AnswerCache(
+            ANSWER_CACHE_CONFIG["db_path"],
+            threshold=ANSWER_CACHE_CONFIG.get("similarity_threshold", 0.95),
+            max_entries=ANSWER_CACHE_CONFIG.get("max_entries", 5000),
+            ttl_seconds=ANSWER_CACHE_CONFIG.get("ttl_seconds", 7 * 86400),
+            invalidate_unscoped_on_ingest=ANSWER_CACHE_CONFIG.get("invalidate_unscoped_on_ingest", True),
+        )
+    except Exception as e:
+        logger.error(f"答案缓存初始化失败，问答将始终调用大模型: {e}")
+        return None
+
+def get_answer_cache() -> Optional[AnswerCache]:
+    """获取答案缓存实例（未启用或初始化失败时为None）"""
+    global answer_cache, _answer_cache_initialized
+    if not _answer_cache_initialized:
+        with _answer_cache_lock:
+            if not _answer_cache_initialized:
+                answer_cache = _build_answer_cache()
+                # 实例创建后再置标志，并发的首次调用不会拿到None
+                _answer_cache_initialized = True
+    return answer_cache
+
+def shutdown_answer_cache():
+    """服务停止时写入暂存的命中记录"""
+    if answer_cache is not None:
+        answer_cache.flush_hits()
@@ -5,9 +5,9 @@
 整合PyMuPDF Pro + PyMuPDF4LLM + LangChain + 极客智坊API
 """
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 import uvicorn
 import json
 import logging
@@ -18,10 +18,17 @@ import subprocess
 from shutil import which
 import shutil
 import requests
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # PyMuPDF相关
 try:
     import fitz  # PyMuPDF
+    from pdf_extraction import extract_documents_with_block_positions, select_extract_profile, get_page_dict
+    from pdf_layout import render_text_lines, iter_text_file_lines
+    from docx_layout import render_docx_to_pdf, extract_docx_text
     PYMUPDF_AVAILABLE = True
 except ImportError:
     PYMUPDF_AVAILABLE = False
@@ -35,26 +42,14 @@ try:
 except Exception:
     OPENPYXL_AVAILABLE = False
 
-# LangChain相关
-try:
-    from langchain.text_splitter import RecursiveCharacterTextSplitter
-    from langchain.schema import Document
-    LANGCHAIN_AVAILABLE = True
-except ImportError:
-    LANGCHAIN_AVAILABLE = False
-    print("❌ LangChain 不可用")
+# 文本分块（项目内实现，保留字符偏移，不再依赖 LangChain）
+from text_splitter import Document, make_text_splitter
 
 # ES相关
 from elasticsearch import Elasticsearch
 import hashlib
 
-# Office文档解析能力（原生）
-try:
-    from docx import Document as DocxDocument
-    DOCX_AVAILABLE = True
-except Exception:
-    DOCX_AVAILABLE = False
-
+# Office文档解析能力（原生；Word 解析见 docx_layout）
 try:
     from pptx import Presentation as PptxPresentation
     PPTX_AVAILABLE = True
@@ -71,9 +66,28 @@ app = FastAPI(title="智能知识库系统", version="2.0.0")
 from config import (
     ES_CONFIG, DOCUMENT_CONFIG, EMBEDDING_CONFIG, RAG_CONFIG,
     CHUNKING_CONFIG, GEEKAI_API_KEY, GEEKAI_CHAT_URL,
-    GEEKAI_EMBEDDING_URL, DEFAULT_EMBEDDING_MODEL
+    GEEKAI_EMBEDDING_URL, DEFAULT_EMBEDDING_MODEL, EMBEDDING_BATCH_CONFIG,
+    ES_BULK_CONFIG, INCREMENTAL_INGEST_CONFIG, UPLOAD_CONFIG, DEDUP_CONFIG,
+    CONVERTED_PDF_CONFIG, RAG_STREAM_CONFIG
 )
-from fastapi.responses import FileResponse
+from es_bulk_writer import ESBulkWriter
+from embedding_cache import get_embedding_cache, get_query_embedding_cache
+from ingest_jobs import init_ingest_queue, get_ingest_queue
+from chunk_positions import assign_positions_by_offset, join_with_offsets
+from span_table import SpanTable, positions_to_dicts
+from incremental_ingest import compute_chunk_ids, collect_existing_ids, diff_chunk_ids
+from upload_registry import get_upload_registry
+from libreoffice_pool import get_libreoffice_pool, shutdown_libreoffice_pool
+from converted_pdf_store import get_converted_pdf_store, convert_with_cache, hash_file, viewer_pdf_path, find_viewer_pdf
+from viewer_pdf import init_viewer_pdf_service, get_viewer_pdf_service, shutdown_viewer_pdf_service
+from excel_streaming import iter_excel_chunks
+from font_registry import init_font_registry, get_font_registry
+from retrieval import retrieve, resolve_retrieval_mode
+from answer_cache import get_answer_cache, make_answer_scope, shutdown_answer_cache
+from chat_stream import format_sse, iterate_in_thread, get_stream_metrics, SSE_HEARTBEAT
+from ai_client_manager import get_ai_manager
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 
 # 辅助：构建页文本与词级索引（用于bbox定位）
 def build_page_text_and_word_index(page: "fitz.Page") -> (str, list):
@@ -145,28 +159,106 @@ es_client = Elasticsearch(
 )
 
 # 极客API embedding函数
+def _request_embeddings(texts: List[str], timeout: int = 20) -> List[Optional[list]]:
+    """调用极客API一次性获取多条文本的向量，按输入顺序返回（失败位置为None）"""
+    url = GEEKAI_EMBEDDING_URL
+    headers = {
+        "Authorization": f"Bearer {GEEKAI_API_KEY}",
+        "Content-Type": "application/json"
+    }
+    data = {
+        "model": DEFAULT_EMBEDDING_MODEL,
+        "input": texts,
+        "intent": "search_document"
+    }
+    response = requests.post(url, headers=headers, json=data, timeout=timeout)
+    if response.status_code != 200:
+        logger.error(f"极客API embedding失败: {response.status_code} - {response.text}")
+        return [None] * len(texts)
+    items = response.json().get("data", []) or []
+    results: List[Optional[list]] = [None] * len(texts)
+    for pos, item in enumerate(items):
+        # 接口返回的 index 字段对应输入位置；缺失时按返回顺序兜底
+        idx = item.get("index", pos)
+        if isinstance(idx, int) and 0 <= idx < len(texts):
+            results[idx] = item.get("embedding")
+    return results
+
 def get_embedding(text: str) -> list:
-    """使用极客API获取文本嵌入向量"""
+    """使用极客API获取文本嵌入向量（优先读取embedding缓存）"""
+    cache = get_embedding_cache()
+    if cache:
+        cached = cache.get(DEFAULT_EMBEDDING_MODEL, text)
+        if cached:
+            return cached
     try:
-        url = GEEKAI_EMBEDDING_URL
-        headers = {
-            "Authorization": f"Bearer {GEEKAI_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        data = {
-            "model": DEFAULT_EMBEDDING_MODEL,
-            "input": [text],
-            "intent": "search_document"
-        }
-        response = requests.post(url, headers=headers, json=data, timeout=20)
-        if response.status_code == 200:
-            return response.json().get("data", [{}])[0].get("embedding")
-        else:
-            logger.error(f"极客API embedding失败: {response.status_code} - {response.text}")
-            return None
+        embedding = _request_embeddings([text], timeout=20)[0]
     except Exception as e:
         logger.error(f"极客API embedding异常: {e}")
         return None
+    if cache and embedding:
+        cache.put(DEFAULT_EMBEDDING_MODEL, text, embedding)
+    return embedding
+
+def get_query_embedding(question: str) -> list:
+    """问答用的问题向量：先查问题向量缓存（归一化后相同的问题直接复用），未命中再走 get_embedding"""
+    cache = get_query_embedding_cache()
+    if cache is None:
+        return get_embedding(question)
+    return cache.get_or_compute(DEFAULT_EMBEDDING_MODEL, question, get_embedding)
+
+def get_embeddings_batch(texts: List[str]) -> List[Optional[list]]:
+    """
+    批量获取文本向量：按 batch_size 分批，最多 max_in_flight 个批次并发在途，
+    结果按输入位置回填；某一批失败时该批对应位置为None。
+    命中embedding缓存的文本不再请求接口，重复文本只请求一次。
+    """
+    if not texts:
+        return []
+    cache = get_embedding_cache()
+    if cache:
+        results = cache.get_many(DEFAULT_EMBEDDING_MODEL, texts)
+        pending: Dict[str, List[int]] = {}
+        for i, vector in enumerate(results):
+            if not vector:
+                pending.setdefault(texts[i], []).append(i)
+        if pending:
+            unique_texts = list(pending.keys())
+            fetched = _request_embeddings_batched(unique_texts)
+            cache.put_many(DEFAULT_EMBEDDING_MODEL, unique_texts, fetched)
+            for text, vector in zip(unique_texts, fetched):
+                for i in pending[text]:
+                    results[i] = vector
+        logger.info(f"embedding缓存命中 {len(texts) - sum(len(v) for v in pending.values())}/{len(texts)} 条")
+        return results
+    return _request_embeddings_batched(texts)
+
+def _request_embeddings_batched(texts: List[str]) -> List[Optional[list]]:
+    """按配置分批并发请求向量接口"""
+    if not texts:
+        return []
+    batch_size = max(1, int(EMBEDDING_BATCH_CONFIG.get("batch_size", 64)))
+    max_in_flight = max(1, int(EMBEDDING_BATCH_CONFIG.get("max_in_flight", 4)))
+    timeout = int(EMBEDDING_BATCH_CONFIG.get("timeout", 60))
+
+    results: List[Optional[list]] = [None] * len(texts)
+    starts = list(range(0, len(texts), batch_size))
+
+    def _run_batch(start: int):
+        batch = texts[start:start + batch_size]
+        try:
+            return start, _request_embeddings(batch, timeout=timeout)
+        except Exception as e:
+            logger.error(f"极客API 批量embedding异常（起始位置 {start}，{len(batch)} 条）: {e}")
+            return start, [None] * len(batch)
+
+    with ThreadPoolExecutor(max_workers=min(max_in_flight, len(starts))) as pool:
+        for start, vectors in pool.map(_run_batch, starts):
+            results[start:start + len(vectors)] = vectors
+
+    failed = sum(1 for v in results if not v)
+    logger.info(f"批量embedding完成: 共 {len(texts)} 条，{len(starts)} 个批次，失败 {failed} 条")
+    return results
 
 # 请求模型
 class LdapValidateRequest(BaseModel):
@@ -177,6 +269,8 @@ class ChatRequest(BaseModel):
     question: str
     user_id: str
     source_file: Optional[str] = None  # 可选：指定特定文件名进行RAG检索
+    retrieval_mode: Optional[str] = None  # 可选：script_score | knn | hybrid，默认取 RETRIEVAL_CONFIG["mode"]
+    num_candidates: Optional[int] = None  # 可选：knn 每分片候选数
 
 class DocumentProcessRequest(BaseModel):
     knowledge_id: int
@@ -220,6 +314,23 @@ class DocumentProcessResponse(BaseModel):
     message: str
     chunks_count: int
     knowledge_id: int
+    job_id: Optional[str] = None  # 异步模式下返回的后台任务ID
+
+class IngestJobResponse(BaseModel):
+    job_id: str
+    status: str
+    progress: float
+    message: Optional[str] = None
+    filename: str
+    knowledge_id: Optional[int] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created_at: float
+    updated_at: float
+
+class AnswerCacheInvalidateRequest(BaseModel):
+    knowledge_id: Optional[int] = None
+    source_file: Optional[str] = None  # 为空表示整个知识
 
 @app.get("/")
 def read_root():
@@ -250,6 +361,11 @@ def _find_soffice_path() -> Optional[str]:
 
 def convert_with_libreoffice_safe(src_path: str, timeout_sec: int = 180, out_dir: Optional[str] = None) -> str:
     """使用LibreOffice将任意Office文档转为PDF，输出到临时文件夹，返回PDF路径。"""
+    # 优先交给常驻进程池，避免每个文件都冷启动soffice
+    pool = get_libreoffice_pool()
+    if pool is not None:
+        return pool.convert(src_path, out_dir=out_dir, timeout=timeout_sec)
+
     soffice = _find_soffice_path()
     if not soffice:
         raise RuntimeError("未找到LibreOffice的soffice.exe，请安装或配置PATH后重试")
@@ -283,44 +399,25 @@ def convert_with_libreoffice_safe(src_path: str, timeout_sec: int = 180, out_dir
     return os.path.join(out_dir, pdfs[0])
 
 def create_simple_pdf_from_txt(src_path: str, out_path: Optional[str] = None) -> str:
-    """TXT 降级方案：将文本简单排版写入单页/多页PDF，便于坐标回显。"""
-    with open(src_path, 'r', encoding='utf-8', errors='ignore') as f:
-        text = f.read()
+    """TXT 降级方案：将文本逐行排版写入多页PDF，便于坐标回显。"""
     out_pdf = out_path or tempfile.mktemp(suffix='.pdf')
-    os.makedirs(os.path.dirname(out_pdf), exist_ok=True)
-    doc = fitz.open()
-    # 解决中文显示为问号：嵌入系统CJK字体（优先微软雅黑 / 宋体 / 黑体）
-    def _register_cjk_font(_doc: fitz.Document) -> str:
-        try:
-            candidates = [
-                r"C:\\Windows\\Fonts\\msyh.ttc",
-                r"C:\\Windows\\Fonts\\msyh.ttf",
-                r"C:\\Windows\\Fonts\\simsun.ttc",
-                r"C:\\Windows\\Fonts\\simhei.ttf",
-            ]
-            for p in candidates:
-                if os.path.exists(p):
-                    _doc.insert_font(fontname="CJK", fontfile=p)
-                    return "CJK"
-        except Exception:
-            pass
-        return "helv"
-    cjk_font = _register_cjk_font(doc)
-    page = doc.new_page(width=595, height=842)
-    rect = fitz.Rect(40, 50, 555, 800)
-    page.insert_textbox(rect, text[:50000], fontsize=11, fontname=cjk_font, align=0)
-    doc.save(out_pdf)
-    doc.close()
+    render_text_lines(iter_text_file_lines(src_path), out_pdf)
     return out_pdf
 
 # ===== 持久化存储的转换PDF路径 =====
-CONVERTED_PDF_ROOT = os.path.join(os.path.dirname(__file__), 'static', 'converted')
+CONVERTED_PDF_ROOT = CONVERTED_PDF_CONFIG["root"]
+
+# 转换器标识：参与转换PDF缓存的key，渲染逻辑变化时需同步修改
+DOCX_PDF_CONVERTER = "docx-flow-v2"
+TXT_PDF_CONVERTER = "txt-flow-v2"
+PPTX_PDF_CONVERTER = "pptx-simple-v2"
+LIBREOFFICE_PDF_CONVERTER = "libreoffice-v1"
+XLSX_PDF_CONVERTER = "xlsx-libreoffice-v1"
 
 def build_converted_pdf_path(knowledge_id: int, original_filename: str) -> str:
-    base = Path(original_filename).stem + '.pdf'
-    target_dir = os.path.join(CONVERTED_PDF_ROOT, str(knowledge_id))
-    os.makedirs(target_dir, exist_ok=True)
-    return os.path.join(target_dir, base)
+    target = viewer_pdf_path(CONVERTED_PDF_ROOT, knowledge_id, original_filename)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    return target
 
 def preprocess_xlsx_for_better_pdf(src_path: str) -> Optional[str]:
     """
@@ -329,190 +426,6 @@ def preprocess_xlsx_for_better_pdf(src_path: str) -> Optional[str]:
     """
     if not OPENPYXL_AVAILABLE:
         return None
-
-# ===== Excel 原生解析，不转PDF =====
-def parse_excel_native(file_path: str, filename: str, knowledge_id: int) -> List[Document]:
-    if not OPENPYXL_AVAILABLE:
-        raise RuntimeError("缺少openpyxl，无法原生解析Excel。请安装: pip install openpyxl")
-    wb = load_workbook(file_path, data_only=True)
-    chunks: List[Document] = []
-
-    # 构建每个sheet的虚拟坐标网格
-    for sheet_idx, ws in enumerate(wb.worksheets):
-        # 列宽、行高 → 像素近似（Excel宽度单位转像素，这里做简单近似）
-        col_widths = []
-        for col in ws.columns:
-            # openpyxl列宽在 ws.column_dimensions[col_letter].width
-            break
-        # 收集列宽（若未设置，给默认 8.43 字符宽 ≈ 64px）
-        from openpyxl.utils import get_column_letter
-        max_col = ws.max_column
-        max_row = ws.max_row
-        for c in range(1, max_col + 1):
-            letter = get_column_letter(c)
-            cw = ws.column_dimensions.get(letter).width if ws.column_dimensions.get(letter) and ws.column_dimensions.get(letter).width else 8.43
-            # 近似：1字符宽≈7.5px
-            col_widths.append(float(cw) * 7.5)
-        row_heights = []
-        for r in range(1, max_row + 1):
-            rh = ws.row_dimensions.get(r).height if ws.row_dimensions.get(r) and ws.row_dimensions.get(r).height else 15.0
-            # 近似：1pt≈1.33px，Excel默认行高≈15pt
-            row_heights.append(float(rh) * 1.33)
-
-        # 前缀和得到各列x、各行y起点
-        x_starts = [0.0]
-        for w in col_widths:
-            x_starts.append(x_starts[-1] + w)
-        y_starts = [0.0]
-        for h in row_heights:
-            y_starts.append(y_starts[-1] + h)
-
-        # 构建单元格positions
-        positions: List[Dict] = []
-        for r in range(1, max_row + 1):
-            for c in range(1, max_col + 1):
-                cell = ws.cell(row=r, column=c)
-                text = str(cell.value) if cell.value is not None else ""
-                if not text.strip():
-                    continue
-                # 合并单元格处理：取所属合并区的外接矩形
-                merged_bbox = None
-                for rng in ws.merged_cells.ranges:
-                    if (r, c) in rng.cells:
-                        min_row, min_col, max_row_, max_col_ = rng.min_row, rng.min_col, rng.max_row, rng.max_col
-                        x0 = x_starts[min_col - 1]
-                        y0 = y_starts[min_row - 1]
-                        x1 = x_starts[max_col_]
-                        y1 = y_starts[max_row_]
-                        merged_bbox = [x0, y0, x1, y1]
-                        break
-                if merged_bbox:
-                    bbox = merged_bbox
-                else:
-                    x0 = x_starts[c - 1]
-                    y0 = y_starts[r - 1]
-                    x1 = x_starts[c]
-                    y1 = y_starts[r]
-                    bbox = [x0, y0, x1, y1]
-
-                positions.append({
-                    "text": text.strip(),
-                    "bbox": bbox,
-                    "sheet": ws.title,
-                    "row": r,
-                    "col": c,
-                })
-
-        # 生成纯文本内容（按行拼接）
-        lines = []
-        for r in range(1, max_row + 1):
-            vals = []
-            for c in range(1, max_col + 1):
-                val = ws.cell(row=r, column=c).value
-                vals.append("" if val is None else str(val))
-            lines.append("\t".join(vals).rstrip())
-        all_text = "\n".join(lines)
-
-        # 分块（按字符）
-        splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len,
-        )
-        text_chunks = splitter.split_text(all_text)
-
-        # 将positions按文本包含关系分配给chunk
-        for chunk_idx, chunk_text in enumerate(text_chunks):
-            chunk_positions = []
-            # 简单包含匹配：单元格文本在chunk中出现则纳入（大多数表格有效）
-            for p in positions:
-                t = p["text"]
-                if t and t in chunk_text:
-                    chunk_positions.append(p)
-
-            # 计算块级bbox：所有单元格bbox并集（同一sheet）
-            if chunk_positions:
-                x0 = min(pp["bbox"][0] for pp in chunk_positions)
-                y0 = min(pp["bbox"][1] for pp in chunk_positions)
-                x1 = max(pp["bbox"][2] for pp in chunk_positions)
-                y1 = max(pp["bbox"][3] for pp in chunk_positions)
-                bbox = [x0, y0, x1, y1]
-            else:
-                bbox = [0, 0, 0, 0]
-
-            chunks.append(Document(
-                page_content=chunk_text,
-                metadata={
-                    "knowledge_id": knowledge_id,
-                    "source_file": filename,
-                    "page_num": sheet_idx + 1,  # 将 sheet 当作“页”
-                    "chunk_index": len(chunks),
-                    "positions": chunk_positions,
-                    "bbox": bbox,
-                    "document_name": filename,
-                    "document_type": "表格",
-                    "sheet_name": ws.title,
-                    "keywords": extract_keywords_from_content(chunk_text),
-                }
-            ))
-
-    return chunks
-
-# ===== TXT 原生解析，不转PDF =====
-def parse_txt_native(file_path: str, filename: str, knowledge_id: int) -> List[Document]:
-    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-        content = f.read()
-    # 归一化换行
-    content = content.replace('\r\n', '\n').replace('\r', '\n')
-    lines = content.split('\n')
-
-    # 行级positions（不做真实像素坐标，记录行列与字符区间）
-    positions: List[Dict] = []
-    global_pos = 0
-    for i, line in enumerate(lines, start=1):
-        text = line
-        start = global_pos
-        end = start + len(text)
-        positions.append({
-            "text": text,
-            "line_no": i,
-            "char_start": start,
-            "char_end": end,
-        })
-        global_pos = end + 1  # 计入换行
-
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-        length_function=len,
-    )
-    text_chunks = splitter.split_text(content)
-
-    chunks: List[Document] = []
-    for idx, chunk_text in enumerate(text_chunks):
-        # 为chunk分配行段positions
-        chunk_positions = []
-        # 通过字符范围粗匹配（行文本在chunk中出现时纳入）
-        for p in positions:
-            t = p["text"]
-            if t and t in chunk_text:
-                chunk_positions.append(p)
-        chunks.append(Document(
-            page_content=chunk_text,
-            metadata={
-                "knowledge_id": knowledge_id,
-                "source_file": filename,
-                "page_num": 1,
-                "chunk_index": idx,
-                "positions": chunk_positions,
-                "bbox": [],  # 文本视图通常不需要像素坐标
-                "document_name": filename,
-                "document_type": "文本",
-                "keywords": extract_keywords_from_content(chunk_text),
-            }
-        ))
-
-    return chunks
     try:
         wb = load_workbook(src_path, data_only=True)
         for ws in wb.worksheets:
@@ -544,123 +457,147 @@ def parse_txt_native(file_path: str, filename: str, knowledge_id: int) -> List[D
         logger.warning(f"Excel预处理失败，使用原文件转换: {e}")
         return None
 
-# ===== DOCX 原生解析与PDF生成（不依赖外部工具） =====
-def create_simple_pdf_from_docx(src_path: str, out_path: str) -> tuple[str, List[Dict]]:
-    """将DOCX内容简单排版生成PDF，并返回 (pdf_path, paragraph_positions)。
-    每个段落在PDF中的放置矩形作为其bbox，供后续可视化使用。
-    """
-    if not DOCX_AVAILABLE:
-        raise RuntimeError("缺少python-docx，无法原生解析Word。请安装: pip install python-docx")
+def create_viewer_pdf_from_xlsx(src_path: str, out_path: str) -> None:
+    """Excel回显PDF：分页优化后的临时副本经LibreOffice转换（切分不依赖该PDF）"""
+    prepared = preprocess_xlsx_for_better_pdf(src_path)
+    try:
+        converted = convert_with_libreoffice_safe(prepared or src_path, out_dir=os.path.dirname(out_path))
+        if os.path.abspath(converted) != os.path.abspath(out_path):
+            shutil.move(converted, out_path)
+    finally:
+        if prepared and os.path.exists(prepared):
+            os.unlink(prepared)
 
-    docx = DocxDocument(src_path)
-    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+# ===== Excel 原生解析，不转PDF =====
+def parse_excel_native(file_path: str, filename: str, knowledge_id: int) -> List[Document]:
+    """流式读取工作簿并按行窗口切分，内存占用与表格行数无关"""
+    chunks: List[Document] = []
+    for sheet_idx, sheet_name, chunk_text, chunk_positions, bbox in iter_excel_chunks(file_path):
+        chunks.append(Document(
+            page_content=chunk_text,
+            metadata={
+                "knowledge_id": knowledge_id,
+                "source_file": filename,
+                "page_num": sheet_idx + 1,  # 将 sheet 当作“页”
+                "chunk_index": len(chunks),
+                "positions": chunk_positions,
+                "bbox": bbox,
+                "document_name": filename,
+                "document_type": "表格",
+                "sheet_name": sheet_name,
+                "keywords": extract_keywords_from_content(chunk_text),
+            }
+        ))
+    return chunks
 
-    pdf = fitz.open()
-    def _register_cjk_font(_doc: fitz.Document) -> str:
-        try:
-            candidates = [
-                r"C:\\Windows\\Fonts\\msyh.ttc",
-                r"C:\\Windows\\Fonts\\msyh.ttf",
-                r"C:\\Windows\\Fonts\\simsun.ttc",
-                r"C:\\Windows\\Fonts\\simhei.ttf",
-            ]
-            for p in candidates:
-                if os.path.exists(p):
-                    _doc.insert_font(fontname="CJK", fontfile=p)
-                    return "CJK"
-        except Exception:
-            pass
-        return "helv"
-    cjk_font = _register_cjk_font(pdf)
-    page_width, page_height = 595.0, 842.0  # A4 72dpi points
-    margin_left, margin_right, margin_top, margin_bottom = 40.0, 40.0, 50.0, 50.0
-    usable_width = page_width - margin_left - margin_right
-    cursor_y = margin_top
-
-    paragraph_positions: List[Dict] = []
-
-    # 新建第一页
-    page = pdf.new_page(width=page_width, height=page_height)
-
-    def new_page_if_needed(height_needed: float):
-        nonlocal page, cursor_y
-        if cursor_y + height_needed > (page_height - margin_bottom):
-            page = pdf.new_page(width=page_width, height=page_height)
-            cursor_y = margin_top
-
-    def draw_paragraph(text: str):
-        nonlocal cursor_y
-        if not text.strip():
-            cursor_y += 8.0
-            return
-        # 预估高度：用一个较高的矩形，插入后不读取残留，靠换页控制
-        rect = fitz.Rect(margin_left, cursor_y, margin_left + usable_width, cursor_y + 200.0)
-        new_page_if_needed(rect.height)
-        rect = fitz.Rect(margin_left, cursor_y, margin_left + usable_width, cursor_y + 200.0)
-        page.insert_textbox(rect, text, fontsize=11, fontname=cjk_font, align=0)
-        # 粗略估算占用高度：按文本长度估计行数
-        approx_chars_per_line = 90
-        lines = max(1, (len(text) // approx_chars_per_line) + 1)
-        used_h = 14.0 * lines
-        bbox = [rect.x0, rect.y0, rect.x1, rect.y0 + used_h]
-        paragraph_positions.append({"text": text, "bbox": bbox, "page": len(pdf)})
-        cursor_y += used_h + 6.0
-
-    # 段落
-    for p in docx.paragraphs:
-        draw_paragraph(p.text)
-
-    # 表格（将每个单元格作为独立小段落）
-    for table in docx.tables:
-        for row in table.rows:
-            cells_text = [c.text.strip() for c in row.cells]
-            row_text = "\t".join(cells_text)
-            draw_paragraph(row_text)
-
-    pdf.save(out_path)
-    pdf.close()
-    return out_path, paragraph_positions
+# ===== TXT 原生解析，不转PDF =====
+def parse_txt_native(file_path: str, filename: str, knowledge_id: int) -> List[Document]:
+    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+        content = f.read()
+    # 归一化换行
+    content = content.replace('\r\n', '\n').replace('\r', '\n')
+
+    # 排版生成多页回显PDF，同时得到每行实际的页码与bbox（空行不产生记录）
+    _, meta = convert_with_cache(
+        get_converted_pdf_store(),
+        file_path,
+        int(knowledge_id) if knowledge_id else 0,
+        filename,
+        TXT_PDF_CONVERTER,
+        lambda out_path: {"positions": render_text_lines(content.split('\n'), out_path)},
+    )
+    line_positions = meta["positions"]
+
+    splits = make_text_splitter("txt").split_with_offsets(content)
+    text_chunks = [t for _, _, t in splits]
+
+    # 按字符区间为chunk分配行段positions
+    span_ranges = [(p["char_start"], p["char_end"]) for p in line_positions]
+    chunk_ranges = [(st, en) for st, en, _ in splits]
+    positions_per_chunk = assign_positions_by_offset(text_chunks, chunk_ranges, span_ranges, line_positions)
+
+    chunks: List[Document] = []
+    for idx, chunk_text in enumerate(text_chunks):
+        chunks.append(Document(
+            page_content=chunk_text,
+            metadata={
+                "knowledge_id": knowledge_id,
+                "source_file": filename,
+                "chunk_index": idx,
+                **_chunk_position_fields(positions_per_chunk[idx]),
+                "document_name": filename,
+                "document_type": "文本",
+                "keywords": extract_keywords_from_content(chunk_text),
+            }
+        ))
+
+    return chunks
+
+# ===== DOCX 原生解析与PDF生成（不依赖外部工具） =====
+def create_simple_pdf_from_docx(src_path: str, out_path: str) -> tuple[str, List[Dict], str]:
+    """将DOCX按文档顺序排版生成PDF，并返回 (pdf_path, paragraph_positions, full_text)。
+    段落与表格行的实际放置矩形作为其bbox，位置记录带有在 full_text 中的字符区间。
+    """
+    paragraph_positions, full_text = render_docx_to_pdf(src_path, out_path)
+    return out_path, paragraph_positions, full_text
+
+def _docx_render_meta(src_path: str, out_path: str) -> Dict:
+    """DOCX回显PDF渲染：元数据含段落级positions与全文，随产物缓存"""
+    _, positions, full_text = create_simple_pdf_from_docx(src_path, out_path)
+    return {"positions": positions, "text": full_text}
+
+def _chunk_position_fields(chunk_pos: List[Dict]) -> Dict:
+    """由chunk的位置记录得到 positions/bbox/page_num（page_num 取位置记录最多的页）"""
+    chunk_pos = [dict(p, page=p.get("page", 1)) for p in chunk_pos]
+    bbox = calculate_chunk_bbox(chunk_pos)
+    page_counts: Dict[int, int] = {}
+    for pp in chunk_pos:
+        pg = int(pp.get("page", 1))
+        page_counts[pg] = page_counts.get(pg, 0) + 1
+    main_page = max(page_counts.items(), key=lambda kv: kv[1])[0] if page_counts else 1
+    return {"positions": chunk_pos, "bbox": bbox, "page_num": main_page}
 
 def parse_docx_native(file_path: str, filename: str, knowledge_id: int) -> List["Document"]:
-    pdf_out = build_converted_pdf_path(int(knowledge_id) if knowledge_id else 0, filename)
-    # 生成用于可视化的简单PDF，并获取段落级positions
-    _, paragraph_positions = create_simple_pdf_from_docx(file_path, pdf_out)
+    """
+    Word原生解析：切分只依赖全文，回显PDF默认入库后再生成（见 schedule_viewer_pdf）
+    同内容的PDF已缓存或回显服务未启用时，仍在解析时取得段落级positions
+    """
+    kid = int(knowledge_id) if knowledge_id else 0
+    store = get_converted_pdf_store()
+    sha = hash_file(file_path) if store is not None else None
+    cached = store is not None and store.lookup(sha, DOCX_PDF_CONVERTER) is not None
+    if cached or get_viewer_pdf_service() is None:
+        # 生成用于可视化的PDF，并获取段落级positions（源文件内容相同时复用已生成的PDF）
+        _, meta = convert_with_cache(store, file_path, kid, filename, DOCX_PDF_CONVERTER,
+                                     lambda out_path: _docx_render_meta(file_path, out_path),
+                                     source_sha256=sha)
+        paragraph_positions = meta["positions"]
+        all_text = meta["text"]
+    else:
+        # 位置信息在回显PDF生成后按字符区间回填
+        paragraph_positions = []
+        all_text = extract_docx_text(file_path)
 
-    # 汇总内容
-    all_text = "\n".join([p["text"] for p in paragraph_positions])
+    # 位置记录自带在全文中的字符区间
+    span_ranges = [(p["char_start"], p["char_end"]) for p in paragraph_positions]
 
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-        length_function=len,
-    )
-    text_chunks = splitter.split_text(all_text)
+    splits = make_text_splitter("docx").split_with_offsets(all_text)
+    text_chunks = [t for _, _, t in splits]
+    chunk_ranges = [(st, en) for st, en, _ in splits]
+    positions_per_chunk = assign_positions_by_offset(text_chunks, chunk_ranges, span_ranges, paragraph_positions)
 
     chunks: List["Document"] = []
     for chunk_idx, chunk_text in enumerate(text_chunks):
-        chunk_pos = []
-        for p in paragraph_positions:
-            t = p.get("text") or ""
-            if t and t in chunk_text:
-                cp = dict(p)
-                # 将页号同步为page_num字段
-                cp["page"] = p.get("page", 1)
-                chunk_pos.append(cp)
-        bbox = calculate_chunk_bbox([{"bbox": pp["bbox"]} for pp in chunk_pos]) if chunk_pos else [0, 0, 0, 0]
-        page_counts: Dict[int, int] = {}
-        for pp in chunk_pos:
-            pg = int(pp.get("page", 1))
-            page_counts[pg] = page_counts.get(pg, 0) + 1
-        main_page = max(page_counts.items(), key=lambda kv: kv[1])[0] if page_counts else 1
         chunks.append(Document(
             page_content=chunk_text,
             metadata={
                 "knowledge_id": knowledge_id,
                 "source_file": filename,
-                "page_num": main_page,
                 "chunk_index": chunk_idx,
-                "positions": chunk_pos,
-                "bbox": bbox,
+                **_chunk_position_fields(positions_per_chunk[chunk_idx]),
+                # 全文中的字符区间，回填positions时使用（不写入ES）
+                "char_start": chunk_ranges[chunk_idx][0],
+                "char_end": chunk_ranges[chunk_idx][1],
                 "document_name": filename,
                 "document_type": "文档",
                 "keywords": extract_keywords_from_content(chunk_text),
@@ -680,29 +617,32 @@ def create_simple_pdf_from_pptx(src_path: str, out_path: str) -> tuple[str, List
     os.makedirs(os.path.dirname(out_path), exist_ok=True)
 
     pdf = fitz.open()
-    def _register_cjk_font(_doc: fitz.Document) -> str:
-        try:
-            candidates = [
-                r"C:\\Windows\\Fonts\\msyh.ttc",
-                r"C:\\Windows\\Fonts\\msyh.ttf",
-                r"C:\\Windows\\Fonts\\simsun.ttc",
-                r"C:\\Windows\\Fonts\\simhei.ttf",
-            ]
-            for p in candidates:
-                if os.path.exists(p):
-                    _doc.insert_font(fontname="CJK", fontfile=p)
-                    return "CJK"
-        except Exception:
-            pass
-        return "helv"
-    cjk_font = _register_cjk_font(pdf)
+    fonts = get_font_registry()
     # python-pptx 的尺寸为 Length 类型，用 int() 取 EMU 值更稳妥
     slide_w_pts = (int(prs.slide_width) / EMU_PER_INCH) * POINTS_PER_INCH
     slide_h_pts = (int(prs.slide_height) / EMU_PER_INCH) * POINTS_PER_INCH
-    positions: List[Dict] = []
+    positions = extract_pptx_shape_positions(prs)
+
+    pages = [pdf.new_page(width=slide_w_pts, height=slide_h_pts) for _ in prs.slides]
+    page_fonts: Dict[int, str] = {}
+    for pos in positions:
+        try:
+            page = pages[pos["page"] - 1]
+            if page.number not in page_fonts:
+                page_fonts[page.number] = fonts.insert_font(page)
+            # 在对应矩形内写入文本
+            page.insert_textbox(fitz.Rect(pos["bbox"]), pos["text"], fontsize=12, fontname=page_fonts[page.number], align=0)
+        except Exception:
+            continue
 
+    fonts.save(pdf, out_path, used_chars=set("".join(p["text"] for p in positions)))
+    pdf.close()
+    return out_path, positions
+
+def extract_pptx_shape_positions(prs) -> List[Dict]:
+    """文本框按幻灯片原始坐标（EMU换算为pt）得到位置记录，页码即幻灯片序号；与回显PDF的页面坐标一致"""
+    positions: List[Dict] = []
     for s_idx, slide in enumerate(prs.slides):
-        page = pdf.new_page(width=slide_w_pts, height=slide_h_pts)
         for shape in slide.shapes:
             try:
                 if not getattr(shape, "has_text_frame", False):
@@ -714,53 +654,34 @@ def create_simple_pdf_from_pptx(src_path: str, out_path: str) -> tuple[str, List
                 y0 = (int(shape.top) / EMU_PER_INCH) * POINTS_PER_INCH
                 x1 = x0 + (int(shape.width) / EMU_PER_INCH) * POINTS_PER_INCH
                 y1 = y0 + (int(shape.height) / EMU_PER_INCH) * POINTS_PER_INCH
-                rect = fitz.Rect(x0, y0, x1, y1)
-                # 在对应矩形内写入文本
-                page.insert_textbox(rect, text, fontsize=12, fontname=cjk_font, align=0)
                 positions.append({"text": text, "bbox": [x0, y0, x1, y1], "page": s_idx + 1})
             except Exception:
                 continue
-
-    pdf.save(out_path)
-    pdf.close()
-    return out_path, positions
+    return positions
 
 def parse_pptx_native(file_path: str, filename: str, knowledge_id: int) -> List["Document"]:
-    pdf_out = build_converted_pdf_path(int(knowledge_id) if knowledge_id else 0, filename)
-    _, shape_positions = create_simple_pdf_from_pptx(file_path, pdf_out)
+    """PPT原生解析：位置取自幻灯片原始坐标，不依赖回显PDF（PDF入库后再生成，见 schedule_viewer_pdf）"""
+    if not PPTX_AVAILABLE:
+        raise RuntimeError("缺少python-pptx，无法原生解析PPT。请安装: pip install python-pptx")
+    shape_positions = extract_pptx_shape_positions(PptxPresentation(file_path))
 
     # 汇总内容
-    all_text = "\n".join([p["text"] for p in shape_positions])
+    all_text, span_ranges = join_with_offsets([p["text"] for p in shape_positions])
 
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-        length_function=len,
-    )
-    text_chunks = splitter.split_text(all_text)
+    splits = make_text_splitter("pptx").split_with_offsets(all_text)
+    text_chunks = [t for _, _, t in splits]
+    chunk_ranges = [(st, en) for st, en, _ in splits]
+    positions_per_chunk = assign_positions_by_offset(text_chunks, chunk_ranges, span_ranges, shape_positions)
 
     chunks: List["Document"] = []
     for idx, chunk_text in enumerate(text_chunks):
-        chunk_pos = []
-        for p in shape_positions:
-            t = p.get("text") or ""
-            if t and t in chunk_text:
-                chunk_pos.append(dict(p))
-        bbox = calculate_chunk_bbox([{"bbox": pp["bbox"]} for pp in chunk_pos]) if chunk_pos else [0, 0, 0, 0]
-        page_counts: Dict[int, int] = {}
-        for pp in chunk_pos:
-            pg = int(pp.get("page", 1))
-            page_counts[pg] = page_counts.get(pg, 0) + 1
-        main_page = max(page_counts.items(), key=lambda kv: kv[1])[0] if page_counts else 1
         chunks.append(Document(
             page_content=chunk_text,
             metadata={
                 "knowledge_id": knowledge_id,
                 "source_file": filename,
-                "page_num": main_page,
                 "chunk_index": idx,
-                "positions": chunk_pos,
-                "bbox": bbox,
+                **_chunk_position_fields(positions_per_chunk[idx]),
                 "document_name": filename,
                 "document_type": "演示文稿",
                 "keywords": extract_keywords_from_content(chunk_text),
@@ -795,139 +716,36 @@ def process_document_unified(
     description: Optional[str] = None,
     tags: Optional[str] = None,
     effective_time: Optional[str] = None,
+    file_sha256: Optional[str] = None,
 ) -> Dict:
     """
     统一处理文档：
     - 非PDF先转换为PDF（优先使用LibreOffice），不改动原始文件
     - 基于PDF用PyMuPDF提取块级坐标并分块
+    - Word/PPT/Excel 原生解析后直接入库，回显PDF入库后再生成
     """
     try:
-        # 1) 非PDF → PDF（不改动原始文件，仅生成临时PDF用于定位与回显）
-        ext = Path(filename).suffix.lower()
-        pdf_path_to_open = file_path
-        temp_generated_pdf = None
-
-        if ext in {'.xlsx', '.xls'}:
-            # Excel 原生解析
-            chunks = parse_excel_native(file_path, filename, knowledge_id)
-        elif ext == '.txt':
-            # TXT 原生解析
-            chunks = parse_txt_native(file_path, filename, knowledge_id)
-        elif ext in {'.doc', '.docx'}:
-            # Word 原生解析
-            chunks = parse_docx_native(file_path, filename, knowledge_id)
-            # 使用我们生成的简易PDF供回显
-            target_pdf = build_converted_pdf_path(int(knowledge_id) if knowledge_id else 0, filename)
-            pdf_path_to_open = target_pdf
-        elif ext in {'.ppt', '.pptx'}:
-            # PPT 原生解析
-            chunks = parse_pptx_native(file_path, filename, knowledge_id)
-            target_pdf = build_converted_pdf_path(int(knowledge_id) if knowledge_id else 0, filename)
-            pdf_path_to_open = target_pdf
-        elif ext != '.pdf':
-            # 其他Office类型仍尝试转为PDF（如需）
-            target_pdf = build_converted_pdf_path(int(knowledge_id) if knowledge_id else 0, filename)
-            try:
-                target_dir = os.path.dirname(target_pdf)
-                src_for_convert = file_path
-                pdf_path_to_open = convert_with_libreoffice_safe(src_for_convert, out_dir=target_dir)
-                if os.path.abspath(pdf_path_to_open) != os.path.abspath(target_pdf):
-                    shutil.copyfile(pdf_path_to_open, target_pdf)
-                    pdf_path_to_open = target_pdf
-                logger.info(f"已将 {filename} 转为PDF: {pdf_path_to_open}")
-            except Exception as e:
-                if ext == '.txt':
-                    pdf_path_to_open = create_simple_pdf_from_txt(file_path, out_path=target_pdf)
-                    logger.info(f"TXT降级转PDF成功: {pdf_path_to_open}")
-                else:
-                    raise
-
-        # 2) 基于PDF走统一解析
-        doc = fitz.open(pdf_path_to_open)
-        try:
-            logger.info(f"成功打开文档，页数: {len(doc)}")
-
-            documents = extract_documents_with_block_positions(doc, filename)
-
-            all_content = ""
-            all_positions = []
-            for doc_info in documents:
-                all_content += doc_info["content"] + "\n"
-                all_positions.extend(doc_info["positions"])
-
-            logger.info(f"合并后总内容长度: {len(all_content)} 字符")
-            logger.info(f"合并后总位置信息数量: {len(all_positions)}")
-
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=1000,
-                chunk_overlap=200,
-                length_function=len,
-            )
-
-            text_chunks = text_splitter.split_text(all_content)
-            logger.info(f"LangChain分割后生成 {len(text_chunks)} 个chunks")
-
-            chunks = []
-            for chunk_idx, chunk_text in enumerate(text_chunks):
-                chunk_positions = assign_positions_to_chunk(chunk_text, all_positions)
-
-                page_counts: Dict[int, int] = {}
-                for p in chunk_positions:
-                    pg = int(p.get('page', 1))
-                    page_counts[pg] = page_counts.get(pg, 0) + 1
-                main_page = max(page_counts.items(), key=lambda kv: kv[1])[0] if page_counts else 1
-
-                chunk = Document(
-                    page_content=chunk_text,
-                    metadata={
-                        "knowledge_id": knowledge_id,
-                        "source_file": filename,
-                        "page_num": main_page,
-                        "chunk_index": chunk_idx,
-                        "positions": chunk_positions,
-                        "bbox": calculate_chunk_bbox(chunk_positions),
-                        "document_name": filename,
-                        "document_type": "文档",
-                        "keywords": extract_keywords_from_content(chunk_text),
-                        # 协同到ES
-                        "knowledge_name": knowledge_name or "",
-                        "description": description or "",
-                        "tags": tags or "",
-                        "effective_time": effective_time or "",
-                    }
-                )
-                chunks.append(chunk)
-        finally:
-            try:
-                doc.close()
-            except Exception:
-                pass
-            # 不删除持久化PDF，供前端下载/回显
-        
-        # 为Excel/TXT等原生解析生成的chunk补齐知识元数据字段
-        try:
-            for ch in chunks:
-                md = ch.metadata
-                if "knowledge_name" not in md:
-                    md["knowledge_name"] = knowledge_name or ""
-                if "description" not in md:
-                    md["description"] = description or ""
-                if "tags" not in md:
-                    md["tags"] = tags or ""
-                if "effective_time" not in md:
-                    md["effective_time"] = effective_time or ""
-        except Exception:
-            pass
+        chunks = build_document_chunks(
+            file_path,
+            filename,
+            knowledge_id,
+            knowledge_name=knowledge_name,
+            description=description,
+            tags=tags,
+            effective_time=effective_time,
+        )
 
-        logger.info(f"最终生成 {len(chunks)} 个chunks")
-        
         # 存储到ES
-        stored_count = store_chunks_to_es(chunks, knowledge_id)
+        stored = write_chunks_to_es(chunks, knowledge_id)
+        stored_count = stored["stored_count"]
+        if stored_count > 0:
+            schedule_viewer_pdf(file_path, filename, knowledge_id, chunks, file_sha256=file_sha256)
         
         return {
             "chunks_count": stored_count,
             "total_chunks": len(chunks),
-            "success": stored_count > 0
+            "success": stored_count > 0,
+            "chunk_ids": stored["chunk_ids"]
         }
         
     except Exception as e:
@@ -936,58 +754,172 @@ def process_document_unified(
         traceback.print_exc()
         raise e
 
-def extract_documents_with_block_positions(doc, filename: str) -> List[Dict]:
+def build_document_chunks(
+    file_path: str,
+    filename: str,
+    knowledge_id: int,
+    knowledge_name: Optional[str] = None,
+    description: Optional[str] = None,
+    tags: Optional[str] = None,
+    effective_time: Optional[str] = None,
+) -> List[Document]:
     """
-    直接从PyMuPDF提取文档块和位置信息
+    文档转换、解析与切分（不含向量化与入库），供同步处理与后台任务的解析阶段复用
     """
-    documents = []
+    # 1) 非PDF → PDF（不改动原始文件，仅生成临时PDF用于定位与回显）
+    ext = Path(filename).suffix.lower()
+    pdf_path_to_open = file_path
+    temp_generated_pdf = None
+    chunks = None
+
+    if ext in {'.xlsx', '.xls'}:
+        # Excel 原生解析
+        chunks = parse_excel_native(file_path, filename, knowledge_id)
+    elif ext == '.txt':
+        # TXT 原生解析
+        chunks = parse_txt_native(file_path, filename, knowledge_id)
+    elif ext in {'.doc', '.docx'}:
+        # Word 原生解析
+        chunks = parse_docx_native(file_path, filename, knowledge_id)
+    elif ext in {'.ppt', '.pptx'}:
+        # PPT 原生解析
+        chunks = parse_pptx_native(file_path, filename, knowledge_id)
+    elif ext != '.pdf':
+        # 其他Office类型仍尝试转为PDF（如需）
+        target_pdf = build_converted_pdf_path(int(knowledge_id) if knowledge_id else 0, filename)
+        try:
+            def _convert(out_path: str):
+                converted = convert_with_libreoffice_safe(file_path, out_dir=os.path.dirname(out_path))
+                if os.path.abspath(converted) != os.path.abspath(out_path):
+                    shutil.move(converted, out_path)
+
+            pdf_path_to_open, _ = convert_with_cache(
+                get_converted_pdf_store(),
+                file_path,
+                int(knowledge_id) if knowledge_id else 0,
+                filename,
+                LIBREOFFICE_PDF_CONVERTER,
+                _convert,
+            )
+            logger.info(f"已将 {filename} 转为PDF: {pdf_path_to_open}")
+        except Exception as e:
+            if ext == '.txt':
+                pdf_path_to_open = create_simple_pdf_from_txt(file_path, out_path=target_pdf)
+                logger.info(f"TXT降级转PDF成功: {pdf_path_to_open}")
+            else:
+                raise
+
+    # 2) 基于PDF走统一解析（原生解析的类型已生成chunks，不再重复解析）
+    if chunks is None:
+        chunks = build_chunks_from_pdf(
+            pdf_path_to_open,
+            filename,
+            knowledge_id,
+            knowledge_name=knowledge_name,
+            description=description,
+            tags=tags,
+            effective_time=effective_time,
+        )
 
-    for page_num in range(len(doc)):
-        page = doc.load_page(page_num)
-        blocks = page.get_text("dict")
-
-        for block_idx, block in enumerate(blocks["blocks"]):
-            if "lines" in block:
-                # 收集整个块的所有文本和位置信息
-                block_text = ""
-                block_positions = []
-
-                for line_idx, line in enumerate(block["lines"]):
-                    for span_idx, span in enumerate(line["spans"]):
-                        text = span["text"].strip()
-                        if text:
-                            block_text += text + " "
-                            block_positions.append({
-                                "text": text,
-                                "bbox": span["bbox"],
-                                "font_size": span["size"],
-                                "font": span["font"],
-                                "span_idx": span_idx,
-                                "line_idx": line_idx,
-                                "page": page_num + 1,
-                            })
-
-                if block_text.strip():
-                    # 计算整个块的边界框（内联实现）
-                    if block_positions:
-                        bx0 = min(p["bbox"][0] for p in block_positions)
-                        by0 = min(p["bbox"][1] for p in block_positions)
-                        bx1 = max(p["bbox"][2] for p in block_positions)
-                        by1 = max(p["bbox"][3] for p in block_positions)
-                        block_bbox = [bx0, by0, bx1, by1]
-                    else:
-                        block_bbox = [0, 0, 0, 0]
-
-                    documents.append({
-                        "content": block_text.strip(),
-                        "page": page_num + 1,
-                        "block_idx": block_idx,
-                        "positions": block_positions,
-                        "bbox": block_bbox
-                    })
-
-    return documents
+    # 为Excel/TXT等原生解析生成的chunk补齐知识元数据字段
+    try:
+        for ch in chunks:
+            md = ch.metadata
+            if "knowledge_name" not in md:
+                md["knowledge_name"] = knowledge_name or ""
+            if "description" not in md:
+                md["description"] = description or ""
+            if "tags" not in md:
+                md["tags"] = tags or ""
+            if "effective_time" not in md:
+                md["effective_time"] = effective_time or ""
+    except Exception:
+        pass
+
+    logger.info(f"最终生成 {len(chunks)} 个chunks")
+    return chunks
+
+def build_chunks_from_pdf(
+    pdf_path: str,
+    filename: str,
+    knowledge_id: int,
+    knowledge_name: Optional[str] = None,
+    description: Optional[str] = None,
+    tags: Optional[str] = None,
+    effective_time: Optional[str] = None,
+) -> List[Document]:
+    """基于PDF的块级坐标提取与分块"""
+    doc = fitz.open(pdf_path)
+    try:
+        logger.info(f"成功打开文档，页数: {len(doc)}")
+
+        documents = extract_documents_with_block_positions(doc, filename)
+
+        # 拼接全文并记录每个span的字符区间：块内span以空格相连，块之间以换行相连
+        content_parts = []
+        all_positions = []
+        span_ranges = []
+        offset = 0
+        for doc_info in documents:
+            if not doc_info["content"]:
+                # 图片块等无文本的条目不参与拼接
+                continue
+            content_parts.append(doc_info["content"] + "\n")
+            pos = offset
+            for p in doc_info["positions"]:
+                span_ranges.append((pos, pos + len(p["text"])))
+                pos += len(p["text"]) + 1
+            all_positions.extend(doc_info["positions"])
+            offset += len(doc_info["content"]) + 1
+        all_content = "".join(content_parts)
+
+        logger.info(f"合并后总内容长度: {len(all_content)} 字符")
+        logger.info(f"合并后总位置信息数量: {len(all_positions)}")
+
+        splits = make_text_splitter("pdf").split_with_offsets(all_content)
+        text_chunks = [t for _, _, t in splits]
+        logger.info(f"分块后生成 {len(text_chunks)} 个chunks")
+
+        chunk_ranges = [(st, en) for st, en, _ in splits]
+        positions_per_chunk = assign_positions_by_offset(text_chunks, chunk_ranges, span_ranges, all_positions)
+
+        chunks = []
+        for chunk_idx, chunk_text in enumerate(text_chunks):
+            chunk_positions = positions_per_chunk[chunk_idx]
 
+            page_counts: Dict[int, int] = {}
+            for p in chunk_positions:
+                pg = int(p.get('page', 1))
+                page_counts[pg] = page_counts.get(pg, 0) + 1
+            main_page = max(page_counts.items(), key=lambda kv: kv[1])[0] if page_counts else 1
+
+            chunk = Document(
+                page_content=chunk_text,
+                metadata={
+                    "knowledge_id": knowledge_id,
+                    "source_file": filename,
+                    "page_num": main_page,
+                    "chunk_index": chunk_idx,
+                    "positions": chunk_positions,
+                    "bbox": calculate_chunk_bbox(chunk_positions),
+                    "document_name": filename,
+                    "document_type": "文档",
+                    "keywords": extract_keywords_from_content(chunk_text),
+                    # 协同到ES
+                    "knowledge_name": knowledge_name or "",
+                    "description": description or "",
+                    "tags": tags or "",
+                    "effective_time": effective_time or "",
+                }
+            )
+            chunks.append(chunk)
+    finally:
+        try:
+            doc.close()
+        except Exception:
+            pass
+        # 不删除持久化PDF，供前端下载/回显
+    return chunks
 
 def assign_positions_to_chunk(chunk_text: str, positions: List[Dict]) -> List[Dict]:
     """
@@ -1026,17 +958,19 @@ def calculate_chunk_bbox(positions: List[Dict]) -> List[float]:
 
     return [x0, y0, x1, y1]
 
-def generate_pdfllm_style_markdown(doc, filename: str) -> tuple[str, List[Dict]]:
+def generate_pdfllm_style_markdown(doc, filename: str) -> tuple[str, SpanTable]:
     """
     使用PyMuPDF生成干净的Markdown内容和精确的文本-坐标映射
-    返回: (markdown_content, position_mapping)
+    返回: (markdown_content, position_mapping)，position_mapping 为列式span表，逐项可按dict读取
     """
     content_lines = []
-    position_mapping = []
+    position_mapping = SpanTable(with_fonts=True)
     
     # 添加文档标题
     content_lines.append(f"# {filename}")
     content_lines.append("")
+    # 标题识别需要字号
+    profile = select_extract_profile(filename, need_fonts=True)
     
     for page_num in range(len(doc)):
         page = doc.load_page(page_num)
@@ -1046,17 +980,15 @@ def generate_pdfllm_style_markdown(doc, filename: str) -> tuple[str, List[Dict]]
         content_lines.append("")
         
         # 获取页面文本块
-        blocks = page.get_text("dict")
+        blocks = get_page_dict(page, profile)
         
         if "blocks" in blocks:
             for block_idx, block in enumerate(blocks["blocks"]):
                 if "lines" in block:
                     block_text = ""
-                    block_positions = []
                     
                     for line_idx, line in enumerate(block["lines"]):
                         line_text = ""
-                        line_positions = []
                         
                         for span_idx, span in enumerate(line["spans"]):
                             text = span["text"].strip()
@@ -1064,23 +996,12 @@ def generate_pdfllm_style_markdown(doc, filename: str) -> tuple[str, List[Dict]]
                                 # 只添加文本内容，不添加位置标签
                                 line_text += text + " "
                                 
-                                # 记录位置信息
-                                line_positions.append({
-                                    "text": text,
-                                    "page": page_num + 1,
-                                    "bbox": span["bbox"],
-                                    "font_size": span["size"],
-                                    "font": span["font"],
-                                    "block_idx": block_idx,
-                                    "line_idx": line_idx,
-                                    "span_idx": span_idx,
-                                    "char_start": len("".join(content_lines)),  # 在最终文本中的起始位置
-                                    "char_end": len("".join(content_lines)) + len(text)  # 在最终文本中的结束位置
-                                })
+                                # 记录位置信息（写入span表）
+                                position_mapping.append(text, span["bbox"], page_num + 1, block_idx, line_idx, span_idx,
+                                                        font=span["font"], font_size=span["size"])
                         
                         if line_text.strip():
                             block_text += line_text.strip() + "\n"
-                            block_positions.extend(line_positions)
                     
                     if block_text.strip():
                         # 检查是否可能是标题（基于字体大小）
@@ -1090,32 +1011,29 @@ def generate_pdfllm_style_markdown(doc, filename: str) -> tuple[str, List[Dict]]
                         else:
                             content_lines.append(block_text.strip())
                         content_lines.append("")
-                        
-                        # 添加位置信息到映射
-                        position_mapping.extend(block_positions)
     
     # 合并所有内容
     markdown_content = "\n".join(content_lines)
     
     # 更新字符位置（因为换行符等会影响位置）
     current_pos = 0
-    for pos_info in position_mapping:
-        text = pos_info["text"]
-        pos_info["char_start"] = current_pos
-        pos_info["char_end"] = current_pos + len(text)
-        current_pos += len(text) + 1  # +1 for space
+    for i in range(len(position_mapping)):
+        text_len = position_mapping.text_len(i)
+        position_mapping.set_char_range(i, current_pos, current_pos + text_len)
+        current_pos += text_len + 1  # +1 for space
     
     return markdown_content, position_mapping
 
-def extract_position_mapping(doc) -> List[Dict]:
+def extract_position_mapping(doc) -> SpanTable:
     """
-    单独提取位置信息映射，不嵌入到文本内容中
+    单独提取位置信息映射，不嵌入到文本内容中（列式span表，逐项可按dict读取）
     """
-    position_mapping = []
+    position_mapping = SpanTable(with_fonts=True)
+    profile = select_extract_profile(getattr(doc, "name", "") or "", need_fonts=True)
     
     for page_num in range(len(doc)):
         page = doc.load_page(page_num)
-        blocks = page.get_text("dict")
+        blocks = get_page_dict(page, profile)
         
         if "blocks" in blocks:
             for block_idx, block in enumerate(blocks["blocks"]):
@@ -1124,16 +1042,8 @@ def extract_position_mapping(doc) -> List[Dict]:
                         for span_idx, span in enumerate(line["spans"]):
                             text = span["text"].strip()
                             if text:
-                                position_mapping.append({
-                                    "text": text,
-                                    "page": page_num + 1,
-                                    "bbox": span["bbox"],
-                                    "font_size": span["size"],
-                                    "font": span["font"],
-                                    "block_idx": block_idx,
-                                    "line_idx": line_idx,
-                                    "span_idx": span_idx
-                                })
+                                position_mapping.append(text, span["bbox"], page_num + 1, block_idx, line_idx, span_idx,
+                                                        font=span["font"], font_size=span["size"])
     
     return position_mapping
 
@@ -1268,55 +1178,480 @@ def find_best_position_match_block_level(chunk_text: str, position_mapping: List
     
     return best_match
 
+def _chunk_metadata_fields(chunk: Document, knowledge_id: int, i: int) -> Dict:
+    """chunk写入ES的元数据字段（不含content与embedding）"""
+    return {
+        "knowledge_id": chunk.metadata.get("knowledge_id", knowledge_id),
+        "knowledge_name": chunk.metadata.get("knowledge_name", ""),
+        "description": chunk.metadata.get("description", ""),
+        "tags": chunk.metadata.get("tags", ""),
+        "effective_time": chunk.metadata.get("effective_time", ""),
+        "source_file": chunk.metadata.get("source_file", ""),
+        "chunk_index": chunk.metadata.get("chunk_index", i),
+        "chunk_type": chunk.metadata.get("chunk_type", "content"),
+        "page_num": chunk.metadata.get("page_num", 1),
+        "bbox": chunk.metadata.get("bbox", []),
+        "positions": positions_to_dicts(chunk.metadata.get("positions", [])),
+    }
+
 def store_chunks_to_es(chunks: List[Document], knowledge_id: int):
     """
-    将chunks存储到Elasticsearch
+    将chunks存储到Elasticsearch，返回成功存储的数量
     """
-    stored_count = 0
-    
-    for i, chunk in enumerate(chunks):
-        try:
-            # 生成文档ID
-            doc_id = hashlib.md5(f"{knowledge_id}_{i}_{chunk.page_content[:100]}".encode()).hexdigest()
-            
-            # 为chunk生成embedding
-            chunk_embedding = get_embedding(chunk.page_content)
+    return write_chunks_to_es(chunks, knowledge_id)["stored_count"]
+
+def write_chunks_to_es(chunks: List[Document], knowledge_id: int) -> Dict:
+    """
+    将chunks存储到Elasticsearch（增量比对 + 批量embedding + _bulk写入）
+    - chunk ID 按内容哈希生成，与ES中同一文档已有的chunk比对
+    - 只对新增chunk生成embedding并写入；未变化的chunk仅更新元数据；已不存在的chunk删除
+    """
+    doc_ids = compute_chunk_ids(chunks, knowledge_id)
+
+    existing_ids = None
+    if INCREMENTAL_INGEST_CONFIG.get("enabled", True) and chunks:
+        existing_ids = collect_existing_ids(
+            es_client,
+            ES_CONFIG['index'],
+            knowledge_id,
+            [chunk.metadata.get("source_file", "") for chunk in chunks],
+        )
+    diff = diff_chunk_ids(doc_ids, existing_ids or set())
+    logger.info(f"增量比对: 新增 {len(diff['added'])}，未变化 {len(diff['kept'])}，待删除 {len(diff['removed'])}")
+
+    # 批量生成embedding（仅新增chunk），结果与下标一一对应
+    added_embeddings = get_embeddings_batch([chunks[i].page_content for i in diff["added"]])
+    embeddings = dict(zip(diff["added"], added_embeddings))
+
+    def _actions():
+        for i in diff["added"]:
+            chunk = chunks[i]
+            chunk_embedding = embeddings.get(i)
             if not chunk_embedding:
                 logger.warning(f"Chunk {i} embedding生成失败，跳过")
                 continue
-            
+
             # 准备ES文档
             es_doc = {
                 "content": chunk.page_content,
                 "embedding": chunk_embedding,
-                "knowledge_id": chunk.metadata.get("knowledge_id", knowledge_id),
-                "knowledge_name": chunk.metadata.get("knowledge_name", ""),
-                "description": chunk.metadata.get("description", ""),
-                "tags": chunk.metadata.get("tags", ""),
-                "effective_time": chunk.metadata.get("effective_time", ""),
-                "source_file": chunk.metadata.get("source_file", ""),
-                "chunk_index": chunk.metadata.get("chunk_index", i),
-                "chunk_type": chunk.metadata.get("chunk_type", "content"),
-                "page_num": chunk.metadata.get("page_num", 1),
-                "bbox": chunk.metadata.get("bbox", []),
-                "positions": chunk.metadata.get("positions", []),
+                **_chunk_metadata_fields(chunk, knowledge_id, i),
                 "node_type": "doc",  # 明确标识这是文档类型
                 "weight": 1.0
             }
-            
-            # 存储到ES
-            es_client.index(index=ES_CONFIG['index'], id=doc_id, document=es_doc)
-            stored_count += 1
-            
-            if (i + 1) % 10 == 0:
-                logger.info(f"已存储 {i + 1}/{len(chunks)} 个chunks")
-                
+            yield {"_op_type": "index", "_id": doc_ids[i], "_source": es_doc}
+
+        if INCREMENTAL_INGEST_CONFIG.get("update_kept_metadata", True):
+            for i in diff["kept"]:
+                # 内容未变，只同步下标/页码/坐标等可能平移的元数据
+                yield {"_op_type": "update", "_id": doc_ids[i], "doc": _chunk_metadata_fields(chunks[i], knowledge_id, i)}
+
+        if INCREMENTAL_INGEST_CONFIG.get("delete_removed", True):
+            for doc_id in diff["removed"]:
+                yield {"_op_type": "delete", "_id": doc_id}
+
+    writer = ESBulkWriter(es_client, ES_CONFIG['index'])
+    disable_refresh = bool(ES_BULK_CONFIG.get("disable_refresh")) and \
+        len(diff["added"]) >= int(ES_BULK_CONFIG.get("disable_refresh_min_docs", 200))
+    with writer.refresh_disabled(disable_refresh):
+        result = writer.write(_actions())
+
+    for item in result["failed"]:
+        logger.error(f"存储chunk {item['id']} 失败: op={item['op']}, status={item['status']}, error={item['error']}")
+
+    # 未变化的chunk内容已在ES中，元数据更新失败也不影响检索
+    present = set(result["success"]) | {doc_ids[i] for i in diff["kept"]}
+    stored_ids = [doc_id for doc_id in doc_ids if doc_id in present]
+    stored_count = len(stored_ids)
+    logger.info(f"ES存储完成，成功存储 {stored_count}/{len(chunks)} 个chunks（新增向量化 {len(diff['added'])} 个）")
+    invalidate_answer_cache([knowledge_id], [chunk.metadata.get("source_file", "") for chunk in chunks])
+    return {"stored_count": stored_count, "chunk_ids": stored_ids}
+
+def invalidate_answer_cache(knowledge_ids: List[Optional[int]], source_files: List[str]):
+    """知识入库/改挂后作废受影响的缓存答案"""
+    cache = get_answer_cache()
+    if cache:
+        try:
+            cache.invalidate_knowledge(knowledge_ids, source_files)
         except Exception as e:
-            logger.error(f"存储chunk {i} 失败: {e}")
-            continue
+            logger.warning(f"作废答案缓存失败: {e}")
+
+# ===== 回显PDF延迟生成（Word/PPT/Excel） =====
+# 扩展名 → (转换器标识, 是否入库后立即在后台生成)；Excel回显需经LibreOffice，只在首次请求时生成
+VIEWER_PDF_TARGETS = {
+    '.doc': (DOCX_PDF_CONVERTER, True),
+    '.docx': (DOCX_PDF_CONVERTER, True),
+    '.ppt': (PPTX_PDF_CONVERTER, True),
+    '.pptx': (PPTX_PDF_CONVERTER, True),
+    '.xls': (XLSX_PDF_CONVERTER, False),
+    '.xlsx': (XLSX_PDF_CONVERTER, False),
+}
+
+VIEWER_PDF_RENDERERS = {
+    DOCX_PDF_CONVERTER: _docx_render_meta,
+    PPTX_PDF_CONVERTER: lambda src, out: {"positions": create_simple_pdf_from_pptx(src, out)[1]},
+    XLSX_PDF_CONVERTER: create_viewer_pdf_from_xlsx,
+}
+
+def schedule_viewer_pdf(file_path: str, filename: str, knowledge_id: Optional[int],
+                        chunks: List[Document], file_sha256: Optional[str] = None):
+    """
+    入库完成后登记回显PDF的生成（失败不影响入库结果）
+    Word的chunk在解析时未取得positions的，记录 (chunk_id, 字符区间)，PDF生成后回填
+    """
+    target = VIEWER_PDF_TARGETS.get(Path(filename).suffix.lower())
+    if not target:
+        return
+    converter, background = target
+    kid = int(knowledge_id) if knowledge_id else 0
+    service = get_viewer_pdf_service()
+    if service is None:
+        # 延迟生成未启用：入库时同步生成（Word已在解析时生成，此处为缓存命中）；Excel仍不生成
+        if background:
+            try:
+                convert_with_cache(get_converted_pdf_store(), file_path, kid, filename, converter,
+                                   lambda out_path: VIEWER_PDF_RENDERERS[converter](file_path, out_path),
+                                   source_sha256=file_sha256)
+            except Exception as e:
+                logger.warning(f"生成回显PDF失败 {filename}: {e}")
+        return
+    payload = None
+    if converter == DOCX_PDF_CONVERTER:
+        doc_ids = compute_chunk_ids(chunks, knowledge_id)
+        refs = [[doc_id, ch.metadata["char_start"], ch.metadata["char_end"]]
+                for doc_id, ch in zip(doc_ids, chunks)
+                if not ch.metadata.get("positions") and "char_start" in ch.metadata]
+        payload = {"chunks": refs} if refs else None
+    try:
+        service.schedule(kid, filename, file_path, converter,
+                         payload=payload, source_sha256=file_sha256, background=background)
+    except Exception as e:
+        logger.warning(f"登记回显PDF生成失败 {filename}: {e}")
+
+def backfill_viewer_positions(task: Dict, meta: Optional[Dict]):
+    """回显PDF生成后，按字符区间为入库时缺少positions的chunk回填 positions/bbox/page_num"""
+    refs = (task.get("payload") or {}).get("chunks") or []
+    positions = (meta or {}).get("positions") or []
+    if not refs or not positions:
+        return
+    span_ranges = [(p["char_start"], p["char_end"]) for p in positions]
+    chunk_ranges = [(st, en) for _, st, en in refs]
+    positions_per_chunk = assign_positions_by_offset([""] * len(refs), chunk_ranges, span_ranges, positions)
+
+    def _actions():
+        for (doc_id, _, _), chunk_pos in zip(refs, positions_per_chunk):
+            yield {"_op_type": "update", "_id": doc_id, "doc": _chunk_position_fields(chunk_pos)}
+
+    result = ESBulkWriter(es_client, ES_CONFIG['index']).write(_actions())
+    for item in result["failed"]:
+        # chunk可能已随文档更新或删除
+        logger.warning(f"回填chunk {item['id']} 位置失败: status={item['status']}, error={item['error']}")
+    logger.info(f"回显PDF位置回填完成: {task['filename']}，{len(result['success'])}/{len(refs)} 个chunks")
+
+@app.on_event("startup")
+def load_pdf_fonts():
+    """启动时查找并加载生成PDF所用的中文字体"""
+    init_font_registry()
+
+@app.on_event("startup")
+def start_viewer_pdf_service():
+    """启动回显PDF延迟生成服务，并恢复上次未完成的任务"""
+    init_viewer_pdf_service(VIEWER_PDF_RENDERERS, on_ready=backfill_viewer_positions)
+
+@app.on_event("shutdown")
+def stop_viewer_pdf_service():
+    shutdown_viewer_pdf_service()
+
+@app.get("/api/document/pdf/{knowledge_id}/{filename}")
+def download_viewer_pdf(knowledge_id: int, filename: str):
+    """
+    获取文档的回显PDF；尚未生成时同步生成后返回
+    """
+    service = get_viewer_pdf_service()
+    try:
+        pdf_path = service.ensure(knowledge_id, filename) if service else _existing_converted_pdf(knowledge_id, filename)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"回显PDF生成失败: {str(e)}")
+    if not pdf_path or not os.path.exists(pdf_path):
+        raise HTTPException(status_code=404, detail=f"未找到回显PDF: {filename}")
+    return FileResponse(pdf_path, media_type="application/pdf", filename=Path(filename).stem + ".pdf")
+
+# ===== 上传去重（按文件sha256复用已入库的chunks） =====
+def _existing_converted_pdf(knowledge_id: Optional[int], filename: str) -> Optional[str]:
+    return find_viewer_pdf(CONVERTED_PDF_ROOT, int(knowledge_id) if knowledge_id else 0, filename)
 
-    logger.info(f"ES存储完成，成功存储 {stored_count}/{len(chunks)} 个chunks")
-    return stored_count
+def copy_registered_chunks(chunk_ids: List[str], knowledge_id: Any, filename: str,
+                           metadata: Dict[str, Any]) -> Optional[Dict[str, str]]:
+    """
+    上传去重复用：读取已登记的chunks（含向量），以本次上传的知识元数据写成新的chunks，原知识的chunks保持不变
+    新chunk ID 按 (knowledge_id, filename, 内容) 计算，与正常入库该文件时一致，后续重新入库可增量比对
+    返回 {原chunk ID: 新chunk ID}；有chunk不存在或写入失败时返回None（已写入的新chunk回滚）
+    """
+    sources = {}
+    batch_size = int(ES_BULK_CONFIG.get("chunk_size", 500))
+    for start in range(0, len(chunk_ids), batch_size):
+        res = es_client.mget(index=ES_CONFIG['index'], ids=chunk_ids[start:start + batch_size])
+        for doc in res.get("docs", []):
+            if doc.get("found"):
+                sources[doc["_id"]] = doc["_source"]
+    if len(sources) < len(set(chunk_ids)):
+        return None
+
+    # 按原chunk顺序计算ID，内容相同的chunk序号与正常入库一致
+    ordered = sorted(set(chunk_ids), key=lambda doc_id: sources[doc_id].get("chunk_index", 0))
+    new_ids = compute_chunk_ids(
+        [Document(page_content=sources[doc_id].get("content", ""),
+                  metadata={"knowledge_id": knowledge_id, "source_file": filename})
+         for doc_id in ordered],
+        knowledge_id,
+    )
+    id_map = dict(zip(ordered, new_ids))
+
+    def _actions():
+        for old_id, new_id in id_map.items():
+            es_doc = {**sources[old_id], **metadata, "knowledge_id": knowledge_id, "source_file": filename}
+            yield {"_op_type": "index", "_id": new_id, "_source": es_doc}
+
+    result = ESBulkWriter(es_client, ES_CONFIG['index']).write(_actions())
+    if result["failed"]:
+        # 只回滚复制出的新chunk；与原ID相同的（同一知识、同名文件重复上传）是原chunk本身
+        rollback = [doc_id for doc_id in result["success"] if doc_id not in id_map]
+        if rollback:
+            ESBulkWriter(es_client, ES_CONFIG['index']).write(
+                {"_op_type": "delete", "_id": doc_id} for doc_id in rollback
+            )
+        return None
+    es_client.indices.refresh(index=ES_CONFIG['index'])
+    return id_map
+
+def serve_upload_from_registry(
+    file_sha256: str,
+    file_size: int,
+    filename: str,
+    knowledge_id: Optional[int],
+    knowledge_name: Optional[str] = None,
+    description: Optional[str] = None,
+    tags: Optional[str] = None,
+    effective_time: Optional[str] = None,
+) -> Optional[Dict]:
+    """
+    内容相同的文件已入库时直接复用，返回 {"chunks_count", "mode"}；未命中返回None
+    - relink：复制已有chunks（含向量）为本次上传知识的新chunks，不再解析与向量化；原知识的chunks不受影响
+    - skip：不做修改
+    """
+    registry = get_upload_registry()
+    if not registry:
+        return None
+    entry = registry.lookup(file_sha256)
+    if not entry or not entry["chunk_ids"]:
+        return None
+
+    # 已登记的chunks可能随知识删除、或随增量入库部分被替换，不完整时作废登记、按正常流程处理
+    chunk_ids = entry["chunk_ids"]
+    try:
+        alive = es_client.count(index=ES_CONFIG['index'], query={"ids": {"values": chunk_ids}}).get("count", 0)
+    except Exception as e:
+        logger.warning(f"校验去重登记失败，按正常流程处理: {e}")
+        return None
+    if alive < len(set(chunk_ids)):
+        registry.forget(file_sha256)
+        return None
+
+    mode = DEDUP_CONFIG.get("mode", "relink")
+    if mode == "relink":
+        target_kid = knowledge_id if knowledge_id is not None else entry["knowledge_id"]
+        metadata = {
+            "knowledge_name": knowledge_name or "",
+            "description": description or "",
+            "tags": tags or "",
+            "effective_time": effective_time or "",
+        }
+        try:
+            id_map = copy_registered_chunks(chunk_ids, target_kid, filename, metadata)
+        except Exception as e:
+            logger.warning(f"复制已有chunks失败，按正常流程处理: {e}")
+            return None
+        if id_map is None:
+            logger.warning(f"复制已有chunks不完整，按正常流程处理: {filename}")
+            return None
+        # 回显PDF随之挂到新的知识目录（已入CAS的直接链接同一产物）
+        converted_pdf = entry.get("converted_pdf")
+        target_pdf_kid = int(target_kid) if target_kid else 0
+        store = get_converted_pdf_store()
+        cas_key = store.resolve(entry["knowledge_id"] or 0, entry["source_file"]) if store else None
+        viewer = get_viewer_pdf_service()
+        if cas_key:
+            converted_pdf = store.link(target_pdf_kid, filename, cas_key)
+        elif viewer and viewer.relink(entry["knowledge_id"] or 0, entry["source_file"], target_pdf_kid, filename,
+                                      id_map=id_map):
+            # 原文件的回显PDF尚未生成，复制生成任务（待回填位置的chunk改为新chunk）
+            converted_pdf = None
+        elif converted_pdf and os.path.exists(converted_pdf):
+            target_pdf = build_converted_pdf_path(target_pdf_kid, filename)
+            if os.path.abspath(target_pdf) != os.path.abspath(converted_pdf):
+                shutil.copyfile(converted_pdf, target_pdf)
+            converted_pdf = target_pdf
+        registry.register(file_sha256, target_kid, filename, [id_map[doc_id] for doc_id in chunk_ids],
+                          converted_pdf=converted_pdf, file_size=file_size)
+        # 原知识的chunks未变，只影响新知识
+        invalidate_answer_cache([target_kid], [filename])
+
+    registry.record_hit(mode, file_size, alive)
+    logger.info(f"上传去重命中({mode}): {filename} 复用 {alive} 个chunks（原文件 {entry['source_file']}，知识ID {entry['knowledge_id']}）")
+    return {"chunks_count": alive, "mode": mode}
+
+def register_processed_upload(file_sha256: Optional[str], file_size: int, filename: str,
+                              knowledge_id: Optional[int], chunk_ids: List[str]):
+    """文档处理成功后登记文件哈希，供后续相同文件复用"""
+    registry = get_upload_registry()
+    if not registry or not file_sha256 or not chunk_ids:
+        return
+    try:
+        registry.register(file_sha256, knowledge_id, filename, chunk_ids,
+                          converted_pdf=_existing_converted_pdf(knowledge_id, filename), file_size=file_size)
+    except Exception as e:
+        logger.warning(f"登记上传文件哈希失败: {e}")
+
+@app.get("/api/document/dedup/stats")
+def dedup_stats():
+    """
+    上传去重统计：命中次数、节省的字节数与复用的chunk数
+    """
+    registry = get_upload_registry()
+    return registry.stats() if registry else {"enabled": False}
+
+# ===== 后台入库任务 =====
+def _run_ingest_parse_stage(job: Dict) -> List[Document]:
+    """后台任务解析阶段：转换、解析与切分"""
+    params = job["params"]
+    return build_document_chunks(
+        job["file_path"],
+        job["filename"],
+        params.get("knowledge_id"),
+        knowledge_name=params.get("knowledge_name"),
+        description=params.get("description"),
+        tags=params.get("tags"),
+        effective_time=params.get("effective_time"),
+    )
+
+def _run_ingest_index_stage(job: Dict, chunks: List[Document]) -> Dict:
+    """后台任务入库阶段：向量化并写入ES"""
+    params = job["params"]
+    stored = write_chunks_to_es(chunks, params.get("knowledge_id"))
+    stored_count = stored["stored_count"]
+    if stored_count > 0:
+        schedule_viewer_pdf(job["file_path"], job["filename"], params.get("knowledge_id"), chunks,
+                            file_sha256=params.get("file_sha256"))
+    register_processed_upload(params.get("file_sha256"), params.get("file_size", 0), job["filename"],
+                              params.get("knowledge_id"), stored["chunk_ids"])
+    return {
+        "chunks_count": stored_count,
+        "total_chunks": len(chunks),
+        "success": stored_count > 0
+    }
+
+def _to_job_response(job: Dict) -> IngestJobResponse:
+    return IngestJobResponse(
+        job_id=job["job_id"],
+        status=job["status"],
+        progress=job["progress"],
+        message=job.get("message"),
+        filename=job["filename"],
+        knowledge_id=job["params"].get("knowledge_id"),
+        result=job.get("result"),
+        error=job.get("error"),
+        created_at=job["created_at"],
+        updated_at=job["updated_at"],
+    )
+
+@app.on_event("startup")
+def start_ingest_workers():
+    """启动后台入库任务线程，并恢复上次未完成的任务"""
+    init_ingest_queue(_run_ingest_parse_stage, _run_ingest_index_stage)
+
+@app.on_event("shutdown")
+def stop_libreoffice_pool():
+    """结束常驻的LibreOffice进程"""
+    shutdown_libreoffice_pool()
+
+@app.get("/api/document/jobs/{job_id}", response_model=IngestJobResponse)
+def get_ingest_job(job_id: str):
+    """
+    查询后台入库任务状态
+    """
+    job = get_ingest_queue().get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"任务不存在: {job_id}")
+    return _to_job_response(job)
+
+@app.get("/api/document/jobs/{job_id}/progress")
+def get_ingest_job_progress(job_id: str):
+    """
+    查询后台入库任务进度（轻量轮询接口）
+    """
+    job = get_ingest_queue().get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"任务不存在: {job_id}")
+    return {
+        "job_id": job_id,
+        "status": job["status"],
+        "progress": job["progress"],
+        "message": job.get("message"),
+    }
+
+@app.post("/api/document/jobs/{job_id}/cancel", response_model=IngestJobResponse)
+def cancel_ingest_job(job_id: str):
+    """
+    取消后台入库任务：排队中的任务立即取消，执行中的任务在当前阶段结束后停止
+    """
+    job = get_ingest_queue().cancel(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"任务不存在: {job_id}")
+    return _to_job_response(job)
+
+# ===== 上传文件流式落盘 =====
+UPLOAD_PATHS = {"/api/document/process"}
+
+@app.middleware("http")
+async def reject_oversized_upload(request: Request, call_next):
+    """按 Content-Length 提前拒绝超限上传，避免请求体被完整接收后才报错"""
+    max_bytes = int(UPLOAD_CONFIG.get("max_bytes") or 0)
+    if max_bytes and request.method == "POST" and request.url.path in UPLOAD_PATHS:
+        content_length = request.headers.get("content-length")
+        # multipart 包含表单字段与边界，预留少量余量
+        if content_length and content_length.isdigit() and int(content_length) > max_bytes + 64 * 1024:
+            return JSONResponse(status_code=413, content={"detail": f"文件过大，上限 {max_bytes} 字节"})
+    return await call_next(request)
+
+async def save_upload_to_disk(file: UploadFile, suffix: str) -> Tuple[str, str, int]:
+    """
+    将上传文件按固定块大小流式写入临时文件，同时计算sha256与文件大小
+    超过大小上限时删除临时文件并返回413
+    返回: (临时文件路径, sha256, 字节数)
+    """
+    chunk_bytes = int(UPLOAD_CONFIG.get("chunk_bytes") or 1024 * 1024)
+    max_bytes = int(UPLOAD_CONFIG.get("max_bytes") or 0)
+    hasher = hashlib.sha256()
+    size = 0
+    fd, temp_path = tempfile.mkstemp(suffix=suffix, dir=UPLOAD_CONFIG.get("tmp_dir"))
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                block = await file.read(chunk_bytes)
+                if not block:
+                    break
+                size += len(block)
+                if max_bytes and size > max_bytes:
+                    raise HTTPException(status_code=413, detail=f"文件过大，上限 {max_bytes} 字节")
+                hasher.update(block)
+                out.write(block)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+    return temp_path, hasher.hexdigest(), size
 
 @app.post("/api/document/process", response_model=DocumentProcessResponse)
 async def process_document(
@@ -1325,12 +1660,14 @@ async def process_document(
     knowledge_name: str = Form(None),
     description: str = Form(None),
     tags: str = Form(None),
-    effective_time: str = Form(None)
+    effective_time: str = Form(None),
+    async_mode: bool = Form(False)
 ):
     """
     处理上传的文档
     - 支持切分的格式：PDF、Word、Excel、PowerPoint、TXT 等
     - 不支持切分的格式：图片、音频、视频等（仅存储）
+    - async_mode=true 时立即返回任务ID，由后台任务完成解析与入库
     """
     logger.info(f"开始处理文档: {file.filename}, 知识ID: {knowledge_id}")
     
@@ -1357,15 +1694,55 @@ async def process_document(
         if file_extension not in chunkable_extensions and file_extension not in storage_only_extensions:
             raise HTTPException(status_code=400, detail=f"不支持的文件类型: {file_extension}")
         
-        # 保存上传的文件
-        with tempfile.NamedTemporaryFile(delete=False, suffix=file_extension) as temp_file:
-            content = await file.read()
-            temp_file.write(content)
-            temp_file_path = temp_file.name
+        # 保存上传的文件（流式落盘，边写边计算哈希）
+        temp_file_path, file_sha256, file_size = await save_upload_to_disk(file, file_extension)
+        logger.info(f"上传文件已落盘: {file.filename}，大小 {file_size} 字节，sha256={file_sha256}")
         
         try:
-            # 判断是否需要切分处理
+            # 内容相同的文件已入库时直接复用
             if file_extension in chunkable_extensions:
+                reused = serve_upload_from_registry(
+                    file_sha256,
+                    file_size,
+                    file.filename,
+                    knowledge_id,
+                    knowledge_name=knowledge_name,
+                    description=description,
+                    tags=tags,
+                    effective_time=effective_time,
+                )
+                if reused is not None:
+                    return DocumentProcessResponse(
+                        success=True,
+                        message=f"文档内容已存在，复用已有切分结果: {file.filename}",
+                        chunks_count=reused["chunks_count"],
+                        knowledge_id=int(knowledge_id) if knowledge_id is not None else 0
+                    )
+
+            # 判断是否需要切分处理
+            if file_extension in chunkable_extensions and async_mode:
+                # 提交后台任务，立即返回任务ID
+                job = get_ingest_queue().submit(
+                    temp_file_path,
+                    file.filename,
+                    {
+                        "knowledge_id": knowledge_id,
+                        "knowledge_name": knowledge_name,
+                        "description": description,
+                        "tags": tags,
+                        "effective_time": effective_time,
+                        "file_sha256": file_sha256,
+                        "file_size": file_size,
+                    },
+                )
+                return DocumentProcessResponse(
+                    success=True,
+                    message=f"文档已提交后台处理: {file.filename}",
+                    chunks_count=0,
+                    knowledge_id=int(knowledge_id) if knowledge_id is not None else 0,
+                    job_id=job["job_id"]
+                )
+            elif file_extension in chunkable_extensions:
                 # 进行文档切分处理
                 result = process_document_unified(
                     temp_file_path,
@@ -1375,7 +1752,9 @@ async def process_document(
                     description=description,
                     tags=tags,
                     effective_time=effective_time,
+                    file_sha256=file_sha256,
                 )
+                register_processed_upload(file_sha256, file_size, file.filename, knowledge_id, result.get("chunk_ids", []))
                 
                 return DocumentProcessResponse(
                     success=True,
@@ -1395,13 +1774,153 @@ async def process_document(
                 )
             
         finally:
-            # 清理临时文件
-            os.unlink(temp_file_path)
+            # 清理临时文件（异步模式下已移动到任务目录）
+            if os.path.exists(temp_file_path):
+                os.unlink(temp_file_path)
             
+    except HTTPException:
+        # 400/413 等已明确的状态码原样返回
+        raise
     except Exception as e:
         logger.error(f"文档处理失败: {e}")
         raise HTTPException(status_code=500, detail=f"文档处理失败: {str(e)}")
 
+def prepare_rag_chat(request: ChatRequest, chat_model: str) -> Dict[str, Any]:
+    """
+    问答准备阶段（/api/rag/chat 与 /api/rag/chat/stream 共用）：答案缓存查找 → 检索 → 构建上下文、提示词与引用
+    返回的 answer 不为None时直接作为答案（缓存命中、未检索到内容等），否则用 prompt 调用大模型
+    chat_model 为生成答案的 "API:模型"，参与答案缓存范围，不同模型的答案不互相命中
+    """
+    prepared = {
+        "answer": None,
+        "prompt": None,
+        "references": [],
+        "cached": False,
+        "answer_scope": None,
+        "question_embedding": None,
+        "cache_snapshot": None,
+        "retrieval_mode": None,
+        "retrieval_ms": 0.0,
+    }
+    
+    # 0. 语义答案缓存：同一检索范围内相似问题已回答过时直接返回，不检索、不调用大模型
+    answer_cache = get_answer_cache()
+    if answer_cache:
+        # 先取作废快照再查缓存与检索：生成期间有入库/删除时，答案不写入缓存
+        prepared["cache_snapshot"] = answer_cache.snapshot()
+        question_embedding = get_query_embedding(request.question)
+        if question_embedding:
+            answer_scope = make_answer_scope(ES_CONFIG['index'], DEFAULT_EMBEDDING_MODEL, request.source_file,
+                                             resolve_retrieval_mode(request.retrieval_mode), chat_model)
+            prepared["answer_scope"] = answer_scope
+            prepared["question_embedding"] = question_embedding
+            cached = answer_cache.lookup(answer_scope, question_embedding)
+            if cached:
+                logger.info(f"答案缓存命中（相似度 {cached['similarity']:.3f}，原问题: {cached['question']}）")
+                prepared["answer"] = cached["answer"]
+                prepared["references"] = [KnowledgeReference(**ref) for ref in cached["references"]]
+                prepared["cached"] = True
+                return prepared
+    
+    # 1. 检索相关chunks
+    # 构建过滤条件 - 简化过滤，先确保基本搜索能工作
+    filters = [
+        {"term": {"chunk_type": "content"}}  # 只搜索内容类型的chunk
+    ]
+    
+    # 如果指定了特定文件，则只检索该文件的chunks
+    if request.source_file:
+        logger.info(f"按文件名过滤RAG检索: {request.source_file}")
+        filters.append({"term": {"source_file": request.source_file}})
+    
+    # script_score 精确计算、knn 走HNSW近似检索；hybrid 时BM25与向量检索并发后按RRF融合
+    retrieval = retrieve(
+        es_client,
+        ES_CONFIG['index'],
+        request.question,
+        get_query_embedding,
+        size=10 if request.source_file else 5,  # 针对特定文件时返回更多chunks
+        filters=filters,
+        mode=request.retrieval_mode,
+        num_candidates=request.num_candidates,
+    )
+    hits = retrieval["hits"]
+    prepared["retrieval_mode"] = retrieval["mode"]
+    prepared["retrieval_ms"] = retrieval["took_ms"]
+    if not hits and not retrieval["embedding_ok"]:
+        prepared["answer"] = "抱歉，无法生成问题的向量表示，请重试。"
+        return prepared
+    logger.info(f"检索方式: {retrieval['mode']}，命中 {len(hits)} 条，耗时 {retrieval['took_ms']:.1f}ms")
+    
+    if not hits:
+        prepared["answer"] = "抱歉，在知识库中没有找到相关信息。"
+        return prepared
+    
+    # 2. 构建增强的上下文信息
+    context_chunks = []
+    for hit in hits:
+        source = hit['_source']
+        score = hit.get('_score') or 0.0
+        
+        # 构建每个chunk的完整上下文信息
+        chunk_info = {
+            "content": source.get('content', ''),
+            "metadata": {
+                "knowledge_id": source.get('knowledge_id', 0),
+                "knowledge_name": source.get('knowledge_name', ''),
+                "description": source.get('description', ''),
+                "tags": source.get('tags', ''),
+                "effective_time": source.get('effective_time', ''),
+                "document_name": source.get('source_file', 'N/A'),
+                "document_type": "文档",  # 通用文档类型
+                "page_num": source.get('page_num', 'N/A'),
+                "chunk_index": source.get('chunk_index', 'N/A'),
+                "bbox": source.get('bbox', []),
+                "positions": source.get('positions', []),
+                "relevance_score": round(score, 3)
+            }
+        }
+        context_chunks.append(chunk_info)
+    
+    # 3. 构建增强的RAG提示词
+    prepared["prompt"] = build_enhanced_rag_prompt(request.question, context_chunks)
+    
+    # 4. 构建引用信息（流式接口在答案生成前先推送引用）
+    references = []
+    for chunk in context_chunks:
+        metadata = chunk['metadata']
+        references.append(KnowledgeReference(
+            knowledge_id=int(metadata.get('knowledge_id', 0)) if metadata.get('knowledge_id') is not None else 0,
+            knowledge_name=metadata.get('knowledge_name', ''),
+            description=metadata.get('description', ''),
+            tags=[metadata.get('tags', '')] if isinstance(metadata.get('tags', ''), str) else metadata.get('tags', []),
+            effective_time=metadata.get('effective_time', ''),
+            attachments=[metadata.get('document_name', '')],
+            relevance=metadata.get('relevance_score', 0.0),
+            source_file=metadata.get('document_name', ''),
+            page_num=metadata.get('page_num', 0),
+            chunk_index=metadata.get('chunk_index', 0),
+            chunk_type="content",
+            bbox_union=metadata.get('bbox', []),  # 使用新的bbox字段
+            char_start=0,  # 不再使用字符位置
+            char_end=0
+        ))
+    prepared["references"] = references
+    return prepared
+
+def remember_rag_answer(request: ChatRequest, prepared: Dict[str, Any], answer: str):
+    """大模型成功生成的答案写入语义答案缓存"""
+    answer_cache = get_answer_cache()
+    if not answer_cache or not prepared["answer_scope"]:
+        return
+    references = prepared["references"]
+    answer_cache.put(
+        prepared["answer_scope"], request.source_file, request.question, prepared["question_embedding"], answer,
+        [ref.model_dump() for ref in references],
+        knowledge_ids=[ref.knowledge_id for ref in references],
+        snapshot=prepared["cache_snapshot"],
+    )
+
 @app.post("/api/rag/chat", response_model=ChatResponse)
 def chat_with_rag(request: ChatRequest):
     """
@@ -1410,123 +1929,22 @@ def chat_with_rag(request: ChatRequest):
     logger.info(f"RAG聊天请求: {request.question}")
     
     try:
-        # 1. 向量搜索找到相关chunks
-        question_embedding = get_embedding(request.question)
-        if not question_embedding:
-            return ChatResponse(
-                answer="抱歉，无法生成问题的向量表示，请重试。",
-                references=[],
-                session_id=request.user_id
-            )
-        
-        # 构建过滤条件 - 简化过滤，先确保基本搜索能工作
-        filters = [
-            {"term": {"chunk_type": "content"}}  # 只搜索内容类型的chunk
-        ]
-        
-        # 如果指定了特定文件，则只检索该文件的chunks
-        if request.source_file:
-            logger.info(f"按文件名过滤RAG检索: {request.source_file}")
-            filters.append({"term": {"source_file": request.source_file}})
-        
-        # 简化搜索逻辑 - 直接返回语义相似度最高的chunks
-        # 仅检索包含embedding字段的文档，避免脚本在缺失字段时报错
-        search_query = {
-            "size": 10 if request.source_file else 5,  # 针对特定文件时返回更多chunks
-            "query": {
-                "script_score": {
-                    "query": {
-                        "bool": {
-                            "filter": filters
-                        }
-                    },
-                    "script": {
-                        "source": "cosineSimilarity(params.query_vector, 'embedding') + 1.0",
-                        "params": {"query_vector": question_embedding}
-                    }
-                }
-            },
-            "_source": [
-                "content",
-                "knowledge_id",
-                "knowledge_name",
-                "description",
-                "tags",
-                "effective_time",
-                "source_file",
-                "page_num",
-                "chunk_index",
-                "bbox",
-                "positions"
-            ]
-        }
-        
-        search_response = es_client.search(index=ES_CONFIG['index'], body=search_query)
-        hits = search_response.get('hits', {}).get('hits', [])
-        
-        if not hits:
+        prepared = prepare_rag_chat(request, RAG_CHAT_MODEL_ID)
+        if prepared["answer"] is not None:
             return ChatResponse(
-                answer="抱歉，在知识库中没有找到相关信息。",
-                references=[],
+                answer=prepared["answer"],
+                references=prepared["references"],
                 session_id=request.user_id
             )
         
-        # 2. 构建增强的上下文信息
-        context_chunks = []
-        for hit in hits:
-            source = hit['_source']
-            score = hit['_score']
-            
-            # 构建每个chunk的完整上下文信息
-            chunk_info = {
-                "content": source.get('content', ''),
-                "metadata": {
-                    "knowledge_id": source.get('knowledge_id', 0),
-                    "knowledge_name": source.get('knowledge_name', ''),
-                    "description": source.get('description', ''),
-                    "tags": source.get('tags', ''),
-                    "effective_time": source.get('effective_time', ''),
-                    "document_name": source.get('source_file', 'N/A'),
-                    "document_type": "文档",  # 通用文档类型
-                    "page_num": source.get('page_num', 'N/A'),
-                    "chunk_index": source.get('chunk_index', 'N/A'),
-                    "bbox": source.get('bbox', []),
-                    "positions": source.get('positions', []),
-                    "relevance_score": round(score, 3)
-                }
-            }
-            context_chunks.append(chunk_info)
-        
-        # 3. 构建增强的RAG提示词
-        enhanced_prompt = build_enhanced_rag_prompt(request.question, context_chunks)
-        
-        # 4. 调用大模型生成答案
-        answer = generate_ai_answer(enhanced_prompt)
-        
-        # 5. 构建引用信息
-        references = []
-        for chunk in context_chunks:
-            metadata = chunk['metadata']
-            references.append(KnowledgeReference(
-                knowledge_id=int(metadata.get('knowledge_id', 0)) if metadata.get('knowledge_id') is not None else 0,
-                knowledge_name=metadata.get('knowledge_name', ''),
-                description=metadata.get('description', ''),
-                tags=[metadata.get('tags', '')] if isinstance(metadata.get('tags', ''), str) else metadata.get('tags', []),
-                effective_time=metadata.get('effective_time', ''),
-                attachments=[metadata.get('document_name', '')],
-                relevance=metadata.get('relevance_score', 0.0),
-                source_file=metadata.get('document_name', ''),
-                page_num=metadata.get('page_num', 0),
-                chunk_index=metadata.get('chunk_index', 0),
-                chunk_type="content",
-                bbox_union=metadata.get('bbox', []),  # 使用新的bbox字段
-                char_start=0,  # 不再使用字符位置
-                char_end=0
-            ))
+        # 调用大模型生成答案
+        answer, answer_ok = generate_ai_answer_with_status(prepared["prompt"])
+        if answer_ok:
+            remember_rag_answer(request, prepared, answer)
         
         return ChatResponse(
             answer=answer,
-            references=references,
+            references=prepared["references"],
             session_id=request.user_id
         )
         
@@ -1538,6 +1956,112 @@ def chat_with_rag(request: ChatRequest):
             session_id=request.user_id
         )
 
+@app.post("/api/rag/chat/stream")
+async def chat_with_rag_stream(request: ChatRequest, http_request: Request):
+    """
+    基于知识库的智能问答（流式，text/event-stream）
+    事件：references（引用列表）→ token（答案片段，{"text"}）→ done（完整答案与耗时）；出错时为 error
+    客户端断开后停止读取大模型输出；只有完整生成的答案才写入答案缓存
+    """
+    logger.info(f"RAG流式聊天请求: {request.question}")
+    metrics = get_stream_metrics()
+    metrics.incr("started")
+    heartbeat_seconds = RAG_STREAM_CONFIG.get("heartbeat_seconds", 15)
+    
+    async def event_stream():
+        t0 = time.perf_counter()
+        cancel_event = threading.Event()
+        try:
+            # 检索、向量化均为同步调用，放到线程池中执行，不阻塞事件循环
+            # 流式生成走当前AI客户端（AI_API_SWITCH）的默认聊天模型，缓存范围按实际模型区分
+            manager = await run_in_threadpool(get_ai_manager)
+            chat_model = manager.default_chat_model()
+            prepared = await run_in_threadpool(prepare_rag_chat, request, f"{manager.current_api}:{chat_model}")
+            references_ms = (time.perf_counter() - t0) * 1000
+            metrics.observe("retrieval_ms", references_ms)
+            yield format_sse("references", {
+                "references": [ref.model_dump() for ref in prepared["references"]],
+                "cached": prepared["cached"],
+                "retrieval_mode": prepared["retrieval_mode"],
+                "elapsed_ms": round(references_ms, 1),
+                "session_id": request.user_id,
+            })
+            
+            if prepared["answer"] is not None:
+                metrics.incr("cached" if prepared["cached"] else "no_hits")
+                yield format_sse("token", {"text": prepared["answer"]})
+                yield format_sse("done", {
+                    "answer": prepared["answer"],
+                    "cached": prepared["cached"],
+                    "ttft_ms": round(references_ms, 1),
+                    "total_ms": round(references_ms, 1),
+                })
+                return
+            
+            parts = []
+            ttft_ms = None
+            error = None
+            
+            def make_stream():
+                return manager.chat_completion_stream(
+                    build_rag_messages(prepared["prompt"]), model=chat_model, temperature=0.3, max_tokens=1000
+                )
+            
+            async for chunk in iterate_in_thread(make_stream, cancel_event, heartbeat_seconds):
+                if await http_request.is_disconnected():
+                    metrics.incr("cancelled")
+                    logger.info(f"客户端已断开，停止生成（已输出 {len(parts)} 段）")
+                    return
+                if chunk is None:
+                    yield SSE_HEARTBEAT
+                    continue
+                if "error" in chunk:
+                    error = chunk["error"]
+                    break
+                choices = chunk.get("choices") or []
+                text = ((choices[0].get("delta") or {}).get("content") or "") if choices else ""
+                if not text:
+                    continue
+                if ttft_ms is None:
+                    ttft_ms = (time.perf_counter() - t0) * 1000
+                    metrics.observe("ttft_ms", ttft_ms)
+                parts.append(text)
+                yield format_sse("token", {"text": text})
+            
+            if error or not parts:
+                metrics.incr("errors")
+                logger.error(f"RAG流式生成失败: {error or '大模型未返回内容'}")
+                yield format_sse("error", {"message": f"抱歉，生成答案失败：{error or '大模型未返回内容'}，请重试。"})
+                return
+            
+            answer = "".join(parts)
+            total_ms = (time.perf_counter() - t0) * 1000
+            metrics.observe("total_ms", total_ms)
+            metrics.incr("completed")
+            await run_in_threadpool(remember_rag_answer, request, prepared, answer)
+            yield format_sse("done", {
+                "answer": answer,
+                "cached": False,
+                "ttft_ms": round(ttft_ms, 1),
+                "total_ms": round(total_ms, 1),
+            })
+        except asyncio.CancelledError:
+            # 服务端检测到连接断开时取消生成器
+            metrics.incr("cancelled")
+            raise
+        except Exception as e:
+            metrics.incr("errors")
+            logger.error(f"RAG流式聊天失败: {e}")
+            yield format_sse("error", {"message": f"抱歉，处理您的问题时出现错误：{str(e)}"})
+        finally:
+            cancel_event.set()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 def build_enhanced_rag_prompt(question: str, context_chunks: List[Dict]) -> str:
     """
     构建增强的RAG提示词，让大模型能看到完整的上下文信息
@@ -1589,10 +2113,35 @@ def build_enhanced_rag_prompt(question: str, context_chunks: List[Dict]) -> str:
     
     return prompt
 
+# /api/rag/chat 直接调用极客智坊接口使用的模型；答案缓存范围中记为 "geekai:模型"
+RAG_CHAT_MODEL = "gpt-4o-mini"
+RAG_CHAT_MODEL_ID = f"geekai:{RAG_CHAT_MODEL}"
+
+def build_rag_messages(prompt: str) -> List[Dict[str, str]]:
+    """
+    问答消息（非流式与流式接口共用）
+    """
+    return [
+        {
+            "role": "system",
+            "content": "你是一个专业的文档知识助手，请基于提供的文档信息准确回答问题。"
+        },
+        {
+            "role": "user", 
+            "content": prompt
+        }
+    ]
+
 def generate_ai_answer(prompt: str) -> str:
     """
     调用大模型生成答案
     """
+    return generate_ai_answer_with_status(prompt)[0]
+
+def generate_ai_answer_with_status(prompt: str) -> Tuple[str, bool]:
+    """
+    调用大模型生成答案，返回 (答案, 是否成功)；失败时答案为提示语（不应缓存）
+    """
     try:
         # 调用极客智坊API生成答案
         headers = {
@@ -1601,17 +2150,8 @@ def generate_ai_answer(prompt: str) -> str:
         }
         
         payload = {
-            "model": "gpt-4o-mini",  # 使用合适的模型
-            "messages": [
-                {
-                    "role": "system",
-                    "content": "你是一个专业的文档知识助手，请基于提供的文档信息准确回答问题。"
-                },
-                {
-                    "role": "user", 
-                    "content": prompt
-                }
-            ],
+            "model": RAG_CHAT_MODEL,
+            "messages": build_rag_messages(prompt),
             "max_tokens": 1000,
             "temperature": 0.3
         }
@@ -1627,23 +2167,23 @@ def generate_ai_answer(prompt: str) -> str:
             result = response.json()
             if "choices" in result and len(result["choices"]) > 0:
                 answer = result["choices"][0]["message"]["content"]
-                return answer
+                return answer, True
             else:
                 logger.error(f"API响应格式异常: {result}")
-                return "抱歉，生成答案时出现格式错误，请重试。"
+                return "抱歉，生成答案时出现格式错误，请重试。", False
         else:
             logger.error(f"API调用失败: {response.status_code}, {response.text}")
-            return f"抱歉，API调用失败（状态码：{response.status_code}），请重试。"
+            return f"抱歉，API调用失败（状态码：{response.status_code}），请重试。", False
             
     except requests.exceptions.Timeout:
         logger.error("API调用超时")
-        return "抱歉，生成答案超时，请重试。"
+        return "抱歉，生成答案超时，请重试。", False
     except requests.exceptions.RequestException as e:
         logger.error(f"API请求异常: {e}")
-        return f"抱歉，API请求异常：{str(e)}，请重试。"
+        return f"抱歉，API请求异常：{str(e)}，请重试。", False
     except Exception as e:
         logger.error(f"生成AI答案失败: {e}")
-        return f"抱歉，生成答案时出现错误：{str(e)}，请重试。"
+        return f"抱歉，生成答案时出现错误：{str(e)}，请重试。", False
 
 def extract_keywords_from_content(content: str) -> List[str]:
     """从内容提取关键标识词（通用版本）"""
@@ -1664,6 +2204,68 @@ def extract_keywords_from_content(content: str) -> List[str]:
     
     return keywords[:8]  # 限制关键词数量
 
+@app.get("/api/cache/stats")
+def cache_stats():
+    """
+    缓存命中统计
+    """
+    cache = get_embedding_cache()
+    query_cache = get_query_embedding_cache()
+    answers = get_answer_cache()
+    pdf_store = get_converted_pdf_store()
+    viewer = get_viewer_pdf_service()
+    return {
+        "embedding": cache.stats() if cache else {"enabled": False},
+        "query_embedding": query_cache.stats() if query_cache else {"enabled": False},
+        "answer": answers.stats() if answers else {"enabled": False},
+        "converted_pdf": pdf_store.stats() if pdf_store else {"enabled": False},
+        "viewer_pdf": viewer.stats() if viewer else {"enabled": False},
+        "pdf_font": get_font_registry().info(),
+    }
+
+@app.post("/api/cache/answers/clear")
+def clear_answer_cache():
+    """
+    清空语义答案缓存（索引代次加一）；整库重建或迁移索引后调用
+    """
+    cache = get_answer_cache()
+    if not cache:
+        return {"enabled": False}
+    return {"enabled": True, "generation": cache.bump_generation()}
+
+@app.post("/api/cache/answers/invalidate")
+def invalidate_deleted_answers(request: AnswerCacheInvalidateRequest):
+    """
+    知识或附件删除后作废引用了它的缓存答案（由Java端删除知识/附件时调用）
+    """
+    cache = get_answer_cache()
+    if not cache:
+        return {"enabled": False}
+    source_files = [request.source_file] if request.source_file else []
+    removed = cache.invalidate_knowledge([request.knowledge_id], source_files, include_unscoped=False)
+    return {"enabled": True, "invalidated": removed}
+
+@app.on_event("shutdown")
+def stop_answer_cache():
+    shutdown_answer_cache()
+
+@app.get("/api/rag/chat/stream/metrics")
+def rag_stream_metrics():
+    """
+    流式问答统计：首字延迟（ttft_ms）、检索耗时、总耗时的 p50/p95，以及完成/取消/出错次数
+    """
+    return get_stream_metrics().stats()
+
+@app.post("/api/document/converted/gc")
+def gc_converted_pdfs(dry_run: bool = False):
+    """
+    回收不再被任何知识文档引用的转换PDF产物
+    """
+    store = get_converted_pdf_store()
+    if not store:
+        return {"enabled": False}
+    return store.gc(grace_seconds=CONVERTED_PDF_CONFIG.get("gc_grace_seconds", 3600), dry_run=dry_run)
+
 @app.get("/api/health")
 def health_check():
     """
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+RAG问答的流式输出（Server-Sent Events）
+- 事件顺序：references（检索完成即推送引用）→ token（答案片段，逐段推送）→ done 或 error
+- 大模型流式接口是同步生成器：在后台线程中迭代，经 asyncio.Queue 交给事件循环逐段产出
+- 客户端断开时置取消标志，后台线程在下一段到达时关闭生成器（随之关闭上游HTTP连接），不再继续消耗token
+- 首字延迟（TTFT）、检索耗时、总耗时按最近样本统计 p50/p95
+"""
+
+import asyncio
+import json
+import logging
+import threading
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional
+
+from config import RAG_STREAM_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# SSE注释行，浏览器 EventSource 会忽略，仅用于保持连接
+SSE_HEARTBEAT = ": ping\n\n"
+
+_END = object()
+
+
+def format_sse(event: str, data: Any) -> str:
+    """格式化一条SSE事件（data 为JSON，中文不转义）"""
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+async def iterate_in_thread(make_iterator: Callable[[], Iterator[Any]],
+                            cancel_event: threading.Event,
+                            heartbeat_seconds: Optional[float] = None) -> AsyncIterator[Any]:
+    """
+    在后台线程中迭代同步生成器，异步逐项产出
+    - 超过 heartbeat_seconds 没有新数据时产出 None，由调用方发送心跳
+    - 调用方退出（正常结束、客户端断开、异常）时置 cancel_event；
+      生成器只能在迭代它的线程中关闭，因此由后台线程在下一项到达时 close()
+    - 生成器抛出的异常转换为 {"error": ...}，与各AI客户端流式接口的错误格式一致
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+
+    def emit(item):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:
+            # 事件循环已关闭（服务停止），丢弃
+            cancel_event.set()
+
+    def worker():
+        iterator = None
+        try:
+            iterator = make_iterator()
+            for item in iterator:
+                if cancel_event.is_set():
+                    break
+                emit(item)
+        except Exception as e:
+            logger.error(f"流式生成异常: {e}")
+            emit({"error": f"流式生成异常: {str(e)}"})
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                try:
+                    close()
+                except Exception as e:
+                    logger.warning(f"关闭流式生成器失败: {e}")
+            emit(_END)
+
+    threading.Thread(target=worker, name="rag-stream", daemon=True).start()
+    try:
+        while True:
+            if heartbeat_seconds:
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout=heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+            else:
+                item = await queue.get()
+            if item is _END:
+                break
+            yield item
+    finally:
+        cancel_event.set()
+
+
+def percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+class StreamMetrics:
+    """流式问答计数与耗时统计（最近 window 个样本）"""
+
+    TIMINGS = ("retrieval_ms", "ttft_ms", "total_ms")
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self._samples = {name: deque(maxlen=max(1, int(window))) for name in self.TIMINGS}
+        self._counts = {"started": 0, "completed": 0, "cached": 0, "no_hits": 0, "cancelled": 0, "errors": 0}
+
+    def incr(self, name: str):
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + 1
+
+    def observe(self, name: str, ms: float):
+        with self._lock:
+            self._samples[name].append(ms)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            result: Dict[str, Any] = dict(self._counts)
+            for name, samples in self._samples.items():
+                values = list(samples)
+                result[name] = {
+                    "samples": len(values),
+                    "p50": round(percentile(values, 50), 1),
+                    "p95": round(percentile(values, 95), 1),
+                    "avg": round(sum(values) / len(values), 1) if values else 0.0,
+                }
+            return result
+
+
+# 全局统计实例
+stream_metrics = None
+_stream_metrics_lock = threading.Lock()
+
+def get_stream_metrics() -> StreamMetrics:
+    """获取流式问答统计实例"""
+    global stream_metrics
+    if stream_metrics is None:
+        with _stream_metrics_lock:
+            if stream_metrics is None:
+                stream_metrics = StreamMetrics(RAG_STREAM_CONFIG.get("metrics_window", 1000))
+    return stream_metrics
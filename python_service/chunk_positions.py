@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基于字符偏移的 span → chunk 位置分配
+记录每个span在拼接文本中的字符区间，以及每个chunk的字符区间，
+用二分查找取与chunk区间相交的span，避免逐个span做子串匹配
+（后者为 O(chunks × spans × chunk_len)，且对"1.19%"、"基金"等短文本/重复文本会误匹配）。
+"""
+
+from bisect import bisect_right
+from typing import Dict, List, Optional, Sequence, Tuple
+
+Range = Tuple[int, int]
+
+
+def locate_chunk_ranges(text: str, chunk_texts: Sequence[str]) -> List[Optional[Range]]:
+    """
+    定位按顺序切出的chunk在原文中的字符区间 [start, end)
+    chunk之间有重叠，下一个chunk必然从上一个chunk起点之后开始，因此从上一起点向后查找；
+    找不到（如切分器改写了空白）时返回None，由调用方降级处理
+    """
+    ranges: List[Optional[Range]] = []
+    cursor = 0
+    for chunk in chunk_texts:
+        idx = text.find(chunk, cursor) if chunk else -1
+        if idx < 0:
+            ranges.append(None)
+            continue
+        ranges.append((idx, idx + len(chunk)))
+        cursor = idx + 1
+    return ranges
+
+
+class SpanOffsetIndex:
+    """
+    span字符区间索引
+    要求span按起点升序且互不重叠（拼接文本天然满足），此时终点也升序，可直接二分
+    """
+
+    def __init__(self, span_ranges: Sequence[Range]):
+        self.starts = [s for s, _ in span_ranges]
+        self.ends = [e for _, e in span_ranges]
+
+    def overlapping(self, start: int, end: int) -> List[int]:
+        """返回与 [start, end) 相交的span下标"""
+        result = []
+        i = bisect_right(self.ends, start)
+        n = len(self.starts)
+        while i < n and self.starts[i] < end:
+            if self.ends[i] > start:
+                result.append(i)
+            i += 1
+        return result
+
+
+def assign_positions_by_offset(chunk_texts: Sequence[str],
+                               chunk_ranges: Sequence[Optional[Range]],
+                               span_ranges: Sequence[Range],
+                               positions: Sequence[Dict]) -> List[List[Dict]]:
+    """
+    为每个chunk分配位置信息：取字符区间与chunk相交的span
+    个别chunk无法定位区间时，退回文本包含匹配
+    """
+    index = SpanOffsetIndex(span_ranges)
+    result: List[List[Dict]] = []
+    for chunk_text, rng in zip(chunk_texts, chunk_ranges):
+        if rng is None:
+            result.append([p for p in positions if p.get("text") and p["text"] in chunk_text])
+        else:
+            result.append([positions[i] for i in index.overlapping(rng[0], rng[1])])
+    return result
+
+
+def join_with_offsets(texts: Sequence[str], sep: str = "\n") -> Tuple[str, List[Range]]:
+    """用分隔符拼接文本，同时返回每段在结果中的字符区间"""
+    ranges: List[Range] = []
+    pos = 0
+    for t in texts:
+        ranges.append((pos, pos + len(t)))
+        pos += len(t) + len(sep)
+    return sep.join(texts), ranges
@@ -13,6 +13,23 @@ ES_CONFIG = {
     'verify_certs': False
 }
 
+# ES批量写入配置（_bulk API）
+ES_BULK_CONFIG = {
+    "max_chunk_bytes": 10 * 1024 * 1024,  # 单个bulk请求最大字节数（1536维向量文档较大，按字节切批）
+    "chunk_size": 500,                    # 单个bulk请求最大文档数（字节上限优先生效）
+    "thread_count": 1,                    # >1 时使用 parallel_bulk 多线程发送
+    "max_retries": 2,                     # 单线程模式下 429 重试次数
+    "disable_refresh": True,              # 大批量入库期间关闭 refresh_interval，结束后恢复
+    "disable_refresh_min_docs": 200,      # 达到该文档数才关闭 refresh
+}
+
+# 增量入库配置（按内容哈希生成chunk ID，与ES已有chunk比对，只向量化新增chunk）
+INCREMENTAL_INGEST_CONFIG = {
+    "enabled": True,
+    "update_kept_metadata": True,   # 未变化的chunk仍更新页码/下标/坐标等元数据（不重新向量化）
+    "delete_removed": True,         # 删除新版本中已不存在的chunk
+}
+
 # 文档处理配置
 DOCUMENT_CONFIG = {
     "chunk_size": 4000,  # 从1000增加到4000，减少过度分块
@@ -29,6 +46,7 @@ DOCUMENT_CONFIG = {
     },
     # 分块器配置
     "splitter_config": {
+        "chunk_size": 1000,  # 各解析路径的分块大小（字符），重叠按 dynamic_overlap 比例计算
         "separators": [
             "\n\n",  # 段落分隔
             "\n",    # 行分隔
@@ -49,18 +67,219 @@ DOCUMENT_CONFIG = {
     }
 }
 
+# 生成PDF（TXT/DOCX/PPTX回显）使用的中文字体：启动时查找一次，字体数据常驻内存
+FONT_CONFIG = {
+    "cjk_font_paths": [],          # 优先使用的字体文件（部署时指定），为空则在系统字体目录中查找
+    "extra_font_dirs": [],         # 额外查找的字体目录
+    "subset_on_save": True,        # 保存时子集化字体（仅保留用到的字形，需要 fontTools）
+}
+
+# 原生解析生成回显PDF的排版配置（A4，单位pt）
+PDF_LAYOUT_CONFIG = {
+    "page_width": 595,
+    "page_height": 842,
+    "margin_left": 40,
+    "margin_right": 40,
+    "margin_top": 50,
+    "margin_bottom": 42,
+    "fontsize": 10.5,
+    "line_spacing": 1.3,   # 行距 = 字体实际高度(ascender - descender) × 该系数
+}
+
+# Excel流式解析配置（read_only 逐行读取，按行窗口切分）
+EXCEL_STREAMING_CONFIG = {
+    "chunk_size": None,        # 行窗口字符上限，None 使用 splitter_config.chunk_size
+    # 位置记录粒度：
+    #   "row"  - 每行一条 {row, col, col_end, bbox}（默认，体积小）
+    #   "cell" - 每个非空单元格一条 {row, col, bbox}
+    "position_mode": "row",
+    "parallel_enabled": True,
+    "parallel_workers": None,      # 进程数，None 表示使用 CPU 核数（不超过sheet数）
+    "parallel_min_sheets": 4,      # sheet数达到该阈值才启用进程池并行
+    "start_method": "spawn",       # 进程启动方式，服务内含后台线程，默认 spawn 更安全
+}
+
+# 文件上传配置（流式落盘，不在内存中缓存整个文件）
+UPLOAD_CONFIG = {
+    "chunk_bytes": 1024 * 1024,        # 每次从上传流读取并写盘的字节数
+    "max_bytes": 500 * 1024 * 1024,    # 单个文件大小上限，超过返回413
+    "tmp_dir": None,                   # 临时文件目录，None 使用系统默认
+}
+
+# 上传去重配置（按文件sha256登记已入库的chunks）
+DEDUP_CONFIG = {
+    "enabled": True,
+    "db_path": str(Path(__file__).parent / "data" / "upload_registry.sqlite3"),
+    # 命中时的处理方式：
+    #   "relink" - 复制已有chunks（含向量）为本次上传知识的新chunks（knowledge_id/名称/标签等取本次上传），原知识不受影响
+    #   "skip"   - 不做任何修改，直接返回已有chunks数量
+    "mode": "relink",
+}
+
+# 文档入库后台任务配置（/api/document/process 异步模式）
+INGEST_JOB_CONFIG = {
+    "db_path": str(Path(__file__).parent / "data" / "ingest_jobs.sqlite3"),  # 任务持久化存储
+    "storage_dir": str(Path(__file__).parent / "data" / "ingest_jobs"),      # 任务上传文件暂存目录
+    "parse_workers": 2,        # 解析阶段（转换/解析/切分）线程数
+    "index_workers": 2,        # 入库阶段（向量化/写ES）线程数
+    "max_pending_index": 4,    # 已切分待入库的任务上限，超出时解析阶段等待
+    "keep_files": False,       # 任务结束后是否保留暂存的上传文件
+}
+
+# 转换后PDF存储配置（按源文件内容寻址缓存，回显路径为 <root>/<knowledge_id>/<filename>.pdf）
+CONVERTED_PDF_CONFIG = {
+    "root": str(Path(__file__).parent / "static" / "converted"),
+    "db_path": str(Path(__file__).parent / "data" / "converted_pdfs.sqlite3"),  # 产物与引用索引
+    "cache_enabled": True,
+    "gc_grace_seconds": 3600,      # GC只回收超过该时长未使用的无引用产物
+}
+
+# Office 原生解析的回显PDF生成（DOCX/PPTX/XLSX 的切分不依赖PDF，入库后再生成）
+VIEWER_PDF_CONFIG = {
+    "enabled": True,
+    "mode": "background",          # background: 入库后后台生成；on_demand: 首次请求下载接口时生成；eager: 解析时同步生成（同改动前）
+    "workers": 1,                  # 后台生成线程数
+    "db_path": str(Path(__file__).parent / "data" / "viewer_pdfs.sqlite3"),  # 待生成任务（服务重启后继续）
+    "sources_dir": str(Path(__file__).parent / "data" / "viewer_sources"),   # 待生成期间保留的源文件副本（按sha256命名）
+    "wait_timeout": 300,           # 下载接口等待同一文件正在进行的生成的秒数
+}
+
+# LibreOffice常驻转换进程池配置（Office → PDF）
+LIBREOFFICE_POOL_CONFIG = {
+    "enabled": True,
+    "soffice_path": None,          # soffice 路径，None 自动探测
+    "workers": 2,                  # 常驻 soffice 进程数
+    "queue_size": 32,              # 排队任务上限
+    "queue_wait": 30,              # 队列已满时提交等待的秒数，超时报错
+    "job_timeout": 180,            # 单个文件转换超时（秒），超时强制结束并重启该worker
+    "start_timeout": 60,           # 单个worker启动并建立UNO连接的超时（秒）
+    "max_jobs_per_worker": 200,    # 每个worker转换该数量文件后重启，避免内存持续增长
+    "profile_root": str(Path(__file__).parent / "data" / "lo_profiles"),  # 各worker独立的用户配置目录
+    "use_uno": True,               # 无法导入uno时自动退化为单次soffice转换
+}
+
+# PDF块级提取配置（extract_documents_with_block_positions）
+PDF_EXTRACT_CONFIG = {
+    "parallel_enabled": True,
+    "parallel_workers": None,     # 进程数，None 表示使用 CPU 核数
+    "parallel_min_pages": 64,     # 页数达到该阈值才启用进程池并行
+    "ranges_per_worker": 4,       # 每个进程分到的页区间数，便于负载均衡
+    "start_method": "spawn",      # 进程启动方式，服务内含后台线程，默认 spawn 更安全
+    "default_profile": "text",    # 提取配置档，见 PDF_EXTRACT_PROFILES
+    # 按源文件类型选择配置档（未列出的类型用 default_profile）；需要字体/图片的下游会自动升级配置档
+    "profile_by_type": {
+        ".pdf": "text",
+        ".hwp": "text",
+        ".hwpx": "text",
+    },
+}
+
+# PDF提取配置档：PyMuPDF 文本标志、裁剪区域与输出字段
+# flags 取值：preserve_ligatures / preserve_whitespace / preserve_images / inhibit_spaces / dehyphenate / preserve_spans / mediabox_clip
+# clip_margins：裁掉页面四周的边距（pt），如 {"top": 40, "bottom": 40} 可去掉页眉页脚；None 表示整页
+PDF_EXTRACT_PROFILES = {
+    # 只要文本与bbox：不解码图片，span不带字体信息
+    "text": {
+        "flags": ["preserve_ligatures", "preserve_whitespace", "mediabox_clip"],
+        "fonts": False,
+        "images": False,
+        "clip_margins": None,
+    },
+    # 带字体名与字号（标题识别等）
+    "fonts": {
+        "flags": ["preserve_ligatures", "preserve_whitespace", "mediabox_clip"],
+        "fonts": True,
+        "images": False,
+        "clip_margins": None,
+    },
+    # 另外输出图片块的位置（PyMuPDF需解码图片，最慢）
+    "images": {
+        "flags": ["preserve_ligatures", "preserve_whitespace", "mediabox_clip", "preserve_images"],
+        "fonts": True,
+        "images": True,
+        "clip_margins": None,
+    },
+}
+
 # Embedding模型配置
 EMBEDDING_CONFIG = {
     "model_name": "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
     "device": "cpu"
 }
 
+# Embedding批量调用配置（入库时按批次请求向量接口）
+EMBEDDING_BATCH_CONFIG = {
+    "batch_size": 64,       # 每次请求携带的文本条数（input 字段为列表）
+    "max_in_flight": 4,     # 同时在途的批次数上限
+    "timeout": 60,          # 单批请求超时（秒）
+}
+
+# Embedding缓存配置（按 模型+归一化文本哈希 缓存向量，内存LRU + 本地sqlite）
+EMBEDDING_CACHE_CONFIG = {
+    "enabled": True,
+    "db_path": str(Path(__file__).parent / "cache" / "embeddings.sqlite3"),
+    "memory_items": 20000,   # 内存LRU层最多缓存的向量条数
+    "max_disk_mb": 2048,     # sqlite中向量数据的磁盘上限，超过后按最久未访问淘汰
+}
+
+# 问题向量缓存（/api/rag/chat，纯内存 TTL + LRU；问题按全角/半角、大小写、空白归一化后作为键）
+QUERY_EMBEDDING_CACHE_CONFIG = {
+    "enabled": True,
+    "max_items": 5000,     # 最多缓存的问题数，超过后淘汰最久未使用的
+    "ttl_seconds": 3600,   # 过期时间；更换向量模型时按模型名区分，无需清空
+}
+
+# 语义答案缓存（/api/rag/chat）：相似问题直接返回缓存的答案与引用，不调用大模型
+ANSWER_CACHE_CONFIG = {
+    "enabled": True,
+    "db_path": str(Path(__file__).parent / "cache" / "answer_cache.sqlite3"),
+    "similarity_threshold": 0.95,   # 问题向量余弦相似度阈值，过低会把不同问题当成同一问题
+    "max_entries": 5000,            # 超过后按最近命中时间淘汰
+    "ttl_seconds": 7 * 86400,
+    "invalidate_unscoped_on_ingest": True,  # 任一知识入库时作废未限定文件的问题（新内容可能改变答案）
+}
+
+# RAG流式问答（/api/rag/chat/stream，SSE）：先推送引用，再逐段推送答案
+RAG_STREAM_CONFIG = {
+    "heartbeat_seconds": 15,   # 无数据超过该时长发送SSE注释心跳，避免代理/负载均衡断开空闲连接
+    "metrics_window": 1000,    # 首字延迟等耗时统计保留的最近样本数
+}
+
 # RAG配置
 RAG_CONFIG = {
     "top_k": 3,  # 检索最相近的文档数量（从5改为3）
     "context_limit": 500  # 上下文长度限制
 }
 
+# RAG检索配置
+RETRIEVAL_CONFIG = {
+    # script_score：对过滤后的全部文档逐个计算余弦相似度（精确，耗时随文档量线性增长）
+    # knn：ES原生近似kNN（HNSW图），过滤条件在kNN内部生效；需要 embedding 字段已建索引
+    # （见 scripts/setup_es_knowledge_chunks.py --migrate-knn）
+    # hybrid：content 上的BM25 match 与向量检索两路并发，按倒数排名融合（RRF）
+    # 请求可单独指定
+    "mode": "script_score",
+    "vector_field": "embedding",
+    "num_candidates": 100,         # 每个分片的候选数，越大召回越高、越慢；不小于返回条数
+    "max_num_candidates": 10000,   # ES上限
+    "similarity": "cosine",        # 与索引映射一致；cosine 的kNN得分 (1+cos)/2 会换算为 script_score 的 1+cos
+    "fallback_to_script_score": True,  # kNN查询失败（如字段未建索引）时退回 script_score
+    # 迁移脚本建索引时使用的HNSW参数
+    "index_options": {"type": "hnsw", "m": 16, "ef_construction": 100},
+    # 混合检索（mode = "hybrid"）
+    "hybrid": {
+        "vector_mode": "script_score",  # 向量一路的检索方式：script_score | knn
+        "bm25_size": 20,                # BM25一路取前N条参与融合
+        "vector_size": 20,              # 向量一路取前N条参与融合
+        "bm25_weight": 1.0,             # 融合得分 = Σ weight / (rrf_k + 排名)
+        "vector_weight": 1.0,
+        "rrf_k": 60,
+        # 服务端 rank.rrf：auto 时在向量一路为knn且两路权重相同时尝试，不可用（版本/许可证）则改用客户端融合
+        "server_side_rrf": "auto",
+        "leg_workers": 8,               # 并发执行两路查询的线程数（进程内共用）
+    },
+}
+
 # PyMuPDF Pro 配置
 PYMUPDF_PRO_CONFIG = {
     "enabled": True,
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+转换后PDF的内容寻址存储
+- 产物按 (源文件sha256, 转换器标识) 命名存放在 static/converted/_cas/<前两位>/<key>.pdf，
+  内容相同的源文件再次转换时直接命中
+- 引用索引：(knowledge_id, filename) → key，回显使用的 static/converted/<knowledge_id>/<filename>.pdf
+  由CAS产物硬链接（不支持时复制）得到；路径保留原扩展名，a.docx 与 a.pptx 不再共用同一个回显文件
+- 产物可附带元数据（如原生渲染时得到的positions），命中缓存时一并返回
+- GC：删除不再被任何引用指向的产物
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from config import CONVERTED_PDF_CONFIG
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def viewer_pdf_path(root: str, knowledge_id: Any, filename: str) -> str:
+    """回显PDF路径：<root>/<knowledge_id>/<filename>.pdf（如 a.docx → a.docx.pdf）"""
+    return os.path.join(root, str(knowledge_id), Path(filename).name + ".pdf")
+
+
+def find_viewer_pdf(root: str, knowledge_id: Any, filename: str) -> Optional[str]:
+    """
+    查找已存在的回显PDF；改动前生成的文件在 <root>/<knowledge_id>/<stem>.pdf，只作读取时的兜底
+    """
+    for path in (viewer_pdf_path(root, knowledge_id, filename),
+                 os.path.join(root, str(knowledge_id), Path(filename).stem + ".pdf")):
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def hash_file(path: str, chunk_bytes: int = 1024 * 1024) -> str:
+    """流式计算文件sha256"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_bytes), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class ConvertedPdfStore:
+    """转换后PDF的内容寻址存储与引用索引"""
+
+    def __init__(self, root: str, db_path: str):
+        self.root = root
+        self.cas_root = os.path.join(root, "_cas")
+        os.makedirs(self.cas_root, exist_ok=True)
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pdf_artifacts (
+                cas_key TEXT PRIMARY KEY,
+                source_sha256 TEXT NOT NULL,
+                converter TEXT NOT NULL,
+                size INTEGER NOT NULL DEFAULT 0,
+                meta TEXT,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pdf_refs (
+                knowledge_id TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                cas_key TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (knowledge_id, filename)
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_pdf_refs_key ON pdf_refs(cas_key)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(source_sha256: str, converter: str) -> str:
+        # 转换器标识参与命名：渲染逻辑升级时更换标识即可使旧产物失效
+        return f"{source_sha256}-{converter}"
+
+    def cas_path(self, cas_key: str) -> str:
+        return os.path.join(self.cas_root, cas_key[:2], f"{cas_key}.pdf")
+
+    def named_path(self, knowledge_id: Any, filename: str) -> str:
+        return viewer_pdf_path(self.root, knowledge_id, filename)
+
+    def lookup(self, source_sha256: str, converter: str) -> Optional[Dict[str, Any]]:
+        """查找已转换的产物，返回 {"cas_key", "path", "meta"}；文件已丢失时清理记录并返回None"""
+        cas_key = self.make_key(source_sha256, converter)
+        with self._lock:
+            row = self._conn.execute("SELECT meta FROM pdf_artifacts WHERE cas_key = ?", (cas_key,)).fetchone()
+        if not row:
+            return None
+        path = self.cas_path(cas_key)
+        if not os.path.exists(path):
+            with self._lock:
+                self._conn.execute("DELETE FROM pdf_artifacts WHERE cas_key = ?", (cas_key,))
+                self._conn.commit()
+            return None
+        with self._lock:
+            self._conn.execute("UPDATE pdf_artifacts SET last_used = ? WHERE cas_key = ?", (time.time(), cas_key))
+            self._conn.commit()
+        return {"cas_key": cas_key, "path": path, "meta": json.loads(row["meta"]) if row["meta"] else None}
+
+    def put(self, source_sha256: str, converter: str, pdf_path: str, meta: Optional[Dict[str, Any]] = None) -> str:
+        """将转换结果放入CAS（先写临时文件再原子替换），返回 cas_key"""
+        cas_key = self.make_key(source_sha256, converter)
+        target = self.cas_path(cas_key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = f"{target}.{uuid.uuid4().hex}.tmp"
+        shutil.copyfile(pdf_path, tmp)
+        os.replace(tmp, target)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO pdf_artifacts (cas_key, source_sha256, converter, size, meta, created_at, last_used)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(cas_key) DO UPDATE SET size = excluded.size, meta = excluded.meta, last_used = excluded.last_used
+                """,
+                (cas_key, source_sha256, converter, os.path.getsize(target),
+                 json.dumps(meta, ensure_ascii=False) if meta is not None else None, now, now),
+            )
+            self._conn.commit()
+        return cas_key
+
+    def link(self, knowledge_id: Any, filename: str, cas_key: str) -> str:
+        """登记引用并在回显路径上物化产物（硬链接，不支持时复制），返回回显路径"""
+        source = self.cas_path(cas_key)
+        target = self.named_path(knowledge_id, filename)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = f"{target}.{uuid.uuid4().hex}.tmp"
+        try:
+            os.link(source, tmp)
+        except OSError:
+            shutil.copyfile(source, tmp)
+        os.replace(tmp, target)
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO pdf_refs (knowledge_id, filename, cas_key, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(knowledge_id, filename) DO UPDATE SET cas_key = excluded.cas_key, updated_at = excluded.updated_at
+                """,
+                (str(knowledge_id), filename, cas_key, time.time()),
+            )
+            self._conn.commit()
+        return target
+
+    def resolve(self, knowledge_id: Any, filename: str) -> Optional[str]:
+        """返回 (knowledge_id, filename) 引用的产物key"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT cas_key FROM pdf_refs WHERE knowledge_id = ? AND filename = ?", (str(knowledge_id), filename)
+            ).fetchone()
+        return row["cas_key"] if row else None
+
+    def unlink(self, knowledge_id: Any, filename: str):
+        """删除引用与回显路径上的文件（CAS产物由GC回收）"""
+        with self._lock:
+            self._conn.execute("DELETE FROM pdf_refs WHERE knowledge_id = ? AND filename = ?", (str(knowledge_id), filename))
+            self._conn.commit()
+        try:
+            os.remove(self.named_path(knowledge_id, filename))
+        except FileNotFoundError:
+            pass
+
+    def gc(self, grace_seconds: float = 3600, dry_run: bool = False) -> Dict[str, Any]:
+        """
+        回收未被引用的产物
+        - 回显路径文件已被删除的引用视为失效
+        - 仅回收超过 grace_seconds 未使用的产物，避免与正在进行的转换竞争
+        - CAS目录中没有记录的孤立文件一并清理
+        """
+        removed_refs = 0
+        with self._lock:
+            refs = self._conn.execute("SELECT knowledge_id, filename FROM pdf_refs").fetchall()
+        for ref in refs:
+            if not os.path.exists(self.named_path(ref["knowledge_id"], ref["filename"])):
+                removed_refs += 1
+                if not dry_run:
+                    with self._lock:
+                        self._conn.execute("DELETE FROM pdf_refs WHERE knowledge_id = ? AND filename = ?",
+                                           (ref["knowledge_id"], ref["filename"]))
+                        self._conn.commit()
+
+        cutoff = time.time() - grace_seconds
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT a.cas_key, a.size FROM pdf_artifacts a
+                WHERE a.last_used < ? AND NOT EXISTS (SELECT 1 FROM pdf_refs r WHERE r.cas_key = a.cas_key)
+                """,
+                (cutoff,),
+            ).fetchall()
+            known = {r["cas_key"] for r in self._conn.execute("SELECT cas_key FROM pdf_artifacts")}
+
+        removed, freed = 0, 0
+        for row in rows:
+            removed += 1
+            freed += row["size"]
+            if dry_run:
+                continue
+            try:
+                os.remove(self.cas_path(row["cas_key"]))
+            except FileNotFoundError:
+                pass
+            with self._lock:
+                self._conn.execute("DELETE FROM pdf_artifacts WHERE cas_key = ?", (row["cas_key"],))
+                self._conn.commit()
+
+        orphans = 0
+        for dirpath, _, names in os.walk(self.cas_root):
+            for name in names:
+                path = os.path.join(dirpath, name)
+                if name.endswith(".pdf") and name[:-4] in known:
+                    continue
+                if os.path.getmtime(path) >= cutoff:
+                    continue
+                orphans += 1
+                freed += os.path.getsize(path)
+                if not dry_run:
+                    os.remove(path)
+
+        result = {"removed_refs": removed_refs, "removed_artifacts": removed, "removed_orphans": orphans,
+                  "freed_bytes": freed, "dry_run": dry_run}
+        logger.info(f"转换PDF GC完成: {result}")
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            artifacts, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pdf_artifacts").fetchone()
+            refs = self._conn.execute("SELECT COUNT(*) FROM pdf_refs").fetchone()[0]
+        return {"artifacts": artifacts, "artifact_bytes": size, "refs": refs}
+
+
+def convert_with_cache(store: Optional[ConvertedPdfStore],
+                       src_path: str,
+                       knowledge_id: Any,
+                       filename: str,
+                       converter: str,
+                       produce: Callable[[str], Optional[Dict[str, Any]]],
+                       source_sha256: Optional[str] = None) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """
+    带缓存的转换：命中时直接物化已有产物，否则调用 produce(out_path) 生成PDF（返回值作为元数据保存）
+    返回 (回显路径, 元数据)；store 为空时退化为直接生成到回显路径
+    """
+    if store is None:
+        target = viewer_pdf_path(CONVERTED_PDF_CONFIG["root"], knowledge_id, filename)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        return target, produce(target)
+
+    sha = source_sha256 or hash_file(src_path)
+    hit = store.lookup(sha, converter)
+    if hit:
+        logger.info(f"转换PDF缓存命中: {filename} ({converter})")
+        return store.link(knowledge_id, filename, hit["cas_key"]), hit["meta"]
+
+    staging_dir = os.path.join(store.cas_root, "_staging", uuid.uuid4().hex)
+    os.makedirs(staging_dir, exist_ok=True)
+    try:
+        out_path = os.path.join(staging_dir, Path(filename).stem + ".pdf")
+        meta = produce(out_path)
+        cas_key = store.put(sha, converter, out_path, meta)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    return store.link(knowledge_id, filename, cas_key), meta
+
+
+# 全局存储实例
+converted_pdf_store = None
+_converted_pdf_store_initialized = False
+
+def init_converted_pdf_store() -> Optional[ConvertedPdfStore]:
+    """初始化转换PDF存储（配置关闭时返回None）"""
+    global converted_pdf_store, _converted_pdf_store_initialized
+    _converted_pdf_store_initialized = True
+    if not CONVERTED_PDF_CONFIG.get("cache_enabled", True):
+        logger.info("转换PDF内容寻址缓存已关闭")
+        return None
+    converted_pdf_store = ConvertedPdfStore(CONVERTED_PDF_CONFIG["root"], CONVERTED_PDF_CONFIG["db_path"])
+    logger.info(f"转换PDF存储初始化成功: {CONVERTED_PDF_CONFIG['root']}")
+    return converted_pdf_store
+
+def get_converted_pdf_store() -> Optional[ConvertedPdfStore]:
+    """获取转换PDF存储实例（未启用时为None）"""
+    global converted_pdf_store
+    if converted_pdf_store is None and not _converted_pdf_store_initialized:
+        converted_pdf_store = init_converted_pdf_store()
+    return converted_pdf_store
@@ -106,6 +106,7 @@ class CustomAIClient:
             yield {"error": "自定义AI API未配置，请先设置API地址"}
             return
         
+        response = None
         try:
             payload = {
                 "model": model,
@@ -148,6 +149,10 @@ class CustomAIClient:
         except Exception as e:
             logger.error(f"流式API调用异常: {str(e)}")
             yield {"error": f"流式API调用异常: {str(e)}"}
+        finally:
+            # 调用方提前关闭生成器（如客户端断开）时释放连接，上游随之停止生成
+            if response is not None:
+                response.close()
     
     def get_embeddings(self, texts: List[str], model: str = "multilingual-e5-large-instruct") -> Dict[str, Any]:
         """
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DOCX → 回显PDF 单遍排版
+- 按文档顺序遍历正文（段落与表格交错），不再先画完所有段落再画表格
+- 段落经 pdf_layout.PageFlow 实测换行与行高，得到实际占用的bbox；跨页段落按页拆分
+- 表格逐行排版：单元格分列换行，行高取最高单元格，整行作为一个位置记录
+- 返回的位置记录带有在全文中的字符区间，分块时直接按偏移分配
+- extract_docx_text 只取全文不排版，供入库时先切分、回显PDF之后再生成
+"""
+
+import logging
+import os
+from typing import Dict, List, Tuple
+
+import fitz  # PyMuPDF
+
+from font_registry import get_font_registry
+from pdf_layout import PageFlow, merge_segments_by_page
+
+try:
+    from docx import Document as DocxDocument
+    from docx.table import Table
+    DOCX_AVAILABLE = True
+except ImportError:
+    DOCX_AVAILABLE = False
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 标题样式字号（pt），其余段落使用 PDF_LAYOUT_CONFIG["fontsize"]
+HEADING_FONT_SIZES = {
+    "Title": 18.0,
+    "Heading 1": 16.0,
+    "Heading 2": 14.0,
+    "Heading 3": 12.5,
+}
+
+
+def _paragraph_fontsize(paragraph, default: float) -> float:
+    try:
+        name = paragraph.style.name if paragraph.style is not None else ""
+    except Exception:
+        name = ""
+    return HEADING_FONT_SIZES.get(name, default)
+
+
+def _row_cells(row) -> List[str]:
+    """行内单元格文本；横向合并的单元格在 row.cells 中重复出现，只取一次"""
+    texts = []
+    last_tc = None
+    for cell in row.cells:
+        if cell._tc is last_tc:
+            continue
+        last_tc = cell._tc
+        texts.append(cell.text.strip())
+    return texts
+
+
+def _iter_blocks(docx):
+    """
+    按文档顺序产出正文块：
+    ("row", 单元格文本列表, 行文本) / ("table_end", None, "") / ("paragraph", 段落, 段落文本)
+    行文本为空白的表格行不产出；空白段落照常产出（排版时占位）
+    """
+    for block in docx.iter_inner_content():
+        if isinstance(block, Table):
+            for row in block.rows:
+                cells = _row_cells(row)
+                row_text = "\t".join(cells)
+                if row_text.strip():
+                    yield "row", cells, row_text
+            yield "table_end", None, ""
+        else:
+            yield "paragraph", block, block.text
+
+
+def extract_docx_text(src_path: str) -> str:
+    """
+    只提取全文（不排版），与 render_docx_to_pdf 返回的 full_text 完全一致，
+    切分得到的字符区间可在之后生成PDF时直接对应到位置记录
+    """
+    if not DOCX_AVAILABLE:
+        raise RuntimeError("缺少python-docx，无法原生解析Word。请安装: pip install python-docx")
+    docx = DocxDocument(src_path)
+    return "\n".join(text for kind, _, text in _iter_blocks(docx) if kind != "table_end" and text.strip())
+
+
+def render_docx_to_pdf(src_path: str, out_path: str) -> Tuple[List[Dict], str]:
+    """
+    将DOCX按文档顺序排版写入PDF
+    Returns:
+        (positions, full_text)
+        positions: [{"text", "bbox", "page", "char_start", "char_end"}]，char_* 为在 full_text 中的区间
+        full_text: 各段落/表格行文本以换行拼接（空段落不计入）
+    """
+    if not DOCX_AVAILABLE:
+        raise RuntimeError("缺少python-docx，无法原生解析Word。请安装: pip install python-docx")
+
+    docx = DocxDocument(src_path)
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    pdf = fitz.open()
+    flow = PageFlow(pdf)
+    paragraph_gap = flow.fontsize * 0.5
+
+    texts: List[str] = []
+    positions: List[Dict] = []
+    offset = 0
+
+    def record(text: str, segments):
+        nonlocal offset
+        for page_no, bbox, start, end in segments:
+            positions.append({
+                "text": text[start:end],
+                "bbox": bbox,
+                "page": page_no,
+                "char_start": offset + start,
+                "char_end": offset + end,
+            })
+        texts.append(text)
+        offset += len(text) + 1
+
+    for kind, block, text in _iter_blocks(docx):
+        if kind == "row":
+            record(text, flow.add_row(block))
+            continue
+        if kind == "table_end":
+            flow.add_gap(paragraph_gap)
+            continue
+
+        if not text.strip():
+            # 空段落只占位，与原排版一致
+            flow.add_gap(paragraph_gap)
+            continue
+        fontsize = _paragraph_fontsize(block, flow.fontsize)
+        # 段内软回车（<w:br/>）单独起行，偏移仍相对整段文本
+        segments = []
+        base = 0
+        for line in text.split("\n"):
+            segments += [(pg, bbox, base + s, base + e) for pg, bbox, s, e in flow.add_line(line, fontsize=fontsize)]
+            base += len(line) + 1
+        record(text, merge_segments_by_page(segments))
+        flow.add_gap(paragraph_gap)
+
+    flow.finish()
+    get_font_registry().save(pdf, out_path, used_chars=flow.used_chars)
+    pdf.close()
+    return positions, "\n".join(texts)
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Embedding 缓存
+以 (模型, 归一化文本哈希) 为键，内存LRU + 本地sqlite两级存储，
+按磁盘占用大小淘汰最久未访问的条目，并统计命中/未命中次数。
+另有问答用的问题向量缓存（QueryEmbeddingCache）：纯内存 TTL + LRU，
+问题按全角/半角、大小写、空白归一化后作为键，重复或仅写法不同的问题不再请求向量接口。
+"""
+
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence
+
+from config import EMBEDDING_CACHE_CONFIG, QUERY_EMBEDDING_CACHE_CONFIG
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """归一化文本：统一Unicode组合形式与换行符，并去掉首尾空白"""
+    text = unicodedata.normalize("NFC", text or "")
+    return text.replace("\r\n", "\n").replace("\r", "\n").strip()
+
+
+# 中文字符/全角标点两侧的空白不影响语义
+_CJK_SPACE_RE = re.compile(r"\s*([\u2e80-\u9fff\u3000-\u303f\uf900-\ufaff\uff00-\uffef])\s*")
+_SPACE_RE = re.compile(r"\s+")
+# 句末标点（NFKC之后）
+_TRAILING_PUNCT = "?？!！.。~～、,，;；:："
+
+
+def normalize_query(text: str) -> str:
+    """
+    问题文本归一化：NFKC（全角字母数字/标点转半角）、casefold、空白合并，
+    去掉中文字符两侧的空白与句末标点
+    """
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    text = _SPACE_RE.sub(" ", text).strip()
+    text = _CJK_SPACE_RE.sub(r"\1", text)
+    return text.rstrip(_TRAILING_PUNCT + " ")
+
+
+class EmbeddingCache:
+    """两级 Embedding 缓存（内存LRU + sqlite）"""
+
+    def __init__(self, db_path: str, memory_items: int = 20000, max_disk_bytes: int = 2 * 1024 ** 3):
+        self.db_path = db_path
+        self.memory_items = max(0, int(memory_items))
+        self.max_disk_bytes = max(0, int(max_disk_bytes))
+
+        self._lock = threading.Lock()
+        # 内存层保存 float32 数组（1536维约6KB/条），返回时再转为list
+        self._memory: "OrderedDict[str, array]" = OrderedDict()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "puts": 0, "evictions": 0}
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                dims INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings(last_access)")
+        self._conn.commit()
+        self._disk_bytes = int(self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0])
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        """缓存键：模型名 + 归一化文本的sha256"""
+        digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+        return f"{model}:{digest}"
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        return self.get_many(model, [text])[0]
+
+    def put(self, model: str, text: str, vector: Sequence[float]):
+        self.put_many(model, [text], [vector])
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """批量查询，返回与输入等长的列表，未命中位置为None；每个位置都是新建的list，调用方可自由修改"""
+        keys = [self.make_key(model, t) for t in texts]
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        with self._lock:
+            disk_lookup: Dict[str, List[int]] = {}
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    results[i] = vector.tolist()
+                    self._stats["memory_hits"] += 1
+                else:
+                    disk_lookup.setdefault(key, []).append(i)
+
+            if disk_lookup:
+                found = self._load_from_disk(list(disk_lookup.keys()))
+                for key, positions in disk_lookup.items():
+                    vector = found.get(key)
+                    if vector is None:
+                        self._stats["misses"] += len(positions)
+                        continue
+                    self._remember(key, vector)
+                    self._stats["disk_hits"] += len(positions)
+                    for i in positions:
+                        results[i] = vector.tolist()
+        return results
+
+    def put_many(self, model: str, texts: List[str], vectors: List[Optional[Sequence[float]]]):
+        """批量写入，跳过空向量"""
+        now = time.time()
+        rows = []
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                if not vector:
+                    continue
+                key = self.make_key(model, text)
+                vec = array("f", vector)
+                blob = vec.tobytes()
+                rows.append((key, model, len(vec), blob, len(blob), now))
+                self._remember(key, vec)
+            if not rows:
+                return
+            try:
+                existing = self._sizes_of([r[0] for r in rows])
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, model, dims, vector, size, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+                self._conn.commit()
+                self._disk_bytes += sum(r[4] for r in rows) - sum(existing.values())
+                self._stats["puts"] += len(rows)
+                self._evict_disk_if_needed()
+            except Exception as e:
+                logger.error(f"写入embedding缓存失败: {e}")
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            hits = self._stats["memory_hits"] + self._stats["disk_hits"]
+            total = hits + self._stats["misses"]
+            return {
+                **self._stats,
+                "hits": hits,
+                "hit_rate": round(hits / total, 4) if total else 0.0,
+                "memory_items": len(self._memory),
+                "disk_bytes": self._disk_bytes,
+                "max_disk_bytes": self.max_disk_bytes,
+            }
+
+    def _remember(self, key: str, vector: array):
+        if self.memory_items <= 0:
+            return
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _load_from_disk(self, keys: List[str]) -> Dict[str, array]:
+        found: Dict[str, array] = {}
+        try:
+            # sqlite 单条语句的参数个数有限，分段查询
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                marks = ",".join("?" * len(part))
+                for key, blob in self._conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({marks})", part):
+                    vec = array("f")
+                    vec.frombytes(blob)
+                    found[key] = vec
+                if found:
+                    now = time.time()
+                    self._conn.executemany(
+                        "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                        [(now, k) for k in part if k in found],
+                    )
+            self._conn.commit()
+        except Exception as e:
+            logger.error(f"读取embedding缓存失败: {e}")
+        return found
+
+    def _sizes_of(self, keys: List[str]) -> Dict[str, int]:
+        sizes: Dict[str, int] = {}
+        for start in range(0, len(keys), 500):
+            part = keys[start:start + 500]
+            marks = ",".join("?" * len(part))
+            for key, size in self._conn.execute(f"SELECT key, size FROM embeddings WHERE key IN ({marks})", part):
+                sizes[key] = int(size)
+        return sizes
+
+    def _evict_disk_if_needed(self):
+        """超过磁盘上限时，按最久未访问淘汰到上限的90%"""
+        if not self.max_disk_bytes or self._disk_bytes <= self.max_disk_bytes:
+            return
+        target = int(self.max_disk_bytes * 0.9)
+        removed = 0
+        cursor = self._conn.execute("SELECT key, size FROM embeddings ORDER BY last_access ASC")
+        victims = []
+        for key, size in cursor:
+            if self._disk_bytes <= target:
+                break
+            victims.append((key,))
+            self._disk_bytes -= int(size)
+            self._memory.pop(key, None)
+            removed += 1
+        cursor.close()
+        self._conn.executemany("DELETE FROM embeddings WHERE key = ?", victims)
+        self._conn.commit()
+        self._stats["evictions"] += removed
+        logger.info(f"embedding缓存淘汰 {removed} 条，当前磁盘占用 {self._disk_bytes} 字节")
+
+
+class QueryEmbeddingCache:
+    """问题向量缓存（内存 TTL + LRU）"""
+
+    def __init__(self, max_items: int = 5000, ttl_seconds: float = 3600):
+        self.max_items = max(1, int(max_items))
+        self.ttl_seconds = float(ttl_seconds)
+        self._lock = threading.Lock()
+        # 键 → (向量, 过期时间)
+        self._items: "OrderedDict[str, tuple]" = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0, "puts": 0}
+        self._compute_ms_total = 0.0
+        self._computes = 0
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        return f"{model}:{normalize_query(text)}"
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        key = self.make_key(model, text)
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[1] <= now:
+                del self._items[key]
+                self._stats["expired"] += 1
+                item = None
+            if item is None:
+                self._stats["misses"] += 1
+                return None
+            self._items.move_to_end(key)
+            self._stats["hits"] += 1
+            # 返回副本，调用方修改不影响缓存
+            return list(item[0])
+
+    def put(self, model: str, text: str, vector: Optional[Sequence[float]]):
+        if not vector:
+            return
+        key = self.make_key(model, text)
+        with self._lock:
+            self._items[key] = (list(vector), time.monotonic() + self.ttl_seconds)
+            self._items.move_to_end(key)
+            self._stats["puts"] += 1
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def get_or_compute(self, model: str, text: str,
+                       compute: Callable[[str], Optional[List[float]]]) -> Optional[List[float]]:
+        """命中直接返回；未命中时调用 compute 取向量并写入（记录耗时，用于估算命中节省的时间）"""
+        vector = self.get(model, text)
+        if vector is not None:
+            return vector
+        t0 = time.perf_counter()
+        vector = compute(text)
+        elapsed = (time.perf_counter() - t0) * 1000
+        with self._lock:
+            self._compute_ms_total += elapsed
+            self._computes += 1
+        self.put(model, text, vector)
+        return vector
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self._stats["hits"] + self._stats["misses"]
+            avg_ms = self._compute_ms_total / self._computes if self._computes else 0.0
+            return {
+                **self._stats,
+                "hit_rate": round(self._stats["hits"] / total, 4) if total else 0.0,
+                "items": len(self._items),
+                "max_items": self.max_items,
+                "ttl_seconds": self.ttl_seconds,
+                "avg_miss_ms": round(avg_ms, 1),
+                "saved_ms_estimate": round(avg_ms * self._stats["hits"], 1),
+            }
+
+
+# 全局缓存实例
+embedding_cache = None
+_embedding_cache_initialized = False
+
+def init_embedding_cache() -> Optional[EmbeddingCache]:
+    """初始化Embedding缓存（配置关闭时返回None）"""
+    global embedding_cache, _embedding_cache_initialized
+    _embedding_cache_initialized = True
+    if not EMBEDDING_CACHE_CONFIG.get("enabled", True):
+        logger.info("Embedding缓存已关闭")
+        return None
+    try:
+        embedding_cache = EmbeddingCache(
+            EMBEDDING_CACHE_CONFIG["db_path"],
+            memory_items=EMBEDDING_CACHE_CONFIG.get("memory_items", 20000),
+            max_disk_bytes=int(EMBEDDING_CACHE_CONFIG.get("max_disk_mb", 2048)) * 1024 * 1024,
+        )
+        logger.info(f"Embedding缓存初始化成功: {EMBEDDING_CACHE_CONFIG['db_path']}")
+    except Exception as e:
+        logger.error(f"Embedding缓存初始化失败，将直接调用向量接口: {e}")
+        embedding_cache = None
+    return embedding_cache
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """获取Embedding缓存实例（未启用或初始化失败时为None）"""
+    if not _embedding_cache_initialized:
+        init_embedding_cache()
+    return embedding_cache
+
+
+# 全局问题向量缓存实例
+query_embedding_cache = None
+_query_embedding_cache_initialized = False
+_query_embedding_cache_lock = threading.Lock()
+
+def get_query_embedding_cache() -> Optional[QueryEmbeddingCache]:
+    """获取问题向量缓存实例（未启用时为None）"""
+    global query_embedding_cache, _query_embedding_cache_initialized
+    if not _query_embedding_cache_initialized:
+        with _query_embedding_cache_lock:
+            if not _query_embedding_cache_initialized:
+                if QUERY_EMBEDDING_CACHE_CONFIG.get("enabled", True):
+                    query_embedding_cache = QueryEmbeddingCache(
+                        max_items=QUERY_EMBEDDING_CACHE_CONFIG.get("max_items", 5000),
+                        ttl_seconds=QUERY_EMBEDDING_CACHE_CONFIG.get("ttl_seconds", 3600),
+                    )
+                # 实例创建后再置标志，并发的首次调用不会拿到None
+                _query_embedding_cache_initialized = True
+    return query_embedding_cache
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Elasticsearch 批量写入工具
+基于 _bulk API（streaming_bulk / parallel_bulk），按字节大小切批，
+逐条汇总成功与失败，并支持大批量入库期间临时关闭 refresh_interval。
+"""
+
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional
+
+from elasticsearch import Elasticsearch
+from elasticsearch.helpers import parallel_bulk, streaming_bulk
+
+from config import ES_BULK_CONFIG
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 进程内各索引关闭 refresh 的写入数与关闭前的原值：{索引: {"count", "previous"}}
+_refresh_holders: Dict[str, Dict[str, Any]] = {}
+_refresh_lock = threading.Lock()
+
+
+class ESBulkWriter:
+    """ES批量写入器"""
+
+    def __init__(self,
+                 es_client: Elasticsearch,
+                 index: str,
+                 max_chunk_bytes: Optional[int] = None,
+                 chunk_size: Optional[int] = None,
+                 thread_count: Optional[int] = None,
+                 max_retries: Optional[int] = None):
+        self.es_client = es_client
+        self.index = index
+        self.max_chunk_bytes = int(max_chunk_bytes or ES_BULK_CONFIG.get("max_chunk_bytes", 10 * 1024 * 1024))
+        self.chunk_size = int(chunk_size or ES_BULK_CONFIG.get("chunk_size", 500))
+        self.thread_count = int(thread_count or ES_BULK_CONFIG.get("thread_count", 1))
+        self.max_retries = int(ES_BULK_CONFIG.get("max_retries", 2) if max_retries is None else max_retries)
+
+    def write(self, actions: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        执行批量写入
+
+        Args:
+            actions: bulk动作，格式同 elasticsearch.helpers（_op_type/_index/_id/_source 等）
+
+        Returns:
+            {"success": [成功的_id], "failed": [{"id", "op", "status", "error"}]}
+        """
+        actions = (self._with_default_index(a) for a in actions)
+        if self.thread_count > 1:
+            # parallel_bulk 不支持重试，多线程模式下由调用方根据 failed 自行处理
+            results = parallel_bulk(
+                self.es_client,
+                actions,
+                thread_count=self.thread_count,
+                chunk_size=self.chunk_size,
+                max_chunk_bytes=self.max_chunk_bytes,
+                raise_on_error=False,
+                raise_on_exception=False,
+            )
+        else:
+            results = streaming_bulk(
+                self.es_client,
+                actions,
+                chunk_size=self.chunk_size,
+                max_chunk_bytes=self.max_chunk_bytes,
+                max_retries=self.max_retries,
+                raise_on_error=False,
+                raise_on_exception=False,
+            )
+
+        success: List[str] = []
+        failed: List[Dict[str, Any]] = []
+        for ok, item in results:
+            op, info = next(iter(item.items()))
+            if ok:
+                success.append(info.get("_id"))
+            else:
+                failed.append({
+                    "id": info.get("_id"),
+                    "op": op,
+                    "status": info.get("status"),
+                    "error": info.get("error") or info.get("exception"),
+                })
+
+        if failed:
+            logger.warning(f"ES批量写入存在失败: 成功 {len(success)} 条，失败 {len(failed)} 条，首个错误: {failed[0]}")
+        else:
+            logger.info(f"ES批量写入完成: 成功 {len(success)} 条")
+        return {"success": success, "failed": failed}
+
+    @contextmanager
+    def refresh_disabled(self, enabled: bool = True):
+        """
+        大批量写入期间关闭 refresh_interval，结束后恢复原值并主动refresh一次
+        同一索引的多个写入并发时按进程内引用计数处理：第一个进入的关闭并记录原值，最后一个退出的恢复
+        enabled 为 False 时不做任何处理，便于调用方按条件启用
+        """
+        if not enabled:
+            yield
+            return
+
+        with _refresh_lock:
+            holder = _refresh_holders.get(self.index)
+            if holder is None:
+                previous = self._get_refresh_interval()
+                if previous == "-1":
+                    # 上次异常退出（如进程被杀）未能恢复，不沿用 -1，结束后恢复为默认值
+                    previous = None
+                try:
+                    self.es_client.indices.put_settings(index=self.index, settings={"index": {"refresh_interval": "-1"}})
+                    logger.info(f"已临时关闭索引 {self.index} 的 refresh_interval（原值: {previous or '默认'}）")
+                except Exception as e:
+                    logger.warning(f"关闭 refresh_interval 失败，按默认设置写入: {e}")
+                    holder = None
+                else:
+                    holder = _refresh_holders[self.index] = {"count": 0, "previous": previous}
+            if holder is not None:
+                holder["count"] += 1
+
+        if holder is None:
+            yield
+            return
+
+        try:
+            yield
+        finally:
+            with _refresh_lock:
+                holder["count"] -= 1
+                if holder["count"] == 0:
+                    del _refresh_holders[self.index]
+                    previous = holder["previous"]
+                    try:
+                        # 原值为空表示使用集群默认值，置为None即恢复默认
+                        self.es_client.indices.put_settings(index=self.index, settings={"index": {"refresh_interval": previous}})
+                        self.es_client.indices.refresh(index=self.index)
+                        logger.info(f"已恢复索引 {self.index} 的 refresh_interval: {previous or '默认'}")
+                    except Exception as e:
+                        logger.error(f"恢复 refresh_interval 失败，请手动检查索引设置: {e}")
+                else:
+                    # 其他写入仍在进行，由最后退出的恢复；本次写入的数据先refresh一次即可检索
+                    try:
+                        self.es_client.indices.refresh(index=self.index)
+                    except Exception as e:
+                        logger.warning(f"refresh 索引 {self.index} 失败: {e}")
+
+    def _get_refresh_interval(self) -> Optional[str]:
+        try:
+            resp = self.es_client.indices.get_settings(index=self.index, name="index.refresh_interval")
+            for settings in dict(resp).values():
+                return settings.get("settings", {}).get("index", {}).get("refresh_interval")
+        except Exception as e:
+            logger.warning(f"读取 refresh_interval 失败: {e}")
+        return None
+
+    def _with_default_index(self, action: Dict[str, Any]) -> Dict[str, Any]:
+        if "_index" not in action:
+            action = dict(action)
+            action["_index"] = self.index
+        return action
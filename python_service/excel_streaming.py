@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Excel 流式解析（内存占用与行数无关）
+- openpyxl read_only 模式逐行 iter_rows，不构建整张表的单元格对象
+- 预扫描一次sheet XML（iterparse，逐元素释放）取列宽、自定义行高与合并区域，
+  合并区域建成 左上角单元格 → 区域 的映射，取值时O(1)查询
+- 按行窗口切分：行随读随拼，窗口达到 chunk_size 即产出chunk，窗口间保留尾部若干行作为重叠
+- 位置信息按行压缩：每行一条 {row, col, col_end, bbox}，而不是每个单元格一条
+- 多sheet工作簿可按sheet分给进程池，每个进程独立只读打开工作簿，结果按sheet顺序合并
+"""
+
+import logging
+import multiprocessing
+import os
+import xml.etree.ElementTree as ET
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from config import DOCUMENT_CONFIG, EXCEL_STREAMING_CONFIG
+from text_splitter import make_text_splitter
+
+try:
+    from openpyxl import load_workbook
+    from openpyxl.utils.cell import range_boundaries
+    OPENPYXL_AVAILABLE = True
+except ImportError:
+    OPENPYXL_AVAILABLE = False
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+
+# Excel 单位 → 虚拟坐标（与原网格近似一致：1字符宽≈7.5px，1pt≈1.33px）
+CHAR_WIDTH_PX = 7.5
+POINT_PX = 1.33
+DEFAULT_COL_WIDTH = 8.43
+DEFAULT_ROW_HEIGHT = 15.0
+
+# (行号, 行文本, [(列号, 文本在行内的起点, 终点)])
+RowEntry = Tuple[int, str, List[Tuple[int, int, int]]]
+
+
+class AxisOffsets:
+    """
+    稀疏坐标轴：默认尺寸 + 少量自定义尺寸
+    第 i 个格子的起点 = (i-1)*默认尺寸 + 前面自定义格子的差值之和，二分查找，不需要按行数分配数组
+    """
+
+    def __init__(self, default_size: float, overrides: Dict[int, float]):
+        self.default_size = default_size
+        self.keys = sorted(overrides)
+        self.prefix = [0.0]
+        for k in self.keys:
+            self.prefix.append(self.prefix[-1] + overrides[k] - default_size)
+        self.overrides = overrides
+
+    def start(self, index: int) -> float:
+        """第 index 个格子（从1开始）的起点"""
+        return (index - 1) * self.default_size + self.prefix[bisect_left(self.keys, index)]
+
+    def end(self, index: int) -> float:
+        return self.start(index) + self.overrides.get(index, self.default_size)
+
+
+class SheetLayout:
+    """sheet 的列宽、行高与合并区域"""
+
+    def __init__(self, cols: AxisOffsets, rows: AxisOffsets, merged: Dict[Tuple[int, int], Tuple[int, int, int, int]]):
+        self.cols = cols
+        self.rows = rows
+        self.merged = merged
+
+    def cell_bbox(self, row: int, col: int) -> Tuple[List[float], int]:
+        """返回单元格（或以其为左上角的合并区域）的bbox，以及覆盖到的最大列号"""
+        rng = self.merged.get((row, col))
+        if rng:
+            min_col, min_row, max_col, max_row = rng
+            return [self.cols.start(min_col), self.rows.start(min_row), self.cols.end(max_col), self.rows.end(max_row)], max_col
+        return [self.cols.start(col), self.rows.start(row), self.cols.end(col), self.rows.end(row)], col
+
+
+def scan_sheet_layout(ws) -> SheetLayout:
+    """预扫描sheet XML：列宽、自定义行高、合并区域（逐元素释放，不保留单元格）"""
+    default_col = DEFAULT_COL_WIDTH
+    default_row = DEFAULT_ROW_HEIGHT
+    col_widths: Dict[int, float] = {}
+    row_heights: Dict[int, float] = {}
+    merged: Dict[Tuple[int, int], Tuple[int, int, int, int]] = {}
+
+    try:
+        source = ws._get_source()
+    except Exception as e:
+        logger.warning(f"无法读取sheet {ws.title} 的布局信息，使用默认行高列宽: {e}")
+        return SheetLayout(AxisOffsets(default_col * CHAR_WIDTH_PX, {}), AxisOffsets(default_row * POINT_PX, {}), merged)
+
+    sheet_data = None
+    with source:
+        for event, elem in ET.iterparse(source, events=("start", "end")):
+            tag = elem.tag
+            if event == "start":
+                if tag == f"{_NS}sheetData":
+                    sheet_data = elem
+                continue
+            if tag == f"{_NS}row":
+                ht = elem.get("ht")
+                if ht and elem.get("customHeight") in ("1", "true"):
+                    row_heights[int(elem.get("r"))] = float(ht)
+                # 单元格内容由 iter_rows 读取；处理完即从树上摘除，内存不随行数增长
+                if sheet_data is not None:
+                    sheet_data.clear()
+                else:
+                    elem.clear()
+            elif tag == f"{_NS}sheetFormatPr":
+                if elem.get("defaultRowHeight"):
+                    default_row = float(elem.get("defaultRowHeight"))
+                if elem.get("defaultColWidth"):
+                    default_col = float(elem.get("defaultColWidth"))
+            elif tag == f"{_NS}col":
+                width = elem.get("width")
+                if width:
+                    for c in range(int(elem.get("min")), min(int(elem.get("max")), 16384) + 1):
+                        col_widths[c] = float(width)
+            elif tag == f"{_NS}mergeCell":
+                ref = elem.get("ref")
+                if ref and ":" in ref:
+                    min_col, min_row, max_col, max_row = range_boundaries(ref)
+                    merged[(min_row, min_col)] = (min_col, min_row, max_col, max_row)
+                elem.clear()
+
+    # 自定义行高以默认行高为基准记录，等于默认值的不占用映射
+    row_heights = {r: h for r, h in row_heights.items() if h != default_row}
+    return SheetLayout(
+        AxisOffsets(default_col * CHAR_WIDTH_PX, {c: w * CHAR_WIDTH_PX for c, w in col_widths.items()}),
+        AxisOffsets(default_row * POINT_PX, {r: h * POINT_PX for r, h in row_heights.items()}),
+        merged,
+    )
+
+
+def _row_entry(row_no: int, values) -> Optional[RowEntry]:
+    """将一行的值拼成以Tab分隔的文本，记录每个非空单元格（strip后）在行内的区间"""
+    vals = ["" if v is None else str(v) for v in values]
+    cells = []
+    pos = 0
+    for col, val in enumerate(vals, start=1):
+        stripped = val.strip()
+        if stripped:
+            start = pos + (len(val) - len(val.lstrip()))
+            cells.append((col, start, start + len(stripped)))
+        pos += len(val) + 1
+    if not cells:
+        return None
+    return row_no, "\t".join(vals).rstrip(), cells
+
+
+def _row_positions(entry: RowEntry, layout: SheetLayout, lo: int = 0, hi: Optional[int] = None) -> List[Dict]:
+    """行内区间 [lo, hi) 覆盖到的单元格 → 位置记录"""
+    row_no, _, cells = entry
+    hi = len(entry[1]) if hi is None else hi
+    picked = [col for col, s, e in cells if s < hi and e > lo]
+    if not picked:
+        return []
+    if EXCEL_STREAMING_CONFIG.get("position_mode", "row") == "cell":
+        records = []
+        for col in picked:
+            bbox, _ = layout.cell_bbox(row_no, col)
+            records.append({"row": row_no, "col": col, "bbox": bbox})
+        return records
+    x0 = y0 = float("inf")
+    x1 = y1 = 0.0
+    col_end = picked[-1]
+    for col in picked:
+        bbox, max_col = layout.cell_bbox(row_no, col)
+        x0, y0 = min(x0, bbox[0]), min(y0, bbox[1])
+        x1, y1 = max(x1, bbox[2]), max(y1, bbox[3])
+        col_end = max(col_end, max_col)
+    return [{"row": row_no, "col": picked[0], "col_end": col_end, "bbox": [x0, y0, x1, y1]}]
+
+
+def _union_bbox(positions: List[Dict]) -> List[float]:
+    if not positions:
+        return [0, 0, 0, 0]
+    return [
+        min(p["bbox"][0] for p in positions),
+        min(p["bbox"][1] for p in positions),
+        max(p["bbox"][2] for p in positions),
+        max(p["bbox"][3] for p in positions),
+    ]
+
+
+def iter_sheet_chunks(ws, layout: SheetLayout, chunk_size: int, chunk_overlap: int) -> Iterator[Tuple[str, List[Dict]]]:
+    """
+    按行窗口产出 (chunk文本, positions)
+    - 窗口内各行以换行拼接，加入下一行会超过 chunk_size 时产出当前窗口
+    - 新窗口以上一窗口末尾不超过 chunk_overlap 字符的若干整行开头
+    - 单行超过 chunk_size 时按字符切分该行
+    """
+    # 窗口元素为 (行, 该行的位置记录)；位置在读入时计算一次，重叠行不重复计算
+    window: List[Tuple[RowEntry, List[Dict]]] = []
+    window_len = 0
+
+    def emit():
+        text = "\n".join(e[1] for e, _ in window)
+        positions = [p for _, row_positions in window for p in row_positions]
+        return text, positions
+
+    row_splitter = None
+    for row_no, values in enumerate(ws.iter_rows(min_row=1, values_only=True), start=1):
+        entry = _row_entry(row_no, values)
+        if entry is None:
+            continue
+        line_len = len(entry[1])
+
+        if line_len > chunk_size:
+            if window:
+                yield emit()
+                window, window_len = [], 0
+            row_splitter = row_splitter or make_text_splitter("xlsx", chunk_size=chunk_size)
+            for start, end, piece in row_splitter.split_with_offsets(entry[1]):
+                yield piece, _row_positions(entry, layout, start, end)
+            continue
+
+        if window and window_len + 1 + line_len > chunk_size:
+            yield emit()
+            # 尾部整行作为重叠，且保证加入当前行后不超过 chunk_size
+            tail: List[Tuple[RowEntry, List[Dict]]] = []
+            tail_len = 0
+            for prev in reversed(window[1:]):
+                added = len(prev[0][1]) + (1 if tail else 0)
+                if tail_len + added > chunk_overlap or tail_len + added + 1 + line_len > chunk_size:
+                    break
+                tail.insert(0, prev)
+                tail_len += added
+            window, window_len = tail, tail_len
+
+        window_len += line_len + (1 if window else 0)
+        window.append((entry, _row_positions(entry, layout)))
+
+    if window:
+        yield emit()
+
+
+ExcelChunk = Tuple[int, str, str, List[Dict], List[float]]
+
+
+def _chunk_params() -> Tuple[int, int]:
+    splitter_config = DOCUMENT_CONFIG.get("splitter_config", {})
+    chunk_size = int(EXCEL_STREAMING_CONFIG.get("chunk_size") or splitter_config.get("chunk_size", 1000))
+    ratio = DOCUMENT_CONFIG.get("dynamic_overlap", {}).get("xlsx", 0.25)
+    return chunk_size, int(chunk_size * ratio)
+
+
+def _iter_worksheet(ws, sheet_idx: int, chunk_size: int, chunk_overlap: int) -> Iterator[ExcelChunk]:
+    layout = scan_sheet_layout(ws)
+    for text, positions in iter_sheet_chunks(ws, layout, chunk_size, chunk_overlap):
+        yield sheet_idx, ws.title, text, positions, _union_bbox(positions)
+
+
+def _sheet_chunks_worker(args: Tuple[str, int, int, int]) -> List[ExcelChunk]:
+    """子进程入口：独立以只读方式打开工作簿，处理其中一个sheet"""
+    file_path, sheet_idx, chunk_size, chunk_overlap = args
+    wb = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        return list(_iter_worksheet(wb.worksheets[sheet_idx], sheet_idx, chunk_size, chunk_overlap))
+    finally:
+        wb.close()
+
+
+def resolve_parallel_workers(sheet_count: int) -> int:
+    """按配置与sheet数确定进程数；返回1表示串行"""
+    if not EXCEL_STREAMING_CONFIG.get("parallel_enabled", True):
+        return 1
+    if sheet_count < int(EXCEL_STREAMING_CONFIG.get("parallel_min_sheets", 4)):
+        return 1
+    workers = EXCEL_STREAMING_CONFIG.get("parallel_workers") or os.cpu_count() or 1
+    return max(1, min(int(workers), sheet_count))
+
+
+def iter_excel_chunks(file_path: str) -> Iterator[ExcelChunk]:
+    """
+    流式读取工作簿，逐个产出 (sheet序号, sheet名, chunk文本, positions, bbox)
+    sheet较多时按sheet分给进程池，结果按sheet顺序产出，与串行输出一致
+    """
+    if not OPENPYXL_AVAILABLE:
+        raise RuntimeError("缺少openpyxl，无法原生解析Excel。请安装: pip install openpyxl")
+    chunk_size, chunk_overlap = _chunk_params()
+
+    wb = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        sheet_count = len(wb.worksheets)
+        workers = resolve_parallel_workers(sheet_count)
+        if workers <= 1:
+            for sheet_idx, ws in enumerate(wb.worksheets):
+                yield from _iter_worksheet(ws, sheet_idx, chunk_size, chunk_overlap)
+            return
+    finally:
+        wb.close()
+
+    logger.info(f"并行解析Excel: {sheet_count} 个sheet，{workers} 个进程")
+    ctx = multiprocessing.get_context(EXCEL_STREAMING_CONFIG.get("start_method", "spawn"))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        # map 按提交顺序返回，保证sheet顺序与串行一致；chunksize=1 让大小不均的sheet动态分配
+        tasks = [(file_path, idx, chunk_size, chunk_overlap) for idx in range(sheet_count)]
+        for part in pool.map(_sheet_chunks_worker, tasks, chunksize=1):
+            yield from part
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+生成PDF使用的进程级字体缓存
+- 启动时在 Windows/Linux/macOS 的系统字体目录中查找一次中文字体，字体数据读入内存常驻
+- 新文档通过 fontbuffer 写入字体（不再每个文档从磁盘重读数MB的 .ttc），同一文档内只嵌入一次
+- 找不到系统中文字体时使用 PyMuPDF 内置的 china-s，不再退化为无法显示中文的 helv
+- 保存时子集化字体，只保留用到的字形，生成的PDF体积与所用字数相关而非字体大小；
+  同一字体在文档中只提取、子集化一次（保留字形编号，页面内容无需改写）
+"""
+
+import hashlib
+import io
+import logging
+import os
+import threading
+from typing import Iterable, List, Optional, Set, Tuple
+
+import fitz  # PyMuPDF
+
+from config import FONT_CONFIG
+
+try:
+    from fontTools import subset as ft_subset
+    from fontTools.ttLib import TTFont
+    FONTTOOLS_AVAILABLE = True
+except ImportError:
+    FONTTOOLS_AVAILABLE = False
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+# fontTools 子集化时逐表输出INFO日志，只保留警告
+logging.getLogger("fontTools").setLevel(logging.WARNING)
+
+# 页面字体资源名
+CJK_FONT_NAME = "CJK"
+# 内置中文字体（Droid Sans Fallback）
+BUILTIN_CJK_FONT = "china-s"
+
+# 按优先级排列的中文字体文件名（小写）；.ttc 取集合中的第一个字体
+CJK_FONT_FILES: List[str] = [
+    "msyh.ttc",
+    "msyh.ttf",
+    "simsun.ttc",
+    "simhei.ttf",
+    "notosanscjksc-regular.otf",
+    "sourcehansanssc-regular.otf",
+    "notosanscjk-regular.ttc",
+    "wqy-microhei.ttc",
+    "wqy-zenhei.ttc",
+    "droidsansfallbackfull.ttf",
+    "pingfang.ttc",
+]
+
+
+def system_font_dirs() -> List[str]:
+    """当前平台的系统字体目录"""
+    if os.name == "nt":
+        return [
+            os.path.join(os.environ.get("WINDIR", r"C:\Windows"), "Fonts"),
+            os.path.join(os.environ.get("LOCALAPPDATA", ""), "Microsoft", "Windows", "Fonts"),
+        ]
+    home = os.path.expanduser("~")
+    return [
+        "/usr/share/fonts",
+        "/usr/local/share/fonts",
+        os.path.join(home, ".local", "share", "fonts"),
+        os.path.join(home, ".fonts"),
+        "/System/Library/Fonts",
+        "/Library/Fonts",
+    ]
+
+
+def discover_cjk_font(font_paths: Optional[List[str]] = None,
+                      font_dirs: Optional[List[str]] = None) -> Optional[str]:
+    """查找中文字体：优先使用指定的字体文件，其次按 CJK_FONT_FILES 的顺序在字体目录（含子目录）中查找"""
+    for path in font_paths or []:
+        if os.path.isfile(path):
+            return path
+
+    wanted = {name: rank for rank, name in enumerate(CJK_FONT_FILES)}
+    best: Optional[Tuple[int, str]] = None
+    for font_dir in font_dirs or []:
+        if not font_dir or not os.path.isdir(font_dir):
+            continue
+        for root, _, files in os.walk(font_dir):
+            for name in files:
+                rank = wanted.get(name.lower())
+                if rank is not None and (best is None or rank < best[0]):
+                    best = (rank, os.path.join(root, name))
+            if best is not None and best[0] == 0:
+                break
+    return best[1] if best is not None else None
+
+
+def _xref_value(doc: "fitz.Document", xref: int, key: str) -> Optional[int]:
+    kind, value = doc.xref_get_key(xref, key)
+    if kind == "array":
+        value = value[1:-1].strip()
+    elif kind != "xref":
+        return None
+    try:
+        return int(value.split()[0])
+    except (ValueError, IndexError):
+        return None
+
+
+def _font_file_xref(doc: "fitz.Document", font_xref: int) -> Optional[Tuple[int, int, str]]:
+    """Type0/TrueType 字体的 (FontDescriptor xref, 字体文件 xref, 键名)"""
+    desc_font = _xref_value(doc, font_xref, "DescendantFonts") or font_xref
+    descriptor = _xref_value(doc, desc_font, "FontDescriptor")
+    if descriptor is None:
+        return None
+    for key in ("FontFile2", "FontFile3", "FontFile"):
+        ff = _xref_value(doc, descriptor, key)
+        if ff is not None:
+            return descriptor, ff, key
+    return None
+
+
+def _subset_font_buffer(buffer: bytes, unicodes: Set[int]) -> Optional[bytes]:
+    """只保留用到字符的字形；保留原字形编号（页面内容按字形编号引用），失败返回None"""
+    try:
+        font = TTFont(io.BytesIO(buffer), lazy=True, fontNumber=0)
+        options = ft_subset.Options()
+        options.retain_gids = True
+        options.notdef_outline = True
+        options.ignore_missing_glyphs = True
+        options.ignore_missing_unicodes = True
+        options.layout_features = []
+        options.hinting = False
+        options.name_IDs = ["*"]
+        subsetter = ft_subset.Subsetter(options)
+        subsetter.populate(unicodes=unicodes)
+        subsetter.subset(font)
+        out = io.BytesIO()
+        font.save(out)
+        return out.getvalue()
+    except Exception as e:
+        logger.warning(f"字体子集化失败: {e}")
+        return None
+
+
+def subset_embedded_fonts(doc: "fitz.Document", used_chars: Iterable[str]) -> int:
+    """
+    按已写入的字符子集化文档中嵌入的字体，返回节省的字节数
+    生成的PDF里同一字体会被多个页面/资源名引用，这里按字体文件去重，每个只处理一次
+    """
+    unicodes = {ord(c) for c in used_chars} | {0x20}
+    prefix = "".join(chr(ord("A") + b % 26) for b in hashlib.md5(
+        "".join(sorted(map(chr, unicodes))).encode("utf-8", "ignore")).digest()[:6]) + "+"
+    seen: Set[int] = set()
+    saved = 0
+    for pno in range(doc.page_count):
+        for font_xref, ext, _, basefont, _, _ in doc.get_page_fonts(pno):
+            if font_xref in seen or ext not in ("ttf", "otf", "ttc") or basefont[6:7] == "+":
+                continue
+            seen.add(font_xref)
+            located = _font_file_xref(doc, font_xref)
+            if located is None:
+                continue
+            descriptor, ff_xref, key = located
+            buffer = doc.xref_stream(ff_xref)
+            subset = _subset_font_buffer(buffer, unicodes) if buffer else None
+            if not subset or len(subset) >= len(buffer):
+                continue
+            doc.update_stream(ff_xref, subset)
+            if key == "FontFile2":
+                doc.xref_set_key(ff_xref, "Length1", str(len(subset)))
+            # 子集字体名加6位前缀（PDF规范约定）
+            desc_font = _xref_value(doc, font_xref, "DescendantFonts")
+            for xref, name_key in ((font_xref, "BaseFont"), (desc_font, "BaseFont"), (descriptor, "FontName")):
+                if xref is None:
+                    continue
+                kind, value = doc.xref_get_key(xref, name_key)
+                if kind == "name":
+                    doc.xref_set_key(xref, name_key, "/" + prefix + value[1:].replace(" ", "#20"))
+            saved += len(buffer) - len(subset)
+    return saved
+
+
+class FontRegistry:
+    """中文字体数据与 fitz.Font 的进程级缓存"""
+
+    def __init__(self, font_path: Optional[str] = None, subset_on_save: bool = True):
+        self.font_path = font_path
+        self.subset_on_save = subset_on_save and FONTTOOLS_AVAILABLE
+        self.buffer: Optional[bytes] = None
+        if font_path:
+            try:
+                with open(font_path, "rb") as f:
+                    self.buffer = f.read()
+                # 确认能被MuPDF解析，失败时退回内置字体
+                fitz.Font(fontbuffer=self.buffer)
+            except Exception as e:
+                logger.warning(f"加载字体失败 {font_path}: {e}")
+                self.buffer = None
+                self.font_path = None
+        self._lock = threading.Lock()
+        self._text_font: Optional["fitz.Font"] = None
+
+    @property
+    def has_embedded_font(self) -> bool:
+        return self.buffer is not None
+
+    def text_font(self) -> "fitz.Font":
+        """供 TextWriter 排版与测量的字体（进程内共用同一对象）"""
+        if self._text_font is None:
+            with self._lock:
+                if self._text_font is None:
+                    self._text_font = self._load_text_font()
+        return self._text_font
+
+    def _load_text_font(self) -> "fitz.Font":
+        if self.buffer is not None:
+            try:
+                return fitz.Font(fontbuffer=self.buffer)
+            except Exception as e:
+                logger.warning(f"创建字体失败 {self.font_path}: {e}")
+        try:
+            return fitz.Font(BUILTIN_CJK_FONT)
+        except Exception:
+            return fitz.Font("helv")
+
+    def insert_font(self, page: "fitz.Page") -> str:
+        """
+        在页面上登记中文字体并返回可用于 insert_text/insert_textbox 的字体名
+        同一文档多次登记同一字体数据只嵌入一次
+        """
+        if self.buffer is not None:
+            try:
+                page.insert_font(fontname=CJK_FONT_NAME, fontbuffer=self.buffer)
+                return CJK_FONT_NAME
+            except Exception as e:
+                logger.warning(f"写入字体失败，改用内置字体: {e}")
+        return BUILTIN_CJK_FONT
+
+    def save(self, doc: "fitz.Document", out_path: str, used_chars: Optional[Iterable[str]] = None):
+        """
+        保存生成的PDF：先子集化字体再压缩写出
+        used_chars 为写入过的字符（排版时顺带收集）；未提供时退回 PyMuPDF 的 subset_fonts（逐页扫描，较慢）
+        """
+        if self.subset_on_save:
+            try:
+                if used_chars is not None:
+                    subset_embedded_fonts(doc, used_chars)
+                else:
+                    doc.subset_fonts()
+            except Exception as e:
+                logger.warning(f"字体子集化失败，保存完整字体: {e}")
+        doc.save(out_path, garbage=1, deflate=True)
+
+    def info(self) -> dict:
+        return {
+            "font_path": self.font_path,
+            "buffer_bytes": len(self.buffer) if self.buffer is not None else 0,
+            "fallback": None if self.buffer is not None else BUILTIN_CJK_FONT,
+            "subset_on_save": self.subset_on_save,
+        }
+
+
+# 全局字体缓存实例
+font_registry = None
+_font_registry_lock = threading.Lock()
+
+def init_font_registry() -> FontRegistry:
+    """查找并加载中文字体（进程内只需一次）"""
+    global font_registry
+    font_path = discover_cjk_font(
+        FONT_CONFIG.get("cjk_font_paths") or [],
+        list(FONT_CONFIG.get("extra_font_dirs") or []) + system_font_dirs(),
+    )
+    registry = FontRegistry(font_path, subset_on_save=FONT_CONFIG.get("subset_on_save", True))
+    if registry.has_embedded_font:
+        logger.info(f"中文字体已加载: {font_path}（{len(registry.buffer) // 1024} KB）")
+    else:
+        logger.info(f"未找到系统中文字体，使用内置字体 {BUILTIN_CJK_FONT}")
+    if FONT_CONFIG.get("subset_on_save", True) and not FONTTOOLS_AVAILABLE:
+        logger.warning("未安装fontTools，生成的PDF不做字体子集化。请安装: pip install fonttools")
+    font_registry = registry
+    return registry
+
+def get_font_registry() -> FontRegistry:
+    """获取字体缓存实例（未初始化时自动初始化）"""
+    if font_registry is None:
+        with _font_registry_lock:
+            if font_registry is None:
+                init_font_registry()
+    return font_registry
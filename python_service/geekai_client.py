@@ -93,6 +93,7 @@ class GeekAIClient:
         Yields:
             流式响应数据
         """
+        response = None
         try:
             payload = {
                 "model": model,
@@ -135,6 +136,10 @@ class GeekAIClient:
         except Exception as e:
             logger.error(f"流式API调用异常: {str(e)}")
             yield {"error": f"流式API调用异常: {str(e)}"}
+        finally:
+            # 调用方提前关闭生成器（如客户端断开）时释放连接，上游随之停止生成
+            if response is not None:
+                response.close()
     
     def get_embeddings(self, texts: List[str], model: str = "text-embedding-ada-002") -> Dict[str, Any]:
         """
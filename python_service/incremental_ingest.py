@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+增量入库：chunk级差异比对
+- chunk ID 由 (knowledge_id, source_file, 内容哈希, 同内容序号) 决定，与 chunk 下标无关，
+  插入/删除段落导致下标整体平移时，未变化的chunk ID 保持不变
+- 与ES中同一 knowledge_id/source_file 已有的chunk ID 比对，得到新增、保留、删除三类
+"""
+
+import hashlib
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from elasticsearch import Elasticsearch
+from elasticsearch.helpers import scan
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def make_chunk_id(knowledge_id: Any, source_file: str, content: str, ordinal: int = 0) -> str:
+    """确定性chunk ID；同一文档内容完全相同的chunk用 ordinal 区分"""
+    content_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    return hashlib.sha1(f"{knowledge_id}|{source_file}|{content_hash}|{ordinal}".encode("utf-8")).hexdigest()
+
+
+def compute_chunk_ids(chunks: Iterable[Any], knowledge_id: Any) -> List[str]:
+    """按chunks顺序计算ID（chunks需有 page_content 与 metadata）"""
+    seen: Dict[Tuple[str, str], int] = {}
+    ids = []
+    for chunk in chunks:
+        source_file = chunk.metadata.get("source_file", "")
+        kid = chunk.metadata.get("knowledge_id", knowledge_id)
+        key = (source_file, chunk.page_content)
+        ordinal = seen.get(key, 0)
+        seen[key] = ordinal + 1
+        ids.append(make_chunk_id(kid, source_file, chunk.page_content, ordinal))
+    return ids
+
+
+def fetch_existing_chunk_ids(es_client: Elasticsearch, index: str, knowledge_id: Any, source_file: str) -> Set[str]:
+    """扫描ES中某个文档已入库的chunk ID"""
+    query = {
+        "query": {
+            "bool": {
+                "filter": [
+                    {"term": {"knowledge_id": knowledge_id}},
+                    {"term": {"source_file": source_file}},
+                ]
+            }
+        },
+        "_source": False,
+    }
+    return {hit["_id"] for hit in scan(es_client, index=index, query=query, size=1000)}
+
+
+def diff_chunk_ids(new_ids: List[str], existing_ids: Set[str]) -> Dict[str, Any]:
+    """
+    Returns:
+        {"added": [需要向量化并写入的下标], "kept": [只需更新元数据的下标], "removed": [需要删除的ID]}
+    """
+    new_set = set(new_ids)
+    added = [i for i, doc_id in enumerate(new_ids) if doc_id not in existing_ids]
+    kept = [i for i, doc_id in enumerate(new_ids) if doc_id in existing_ids]
+    removed = sorted(existing_ids - new_set)
+    return {"added": added, "kept": kept, "removed": removed}
+
+
+def collect_existing_ids(es_client: Elasticsearch, index: str, knowledge_id: Optional[Any],
+                         source_files: Iterable[str]) -> Optional[Set[str]]:
+    """汇总多个源文件已有的chunk ID；knowledge_id 为空或查询失败时返回None（按全量入库处理）"""
+    if knowledge_id is None:
+        return None
+    existing: Set[str] = set()
+    try:
+        for source_file in set(source_files):
+            existing |= fetch_existing_chunk_ids(es_client, index, knowledge_id, source_file)
+    except Exception as e:
+        logger.warning(f"查询已有chunk失败，按全量入库处理: {e}")
+        return None
+    return existing
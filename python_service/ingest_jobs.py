@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文档入库后台任务队列
+- 任务持久化到本地sqlite，服务重启后未完成的任务自动重新排队
+- 两阶段工作线程池：解析阶段（转换/解析/切分）与入库阶段（向量化/写ES），线程数分别可配
+- 支持查询状态、进度与取消
+"""
+
+import json
+import logging
+import os
+import queue
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+from config import INGEST_JOB_CONFIG
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 任务状态
+JOB_QUEUED = "queued"
+JOB_PARSING = "parsing"
+JOB_INDEXING = "indexing"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+ACTIVE_STATUSES = (JOB_QUEUED, JOB_PARSING, JOB_INDEXING)
+FINISHED_STATUSES = (JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED)
+
+
+class JobCancelled(Exception):
+    """任务已被取消"""
+
+
+class IngestJobStore:
+    """基于sqlite的任务存储"""
+
+    def __init__(self, db_path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ingest_jobs (
+                job_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                progress REAL NOT NULL DEFAULT 0,
+                message TEXT,
+                filename TEXT NOT NULL,
+                file_path TEXT NOT NULL,
+                params TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                cancel_requested INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_ingest_jobs_status ON ingest_jobs(status)")
+        self._conn.commit()
+
+    def create(self, job_id: str, filename: str, file_path: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO ingest_jobs (job_id, status, progress, message, filename, file_path, params, created_at, updated_at) "
+                "VALUES (?, ?, 0, ?, ?, ?, ?, ?, ?)",
+                (job_id, JOB_QUEUED, "等待处理", filename, file_path, json.dumps(params, ensure_ascii=False), now, now),
+            )
+            self._conn.commit()
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM ingest_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def update(self, job_id: str, **fields):
+        if not fields:
+            return
+        if "result" in fields and fields["result"] is not None:
+            fields["result"] = json.dumps(fields["result"], ensure_ascii=False)
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{k} = ?" for k in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE ingest_jobs SET {assignments} WHERE job_id = ?", (*fields.values(), job_id))
+            self._conn.commit()
+
+    def request_cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """标记取消；仍在排队的任务直接置为已取消"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE ingest_jobs SET cancel_requested = 1, updated_at = ? WHERE job_id = ? AND status IN (?, ?, ?)",
+                (now, job_id, *ACTIVE_STATUSES),
+            )
+            self._conn.execute(
+                "UPDATE ingest_jobs SET status = ?, message = ?, updated_at = ? WHERE job_id = ? AND status = ?",
+                (JOB_CANCELLED, "已取消", now, job_id, JOB_QUEUED),
+            )
+            self._conn.commit()
+        return self.get(job_id)
+
+    def is_cancel_requested(self, job_id: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT cancel_requested FROM ingest_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return bool(row and row["cancel_requested"])
+
+    def list_unfinished(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM ingest_jobs WHERE status IN (?, ?, ?) ORDER BY created_at ASC", ACTIVE_STATUSES
+            ).fetchall()
+        return [self._to_dict(r) for r in rows]
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        job["params"] = json.loads(job["params"]) if job.get("params") else {}
+        job["result"] = json.loads(job["result"]) if job.get("result") else None
+        job["cancel_requested"] = bool(job.get("cancel_requested"))
+        return job
+
+
+class IngestJobQueue:
+    """
+    两阶段后台任务队列
+
+    parse_fn(job) -> chunks：解析阶段，返回切分后的chunks
+    index_fn(job, chunks) -> Dict：入库阶段，返回处理结果（需包含 chunks_count）
+    """
+
+    def __init__(self,
+                 store: IngestJobStore,
+                 parse_fn: Callable[[Dict[str, Any]], List[Any]],
+                 index_fn: Callable[[Dict[str, Any], List[Any]], Dict[str, Any]],
+                 storage_dir: str,
+                 parse_workers: int = 1,
+                 index_workers: int = 1,
+                 max_pending_index: int = 4,
+                 keep_files: bool = False):
+        self.store = store
+        self.parse_fn = parse_fn
+        self.index_fn = index_fn
+        self.storage_dir = storage_dir
+        self.parse_workers = max(1, int(parse_workers))
+        self.index_workers = max(1, int(index_workers))
+        self.keep_files = keep_files
+        self._parse_queue: "queue.Queue[str]" = queue.Queue()
+        # 入库队列有界：入库阶段跟不上时解析阶段阻塞，避免已切分的chunks在内存中堆积
+        self._index_queue: "queue.Queue[tuple]" = queue.Queue(maxsize=max(1, int(max_pending_index)))
+        self._threads: List[threading.Thread] = []
+        self._started = False
+
+    def start(self):
+        """启动工作线程，并将上次未完成的任务重新排队"""
+        if self._started:
+            return
+        self._started = True
+        for i in range(self.parse_workers):
+            self._spawn(self._parse_loop, f"ingest-parse-{i}")
+        for i in range(self.index_workers):
+            self._spawn(self._index_loop, f"ingest-index-{i}")
+
+        recovered = 0
+        for job in self.store.list_unfinished():
+            if job["cancel_requested"]:
+                self._finish(job, JOB_CANCELLED, message="已取消")
+                continue
+            # 中断时的阶段产物未持久化，统一从解析阶段重新开始
+            self.store.update(job["job_id"], status=JOB_QUEUED, progress=0.0, message="服务重启后重新排队")
+            self._parse_queue.put(job["job_id"])
+            recovered += 1
+        logger.info(f"入库任务队列已启动: 解析线程 {self.parse_workers} 个，入库线程 {self.index_workers} 个，恢复任务 {recovered} 个")
+
+    def submit(self, src_path: str, filename: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """提交任务：上传文件移动到任务目录后持久化并排队"""
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.storage_dir, job_id)
+        os.makedirs(job_dir, exist_ok=True)
+        file_path = os.path.join(job_dir, f"source{os.path.splitext(filename)[1].lower()}")
+        shutil.move(src_path, file_path)
+        job = self.store.create(job_id, filename, file_path, params)
+        self._parse_queue.put(job_id)
+        logger.info(f"已提交入库任务 {job_id}: {filename}")
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.store.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self.store.request_cancel(job_id)
+        if job and job["status"] == JOB_CANCELLED:
+            self._cleanup(job)
+        return job
+
+    def check_cancelled(self, job_id: str):
+        """供阶段函数在耗时步骤之间调用，已取消时抛出 JobCancelled"""
+        if self.store.is_cancel_requested(job_id):
+            raise JobCancelled(job_id)
+
+    def _spawn(self, target: Callable, name: str):
+        t = threading.Thread(target=target, name=name, daemon=True)
+        t.start()
+        self._threads.append(t)
+
+    def _parse_loop(self):
+        while True:
+            job_id = self._parse_queue.get()
+            job = self.store.get(job_id)
+            if not job or job["status"] != JOB_QUEUED:
+                continue
+            try:
+                self.check_cancelled(job_id)
+                self.store.update(job_id, status=JOB_PARSING, progress=0.1, message="解析与切分中")
+                chunks = self.parse_fn(job)
+                self.check_cancelled(job_id)
+                self.store.update(job_id, progress=0.5, message=f"切分完成，共 {len(chunks)} 个chunks，等待入库")
+                self._index_queue.put((job_id, chunks))
+            except JobCancelled:
+                self._finish(job, JOB_CANCELLED, message="已取消")
+            except Exception as e:
+                logger.error(f"入库任务 {job_id} 解析失败: {e}")
+                self._finish(job, JOB_FAILED, message="解析失败", error=str(e))
+
+    def _index_loop(self):
+        while True:
+            job_id, chunks = self._index_queue.get()
+            job = self.store.get(job_id)
+            if not job:
+                continue
+            try:
+                self.check_cancelled(job_id)
+                self.store.update(job_id, status=JOB_INDEXING, progress=0.6, message="向量化与写入ES中")
+                result = self.index_fn(job, chunks)
+                self._finish(job, JOB_SUCCEEDED, message="处理完成", result=result)
+            except JobCancelled:
+                self._finish(job, JOB_CANCELLED, message="已取消")
+            except Exception as e:
+                logger.error(f"入库任务 {job_id} 入库失败: {e}")
+                self._finish(job, JOB_FAILED, message="入库失败", error=str(e))
+
+    def _finish(self, job: Dict[str, Any], status: str, message: str,
+                result: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        self.store.update(
+            job["job_id"],
+            status=status,
+            progress=1.0 if status == JOB_SUCCEEDED else job.get("progress", 0.0),
+            message=message,
+            result=result,
+            error=error,
+        )
+        logger.info(f"入库任务 {job['job_id']} 结束: {status}")
+        self._cleanup(job)
+
+    def _cleanup(self, job: Dict[str, Any]):
+        if self.keep_files:
+            return
+        try:
+            shutil.rmtree(os.path.dirname(job["file_path"]), ignore_errors=True)
+        except Exception:
+            pass
+
+
+# 全局队列实例
+ingest_queue = None
+
+def init_ingest_queue(parse_fn: Callable[[Dict[str, Any]], List[Any]],
+                      index_fn: Callable[[Dict[str, Any], List[Any]], Dict[str, Any]]) -> IngestJobQueue:
+    """初始化并启动入库任务队列"""
+    global ingest_queue
+    store = IngestJobStore(INGEST_JOB_CONFIG["db_path"])
+    ingest_queue = IngestJobQueue(
+        store,
+        parse_fn,
+        index_fn,
+        storage_dir=INGEST_JOB_CONFIG["storage_dir"],
+        parse_workers=INGEST_JOB_CONFIG.get("parse_workers", 1),
+        index_workers=INGEST_JOB_CONFIG.get("index_workers", 1),
+        max_pending_index=INGEST_JOB_CONFIG.get("max_pending_index", 4),
+        keep_files=INGEST_JOB_CONFIG.get("keep_files", False),
+    )
+    ingest_queue.start()
+    return ingest_queue
+
+def get_ingest_queue() -> IngestJobQueue:
+    """获取入库任务队列实例"""
+    if ingest_queue is None:
+        raise RuntimeError("入库任务队列未初始化，请先调用init_ingest_queue")
+    return ingest_queue
@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LibreOffice 常驻转换进程池（Office → PDF）
+- 每个worker是一个常驻的 headless soffice 进程，使用独立的 -env:UserInstallation 配置目录，
+  并发转换不会争用同一用户配置
+- 通过 UNO 管道连接（需要可导入 uno 模块）；不可用时退化为按worker独立配置目录的单次 soffice 转换
+- 有界任务队列、单任务超时；超时或进程异常时强制结束并在下次任务前重启该worker
+"""
+
+import atexit
+import logging
+import os
+import queue
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from pathlib import Path
+from shutil import which
+from typing import Any, Dict, List, Optional
+
+from config import LIBREOFFICE_POOL_CONFIG
+
+try:
+    import uno
+    from com.sun.star.beans import PropertyValue
+    UNO_AVAILABLE = True
+except Exception:
+    UNO_AVAILABLE = False
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 按文档类型选择PDF导出过滤器
+PDF_EXPORT_FILTERS = [
+    ("com.sun.star.sheet.SpreadsheetDocument", "calc_pdf_Export"),
+    ("com.sun.star.presentation.PresentationDocument", "impress_pdf_Export"),
+    ("com.sun.star.drawing.DrawingDocument", "draw_pdf_Export"),
+    ("com.sun.star.text.TextDocument", "writer_pdf_Export"),
+]
+
+
+def find_soffice_path(explicit: Optional[str] = None) -> Optional[str]:
+    """查找 soffice 可执行文件：显式指定 > Windows 常见安装路径 > PATH"""
+    candidates = [explicit] if explicit else []
+    candidates += [
+        r"C:\\Program Files\\LibreOffice\\program\\soffice.exe",
+        r"C:\\Program Files (x86)\\LibreOffice\\program\\soffice.exe",
+    ]
+    for c in candidates:
+        if c and os.path.exists(c):
+            return c
+    return which("soffice") or which("soffice.exe")
+
+
+def _expected_pdf_path(src_path: str, out_dir: str) -> str:
+    return os.path.join(out_dir, Path(src_path).with_suffix('.pdf').name)
+
+
+def _kill_process_tree(proc: subprocess.Popen):
+    """结束 soffice 进程（Linux下 soffice 会派生 soffice.bin，按进程组结束）"""
+    if proc is None or proc.poll() is not None:
+        return
+    try:
+        if os.name == "posix":
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            subprocess.run(["taskkill", "/F", "/T", "/PID", str(proc.pid)], capture_output=True)
+    except Exception:
+        proc.kill()
+    try:
+        proc.wait(timeout=10)
+    except Exception:
+        pass
+
+
+def _popen_kwargs() -> Dict[str, Any]:
+    if os.name == "posix":
+        return {"start_new_session": True}
+    return {"creationflags": getattr(subprocess, "CREATE_NEW_PROCESS_GROUP", 0)}
+
+
+class LibreOfficeWorker:
+    """单个常驻 soffice 进程及其独立用户配置"""
+
+    def __init__(self, index: int, soffice_path: str, profile_dir: str,
+                 use_uno: bool = True, start_timeout: int = 60, max_jobs: int = 200):
+        self.index = index
+        self.soffice_path = soffice_path
+        self.profile_dir = profile_dir
+        self.use_uno = use_uno and UNO_AVAILABLE
+        self.start_timeout = start_timeout
+        self.max_jobs = max_jobs
+        self.pipe_name = f"lo_pool_{os.getpid()}_{index}_{uuid.uuid4().hex[:8]}"
+        self.proc: Optional[subprocess.Popen] = None
+        self.desktop = None
+        self.jobs_done = 0
+        self.restarts = 0
+        os.makedirs(profile_dir, exist_ok=True)
+
+    @property
+    def profile_url(self) -> str:
+        return Path(os.path.abspath(self.profile_dir)).as_uri()
+
+    def _base_cmd(self) -> List[str]:
+        return [
+            self.soffice_path,
+            f"-env:UserInstallation={self.profile_url}",
+            "--headless",
+            "--invisible",
+            "--nologo",
+            "--nodefault",
+            "--norestore",
+            "--nolockcheck",
+        ]
+
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None and self.desktop is not None
+
+    def start(self):
+        """启动常驻进程并建立UNO连接"""
+        cmd = self._base_cmd() + [f"--accept=pipe,name={self.pipe_name};urp;StarOffice.ComponentContext"]
+        self.proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, **_popen_kwargs())
+
+        local_ctx = uno.getComponentContext()
+        resolver = local_ctx.ServiceManager.createInstanceWithContext("com.sun.star.bridge.UnoUrlResolver", local_ctx)
+        deadline = time.time() + self.start_timeout
+        last_error = None
+        while time.time() < deadline:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"LibreOffice worker {self.index} 启动后立即退出: rc={self.proc.returncode}")
+            try:
+                ctx = resolver.resolve(f"uno:pipe,name={self.pipe_name};urp;StarOffice.ComponentContext")
+                self.desktop = ctx.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", ctx)
+                self.jobs_done = 0
+                logger.info(f"LibreOffice worker {self.index} 已启动 (pid={self.proc.pid})")
+                return
+            except Exception as e:
+                last_error = e
+                time.sleep(0.3)
+        self.stop()
+        raise RuntimeError(f"LibreOffice worker {self.index} 启动超时: {last_error}")
+
+    def stop(self):
+        """结束进程；尝试正常退出，失败时强制结束"""
+        desktop, self.desktop = self.desktop, None
+        if desktop is not None and self.proc is not None and self.proc.poll() is None:
+            try:
+                desktop.terminate()
+                self.proc.wait(timeout=10)
+            except Exception:
+                pass
+        _kill_process_tree(self.proc)
+        self.proc = None
+
+    def restart(self):
+        self.stop()
+        self.restarts += 1
+        self.start()
+
+    def convert(self, src_path: str, out_dir: str, timeout: int) -> str:
+        """转换单个文件，超时后结束进程并抛出 TimeoutError"""
+        os.makedirs(out_dir, exist_ok=True)
+        if not self.use_uno:
+            return self._convert_once(src_path, out_dir, timeout)
+
+        if not self.alive() or self.jobs_done >= self.max_jobs:
+            # 定期重启，避免长时间运行的soffice内存持续增长
+            if self.proc is not None:
+                self.restart()
+            else:
+                self.start()
+
+        timed_out = threading.Event()
+
+        def _on_timeout():
+            timed_out.set()
+            logger.warning(f"LibreOffice worker {self.index} 转换超时({timeout}s)，强制结束: {src_path}")
+            _kill_process_tree(self.proc)
+
+        watchdog = threading.Timer(timeout, _on_timeout)
+        watchdog.daemon = True
+        watchdog.start()
+        try:
+            out_path = self._convert_uno(src_path, out_dir)
+            self.jobs_done += 1
+            return out_path
+        except Exception as e:
+            if timed_out.is_set() or self.proc is None or self.proc.poll() is not None:
+                # 进程挂死被结束或已崩溃，连接失效，下次任务前重启
+                self.desktop = None
+                if timed_out.is_set():
+                    raise TimeoutError(f"LibreOffice 转换超时({timeout}s): {src_path}") from e
+                raise RuntimeError(f"LibreOffice worker {self.index} 进程异常退出: {e}") from e
+            raise RuntimeError(f"LibreOffice 转换失败: {e}") from e
+        finally:
+            watchdog.cancel()
+
+    def _convert_uno(self, src_path: str, out_dir: str) -> str:
+        def _props(**kwargs):
+            props = []
+            for k, v in kwargs.items():
+                p = PropertyValue()
+                p.Name = k
+                p.Value = v
+                props.append(p)
+            return tuple(props)
+
+        src_url = Path(os.path.abspath(src_path)).as_uri()
+        out_path = _expected_pdf_path(src_path, out_dir)
+        doc = self.desktop.loadComponentFromURL(src_url, "_blank", 0, _props(Hidden=True, ReadOnly=True))
+        if doc is None:
+            raise RuntimeError(f"LibreOffice 无法打开文件: {src_path}")
+        try:
+            filter_name = next((f for svc, f in PDF_EXPORT_FILTERS if doc.supportsService(svc)), "writer_pdf_Export")
+            doc.storeToURL(Path(os.path.abspath(out_path)).as_uri(), _props(FilterName=filter_name))
+        finally:
+            try:
+                doc.close(True)
+            except Exception:
+                doc.dispose()
+        if not os.path.exists(out_path):
+            raise RuntimeError(f"LibreOffice 未生成PDF: {out_path}")
+        return out_path
+
+    def _convert_once(self, src_path: str, out_dir: str, timeout: int) -> str:
+        """无UNO时的退化方式：单次 soffice 转换，仍使用本worker独立的用户配置目录"""
+        cmd = self._base_cmd() + ["--convert-to", "pdf", "--outdir", out_dir, os.path.abspath(src_path)]
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, **_popen_kwargs())
+        self.proc = proc
+        try:
+            stdout, stderr = proc.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            _kill_process_tree(proc)
+            raise TimeoutError(f"LibreOffice 转换超时({timeout}s): {src_path}")
+        finally:
+            self.proc = None
+        if proc.returncode != 0:
+            raise RuntimeError(f"LibreOffice 转换失败: rc={proc.returncode}\nstdout={stdout}\nstderr={stderr}")
+        expected = _expected_pdf_path(src_path, out_dir)
+        if not os.path.exists(expected):
+            raise RuntimeError(f"LibreOffice 未生成PDF。stdout={stdout}\nstderr={stderr}")
+        self.jobs_done += 1
+        return expected
+
+
+class LibreOfficePool:
+    """常驻 soffice 进程池：有界任务队列 + 每个worker一个调度线程"""
+
+    def __init__(self,
+                 soffice_path: str,
+                 workers: int = 2,
+                 queue_size: int = 32,
+                 queue_wait: float = 30,
+                 job_timeout: int = 180,
+                 start_timeout: int = 60,
+                 max_jobs_per_worker: int = 200,
+                 profile_root: Optional[str] = None,
+                 use_uno: bool = True):
+        self.soffice_path = soffice_path
+        self.job_timeout = job_timeout
+        self.queue_wait = queue_wait
+        self.profile_root = profile_root or os.path.join(tempfile.gettempdir(), "lo_pool_profiles")
+        self._jobs: "queue.Queue[Optional[tuple]]" = queue.Queue(maxsize=max(1, int(queue_size)))
+        self._workers = [
+            LibreOfficeWorker(
+                i,
+                soffice_path,
+                os.path.join(self.profile_root, f"worker_{i}"),
+                use_uno=use_uno,
+                start_timeout=start_timeout,
+                max_jobs=max_jobs_per_worker,
+            )
+            for i in range(max(1, int(workers)))
+        ]
+        self._threads: List[threading.Thread] = []
+        self._stats = {"completed": 0, "failed": 0, "timeouts": 0}
+        self._stats_lock = threading.Lock()
+        self._closed = False
+        if use_uno and not UNO_AVAILABLE:
+            logger.warning("未找到 uno 模块，LibreOffice进程池退化为单次转换模式（各worker仍使用独立配置目录）")
+
+    def start(self):
+        """启动调度线程；soffice 进程在各worker首次接到任务时启动"""
+        if self._threads:
+            return
+        for worker in self._workers:
+            t = threading.Thread(target=self._loop, args=(worker,), name=f"lo-worker-{worker.index}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        logger.info(f"LibreOffice进程池已启动: {len(self._workers)} 个worker，UNO={'是' if self._workers[0].use_uno else '否'}")
+
+    def submit(self, src_path: str, out_dir: Optional[str] = None, timeout: Optional[int] = None) -> Future:
+        """提交转换任务；队列已满且等待超时时抛出 RuntimeError"""
+        if self._closed:
+            raise RuntimeError("LibreOffice进程池已关闭")
+        future: Future = Future()
+        out_dir = out_dir or tempfile.mkdtemp(prefix="lo_pdf_")
+        try:
+            self._jobs.put((future, src_path, out_dir, timeout or self.job_timeout), timeout=self.queue_wait)
+        except queue.Full:
+            raise RuntimeError(f"LibreOffice转换队列已满（{self._jobs.maxsize}），请稍后重试")
+        return future
+
+    def convert(self, src_path: str, out_dir: Optional[str] = None, timeout: Optional[int] = None) -> str:
+        """同步转换，返回PDF路径"""
+        return self.submit(src_path, out_dir, timeout).result()
+
+    def _loop(self, worker: LibreOfficeWorker):
+        while True:
+            item = self._jobs.get()
+            if item is None:
+                break
+            future, src_path, out_dir, timeout = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = worker.convert(src_path, out_dir, timeout)
+                self._count("completed")
+                future.set_result(result)
+            except Exception as e:
+                self._count("timeouts" if isinstance(e, TimeoutError) else "failed")
+                future.set_exception(e)
+        worker.stop()
+
+    def _count(self, name: str):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            counters = dict(self._stats)
+        return {
+            "workers": len(self._workers),
+            "uno": self._workers[0].use_uno,
+            "queued": self._jobs.qsize(),
+            "restarts": sum(w.restarts for w in self._workers),
+            **counters,
+        }
+
+    def shutdown(self):
+        """停止调度线程并结束所有 soffice 进程"""
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._threads:
+            self._jobs.put(None)
+        for t in self._threads:
+            t.join(timeout=15)
+        for worker in self._workers:
+            worker.stop()
+
+
+# 全局进程池实例
+libreoffice_pool = None
+_libreoffice_pool_initialized = False
+_libreoffice_pool_lock = threading.Lock()
+
+def init_libreoffice_pool(soffice_path: Optional[str] = None, workers: Optional[int] = None) -> Optional[LibreOfficePool]:
+    """初始化LibreOffice进程池（配置关闭或未找到soffice时返回None）"""
+    global libreoffice_pool, _libreoffice_pool_initialized
+    _libreoffice_pool_initialized = True
+    if not LIBREOFFICE_POOL_CONFIG.get("enabled", True):
+        logger.info("LibreOffice进程池已关闭")
+        return None
+    soffice = find_soffice_path(soffice_path or LIBREOFFICE_POOL_CONFIG.get("soffice_path"))
+    if not soffice:
+        logger.warning("未找到LibreOffice的soffice，进程池不可用")
+        return None
+    libreoffice_pool = LibreOfficePool(
+        soffice,
+        workers=workers or LIBREOFFICE_POOL_CONFIG.get("workers", 2),
+        queue_size=LIBREOFFICE_POOL_CONFIG.get("queue_size", 32),
+        queue_wait=LIBREOFFICE_POOL_CONFIG.get("queue_wait", 30),
+        job_timeout=LIBREOFFICE_POOL_CONFIG.get("job_timeout", 180),
+        start_timeout=LIBREOFFICE_POOL_CONFIG.get("start_timeout", 60),
+        max_jobs_per_worker=LIBREOFFICE_POOL_CONFIG.get("max_jobs_per_worker", 200),
+        profile_root=LIBREOFFICE_POOL_CONFIG.get("profile_root"),
+        use_uno=LIBREOFFICE_POOL_CONFIG.get("use_uno", True),
+    )
+    libreoffice_pool.start()
+    atexit.register(libreoffice_pool.shutdown)
+    return libreoffice_pool
+
+def get_libreoffice_pool() -> Optional[LibreOfficePool]:
+    """获取LibreOffice进程池实例（不可用时为None）"""
+    global libreoffice_pool
+    if libreoffice_pool is None and not _libreoffice_pool_initialized:
+        with _libreoffice_pool_lock:
+            if not _libreoffice_pool_initialized:
+                libreoffice_pool = init_libreoffice_pool()
+    return libreoffice_pool
+
+def shutdown_libreoffice_pool():
+    """关闭进程池（未初始化时不做任何事）"""
+    if libreoffice_pool is not None:
+        libreoffice_pool.shutdown()
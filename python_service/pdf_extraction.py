@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PDF 块级文本与坐标提取
+- 串行：逐页调用 page.get_text("dict")，标志位、裁剪区域与输出字段由提取配置档决定
+- 配置档按源文件类型选择，下游需要字体（标题识别）或图片块时升级配置档；
+  默认只取文本与bbox，不让PyMuPDF解码图片
+- span位置信息写入列式span表（span_table.SpanTable），块的 positions 是表中行的视图，不再每个span一个dict
+- 并行：按页码区间拆分给进程池，每个进程独立打开PDF，结果按页序合并，与串行输出一致
+本模块只依赖 PyMuPDF，子进程导入时不会加载 FastAPI 应用
+"""
+
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import fitz  # PyMuPDF
+
+from config import PDF_EXTRACT_CONFIG, PDF_EXTRACT_PROFILES
+from span_table import SpanTable
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+TEXT_FLAG_NAMES = {
+    "preserve_ligatures": fitz.TEXT_PRESERVE_LIGATURES,
+    "preserve_whitespace": fitz.TEXT_PRESERVE_WHITESPACE,
+    "preserve_images": fitz.TEXT_PRESERVE_IMAGES,
+    "inhibit_spaces": fitz.TEXT_INHIBIT_SPACES,
+    "dehyphenate": fitz.TEXT_DEHYPHENATE,
+    "preserve_spans": fitz.TEXT_PRESERVE_SPANS,
+    "mediabox_clip": fitz.TEXT_MEDIABOX_CLIP,
+}
+
+
+def get_extract_profile(name: Optional[str] = None) -> Dict[str, Any]:
+    """
+    解析提取配置档：{"name", "flags"(PyMuPDF标志位), "fonts", "images", "clip_margins"}
+    未知名称回退到 default_profile
+    """
+    name = name or PDF_EXTRACT_CONFIG.get("default_profile", "text")
+    if name not in PDF_EXTRACT_PROFILES:
+        logger.warning(f"未知的PDF提取配置档 {name}，使用默认配置档")
+        name = PDF_EXTRACT_CONFIG.get("default_profile", "text")
+    cfg = PDF_EXTRACT_PROFILES[name]
+    flags = 0
+    for flag in cfg.get("flags", []):
+        flags |= TEXT_FLAG_NAMES[flag]
+    return {
+        "name": name,
+        "flags": flags,
+        "fonts": bool(cfg.get("fonts")),
+        "images": bool(cfg.get("images")),
+        "clip_margins": cfg.get("clip_margins"),
+    }
+
+
+def select_extract_profile(filename: str = "", need_fonts: bool = False, need_images: bool = False) -> Dict[str, Any]:
+    """按源文件类型选择配置档；下游需要字体或图片块时取能满足需要的配置档"""
+    ext = Path(filename).suffix.lower()
+    name = PDF_EXTRACT_CONFIG.get("profile_by_type", {}).get(ext) or PDF_EXTRACT_CONFIG.get("default_profile", "text")
+    profile = get_extract_profile(name)
+    if need_images and not profile["images"]:
+        profile = get_extract_profile("images")
+    elif need_fonts and not profile["fonts"]:
+        profile = get_extract_profile("fonts")
+    return profile
+
+
+def page_clip(page: "fitz.Page", profile: Dict[str, Any]) -> Optional["fitz.Rect"]:
+    """配置档的裁剪区域：页面矩形去掉四周边距；未配置时为None（整页）"""
+    margins = profile.get("clip_margins")
+    if not margins:
+        return None
+    rect = page.rect
+    return fitz.Rect(
+        rect.x0 + float(margins.get("left", 0)),
+        rect.y0 + float(margins.get("top", 0)),
+        rect.x1 - float(margins.get("right", 0)),
+        rect.y1 - float(margins.get("bottom", 0)),
+    )
+
+
+def get_page_dict(page: "fitz.Page", profile: Optional[Dict[str, Any]] = None) -> Dict:
+    """按配置档调用 page.get_text("dict")"""
+    profile = profile or get_extract_profile()
+    return page.get_text("dict", flags=profile["flags"], clip=page_clip(page, profile))
+
+
+def extract_page_blocks(page: "fitz.Page", page_num: int, profile: Optional[Dict[str, Any]] = None,
+                        table: Optional[SpanTable] = None) -> List[Dict]:
+    """
+    提取单页的文本块及span级位置信息（page_num 从0开始）
+    span写入列式span表 table（未提供时新建），块的 positions 为表中对应行的视图，可按dict读取
+    配置档带字体时span记录 font/font_size；带图片时另外输出 block_type 为 image 的图片块（content 为空）
+    """
+    profile = profile or get_extract_profile()
+    with_fonts = profile["fonts"]
+    if table is None:
+        table = SpanTable(with_fonts=with_fonts)
+    documents = []
+    blocks = get_page_dict(page, profile)
+
+    for block_idx, block in enumerate(blocks["blocks"]):
+        if block.get("type") == 1:
+            if profile["images"]:
+                documents.append({
+                    "content": "",
+                    "page": page_num + 1,
+                    "block_idx": block_idx,
+                    "block_type": "image",
+                    "positions": [],
+                    "bbox": list(block["bbox"]),
+                    "width": block.get("width"),
+                    "height": block.get("height"),
+                })
+            continue
+        if "lines" in block:
+            # 收集整个块的所有文本，span写入span表
+            texts = []
+            first = len(table)
+
+            for line_idx, line in enumerate(block["lines"]):
+                for span_idx, span in enumerate(line["spans"]):
+                    text = span["text"].strip()
+                    if text:
+                        texts.append(text)
+                        if with_fonts:
+                            table.append(text, span["bbox"], page_num + 1, block_idx, line_idx, span_idx,
+                                         font=span["font"], font_size=span["size"])
+                        else:
+                            table.append(text, span["bbox"], page_num + 1, block_idx, line_idx, span_idx)
+
+            if texts:
+                block_positions = table.rows(first, len(table))
+                documents.append({
+                    "content": " ".join(texts),
+                    "page": page_num + 1,
+                    "block_idx": block_idx,
+                    "positions": block_positions,
+                    "bbox": block_positions.bounds()
+                })
+
+    return documents
+
+
+def extract_blocks_serial(doc: "fitz.Document", start: int = 0, end: int = None,
+                          profile: Optional[Dict[str, Any]] = None) -> List[Dict]:
+    """串行提取 [start, end) 页"""
+    end = len(doc) if end is None else end
+    profile = profile or get_extract_profile()
+    table = SpanTable(with_fonts=profile["fonts"])
+    documents = []
+    for page_num in range(start, end):
+        documents.extend(extract_page_blocks(doc.load_page(page_num), page_num, profile, table))
+    return documents
+
+
+def _extract_page_range_worker(args: Tuple[str, int, int, Dict[str, Any]]) -> List[Dict]:
+    """进程池任务：独立打开PDF并提取指定页区间"""
+    pdf_path, start, end, profile = args
+    doc = fitz.open(pdf_path)
+    try:
+        return extract_blocks_serial(doc, start, end, profile)
+    finally:
+        doc.close()
+
+
+def split_page_ranges(total_pages: int, workers: int, ranges_per_worker: int = 4) -> List[Tuple[int, int]]:
+    """将页码切成连续区间；区间数多于进程数，便于页面复杂度不均时负载均衡"""
+    parts = max(1, min(total_pages, workers * max(1, ranges_per_worker)))
+    size, rest = divmod(total_pages, parts)
+    ranges = []
+    start = 0
+    for i in range(parts):
+        end = start + size + (1 if i < rest else 0)
+        if end > start:
+            ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def extract_blocks_parallel(pdf_path: str, total_pages: int, workers: int,
+                            profile: Optional[Dict[str, Any]] = None) -> List[Dict]:
+    """进程池并行提取，按页序合并"""
+    ranges = split_page_ranges(total_pages, workers, PDF_EXTRACT_CONFIG.get("ranges_per_worker", 4))
+    ctx = multiprocessing.get_context(PDF_EXTRACT_CONFIG.get("start_method", "spawn"))
+    documents: List[Dict] = []
+    with ProcessPoolExecutor(max_workers=min(workers, len(ranges)), mp_context=ctx) as pool:
+        # map 按提交顺序返回，保证页序与串行一致
+        profile = profile or get_extract_profile()
+        for part in pool.map(_extract_page_range_worker, [(pdf_path, s, e, profile) for s, e in ranges]):
+            documents.extend(part)
+    return documents
+
+
+def resolve_parallel_workers() -> int:
+    workers = PDF_EXTRACT_CONFIG.get("parallel_workers") or os.cpu_count() or 1
+    return max(1, int(workers))
+
+
+def extract_documents_with_block_positions(doc: "fitz.Document", filename: str,
+                                           profile: Optional[Dict[str, Any]] = None) -> List[Dict]:
+    """
+    直接从PyMuPDF提取文档块和位置信息
+    profile 为空时按文件类型选择配置档
+    页数达到阈值且PDF来自磁盘文件时走进程池并行，否则串行
+    """
+    profile = profile or select_extract_profile(filename)
+    total_pages = len(doc)
+    workers = resolve_parallel_workers()
+    pdf_path = getattr(doc, "name", "") or ""
+    use_parallel = (
+        PDF_EXTRACT_CONFIG.get("parallel_enabled", True)
+        and workers > 1
+        and total_pages >= int(PDF_EXTRACT_CONFIG.get("parallel_min_pages", 64))
+        and os.path.isfile(pdf_path)
+    )
+    if use_parallel:
+        try:
+            documents = extract_blocks_parallel(pdf_path, total_pages, workers, profile)
+            logger.info(f"并行提取完成: {filename}，{total_pages} 页，{workers} 个进程，配置档 {profile['name']}")
+            return documents
+        except Exception as e:
+            logger.warning(f"并行提取失败，回退串行: {e}")
+    return extract_blocks_serial(doc, profile=profile)
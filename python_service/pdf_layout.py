@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文本流式排版写入PDF（供 TXT 等原生解析生成回显PDF）
+- 用进程级缓存的中文字体（font_registry）实测字符宽度换行、按字体的 ascender/descender 计算行高，写满一页自动分页
+- 用 TextWriter 逐行写入，同时记录每行实际所在的页码与bbox，直接作为chunk的位置信息
+- 换行点用前缀和 + 二分查找，整体耗时与文本长度线性相关
+"""
+
+import logging
+import os
+from bisect import bisect_right
+from itertools import accumulate
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import fitz  # PyMuPDF
+
+from config import PDF_LAYOUT_CONFIG
+from font_registry import get_font_registry
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# TextWriter.append 每次都会重算已写入文本的整体bbox，单个writer写入行数越多越慢；
+# 每写入该数量的视觉行就落盘并换新writer（过小则内容流过多，保存变慢）
+WRITER_BATCH_LINES = 16
+
+# (页码(从1开始), bbox, 行内起点, 行内终点)
+LineSegment = Tuple[int, List[float], int, int]
+
+class PageFlow:
+    """
+    逐行排版：超出版心宽度自动换行（优先在空格处断开，中文可在任意字符处断开），
+    超出版心高度自动分页
+    """
+
+    def __init__(self,
+                 doc: "fitz.Document",
+                 font: Optional["fitz.Font"] = None,
+                 fontsize: Optional[float] = None,
+                 line_spacing: Optional[float] = None):
+        cfg = PDF_LAYOUT_CONFIG
+        self.doc = doc
+        self.font = font or get_font_registry().text_font()
+        self.fontsize = float(fontsize or cfg.get("fontsize", 10.5))
+        self.page_width = float(cfg.get("page_width", 595))
+        self.page_height = float(cfg.get("page_height", 842))
+        self.left = float(cfg.get("margin_left", 40))
+        self.right = self.page_width - float(cfg.get("margin_right", 40))
+        self.top = float(cfg.get("margin_top", 50))
+        self.bottom = self.page_height - float(cfg.get("margin_bottom", 42))
+        self.line_spacing = float(line_spacing or cfg.get("line_spacing", 1.3))
+        self.page: Optional["fitz.Page"] = None
+        self.page_no = 0
+        self.writer: Optional["fitz.TextWriter"] = None
+        self.writer_lines = 0
+        self.y = self.top
+        # 写入过的字符，保存时据此子集化字体
+        self.used_chars = set()
+
+    def _text_height(self, fontsize: float) -> float:
+        return (self.font.ascender - self.font.descender) * fontsize
+
+    def _new_page(self):
+        self._flush()
+        self.page = self.doc.new_page(width=self.page_width, height=self.page_height)
+        self.page_no += 1
+        self.y = self.top
+
+    def _flush(self):
+        if self.writer is not None and self.page is not None:
+            self.writer.write_text(self.page)
+        self.writer = None
+        self.writer_lines = 0
+
+    def _append(self, point: Tuple[float, float], text: str, fontsize: float):
+        if self.writer is None:
+            self.writer = fitz.TextWriter(self.page.rect)
+        self.writer.append(point, text, font=self.font, fontsize=fontsize)
+        self.used_chars.update(text)
+        self.writer_lines += 1
+        if self.writer_lines >= WRITER_BATCH_LINES:
+            self._flush()
+
+    def add_gap(self, height: float):
+        """空白（空行、段间距）；跨页时下一行从新页顶部开始"""
+        self.y += height
+
+    def line_step(self, fontsize: Optional[float] = None) -> float:
+        return self._text_height(float(fontsize or self.fontsize)) * self.line_spacing
+
+    def wrap(self, text: str, fontsize: float, max_width: float) -> List[Tuple[int, int, float]]:
+        """按实测宽度换行，返回各视觉行的 (起点, 终点, 宽度)"""
+        prefix = list(accumulate(self.font.char_lengths(text, fontsize), initial=0.0))
+        n = len(text)
+        lines: List[Tuple[int, int, float]] = []
+        pos = 0
+        while pos < n:
+            brk = bisect_right(prefix, prefix[pos] + max_width) - 1
+            if brk <= pos:
+                brk = pos + 1
+            if brk < n:
+                sp = text.rfind(" ", pos, brk)
+                if sp > pos:
+                    brk = sp + 1
+            lines.append((pos, brk, prefix[brk] - prefix[pos]))
+            pos = brk
+        return lines
+
+    def add_line(self, text: str, fontsize: Optional[float] = None, indent: float = 0.0) -> List[LineSegment]:
+        """
+        写入一个逻辑行，返回其各视觉行的 (页码, bbox, 行内起点, 行内终点)
+        空行只推进行高，不产生记录
+        """
+        fs = float(fontsize or self.fontsize)
+        text_h = self._text_height(fs)
+        step = text_h * self.line_spacing
+        if not text.strip():
+            self.add_gap(step)
+            return []
+
+        # Tab 等宽替换为空格，保持字符下标不变
+        render = text.replace("\t", " ")
+        x0 = self.left + indent
+        segments: List[LineSegment] = []
+        for start, end, width in self.wrap(render, fs, max(self.right - x0, fs)):
+            if self.page is None or self.y + text_h > self.bottom:
+                self._new_page()
+            piece = render[start:end]
+            if piece.strip():
+                self._append((x0, self.y + self.font.ascender * fs), piece, fs)
+                segments.append((self.page_no, [x0, self.y, x0 + width, self.y + text_h], start, end))
+            self.y += step
+        return segments
+
+    def add_row(self, cells: List[str], fontsize: Optional[float] = None, padding: float = 3.0) -> List[LineSegment]:
+        """
+        写入表格行：各单元格等宽分列、格内换行，行高取最高的单元格，整行不跨页
+        返回整行的 (页码, bbox, 0, len("\t".join(cells)))；单行高度超过一页时退化为按普通文本行写入
+        """
+        fs = float(fontsize or self.fontsize)
+        text_h = self._text_height(fs)
+        step = text_h * self.line_spacing
+        row_text = "\t".join(cells)
+        if not row_text.strip():
+            return []
+        col_w = (self.right - self.left) / max(1, len(cells))
+        # 单元格内的Tab/换行按空格排版，字符下标不变
+        cells = [c.replace("\t", " ").replace("\n", " ") for c in cells]
+        wrapped = [self.wrap(c, fs, max(col_w - 2 * padding, fs)) for c in cells]
+        row_h = max(1, max(len(w) for w in wrapped)) * step + 2 * padding
+        if row_h > self.bottom - self.top:
+            return merge_segments_by_page(self.add_line(row_text, fs))
+        if self.page is None or self.y + row_h > self.bottom:
+            self._new_page()
+
+        top = self.y
+        for col, (cell, lines) in enumerate(zip(cells, wrapped)):
+            x0 = self.left + col * col_w + padding
+            for i, (start, end, _) in enumerate(lines):
+                piece = cell[start:end]
+                if piece.strip():
+                    self._append((x0, top + padding + i * step + self.font.ascender * fs), piece, fs)
+        self.page.draw_rect(fitz.Rect(self.left, top, self.right, top + row_h), color=(0.75, 0.75, 0.75), width=0.5)
+        self.y = top + row_h
+        return [(self.page_no, [self.left, top, self.right, top + row_h], 0, len(row_text))]
+
+    def finish(self):
+        """写入最后一页；空文档补一页空白页，保证可保存"""
+        if self.page is None:
+            self._new_page()
+        self._flush()
+
+
+def merge_segments_by_page(segments: List[LineSegment]) -> List[LineSegment]:
+    """同一逻辑行在同一页上的视觉行合并为一个bbox"""
+    merged: List[LineSegment] = []
+    for page_no, bbox, start, end in segments:
+        if merged and merged[-1][0] == page_no:
+            _, mb, ms, _ = merged[-1]
+            merged[-1] = (page_no, [min(mb[0], bbox[0]), mb[1], max(mb[2], bbox[2]), bbox[3]], ms, end)
+        else:
+            merged.append((page_no, list(bbox), start, end))
+    return merged
+
+
+def render_text_lines(lines: Iterable[str], out_path: str, font: Optional["fitz.Font"] = None) -> List[Dict]:
+    """
+    将文本逐行排版写入PDF（多页），返回每行的位置记录：
+    {"line_no", "char_start", "char_end", "page", "bbox"}，char_* 为在以换行拼接的全文中的区间；
+    跨页的行按页拆成多条
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    doc = fitz.open()
+    flow = PageFlow(doc, font=font)
+    positions: List[Dict] = []
+    offset = 0
+    for line_no, line in enumerate(lines, start=1):
+        for page_no, bbox, start, end in merge_segments_by_page(flow.add_line(line)):
+            positions.append({
+                "line_no": line_no,
+                "char_start": offset + start,
+                "char_end": offset + end,
+                "page": page_no,
+                "bbox": bbox,
+            })
+        offset += len(line) + 1  # 计入换行
+    flow.finish()
+    get_font_registry().save(doc, out_path, used_chars=flow.used_chars)
+    doc.close()
+    return positions
+
+
+def iter_text_file_lines(path: str) -> Iterable[str]:
+    """逐行读取文本文件（换行统一为\\n，不含行尾换行符），不一次性读入内存"""
+    with open(path, "r", encoding="utf-8", errors="ignore", newline=None) as f:
+        for line in f:
+            yield line[:-1] if line.endswith("\n") else line
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+RAG 检索
+- script_score：bool过滤后对每个命中文档执行 cosineSimilarity，精确但耗时随文档量线性增长
+- knn：ES原生近似kNN（HNSW），num_candidates 控制召回/耗时，过滤条件放在kNN内部（先过滤再取近邻，
+  不会出现取完近邻再过滤导致结果不足的情况）
+  两种方式返回的得分统一为 1+cos，引用中的相关性数值含义不变
+- hybrid：content 上的BM25 match 与向量检索两路并发，倒数排名融合（RRF），补上基金代码、日期、费率等
+  向量检索容易漏掉的精确字面匹配；服务端支持 rank.rrf 时一次请求完成，否则客户端融合
+  融合后的得分为RRF得分（Σ weight / (k + 排名)）
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import RETRIEVAL_CONFIG
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MODE_SCRIPT_SCORE = "script_score"
+MODE_KNN = "knn"
+MODE_HYBRID = "hybrid"
+RETRIEVAL_MODES = (MODE_SCRIPT_SCORE, MODE_KNN, MODE_HYBRID)
+VECTOR_MODES = (MODE_SCRIPT_SCORE, MODE_KNN)
+
+# chat 需要的ES字段
+CHUNK_SOURCE_FIELDS = [
+    "content",
+    "knowledge_id",
+    "knowledge_name",
+    "description",
+    "tags",
+    "effective_time",
+    "source_file",
+    "page_num",
+    "chunk_index",
+    "bbox",
+    "positions"
+]
+
+
+def resolve_retrieval_mode(mode: Optional[str] = None) -> str:
+    """请求指定的检索方式优先，否则取配置；未知取值回退 script_score"""
+    mode = (mode or RETRIEVAL_CONFIG.get("mode") or MODE_SCRIPT_SCORE).lower()
+    if mode not in RETRIEVAL_MODES:
+        logger.warning(f"未知的检索方式 {mode}，使用 {MODE_SCRIPT_SCORE}")
+        return MODE_SCRIPT_SCORE
+    return mode
+
+
+def resolve_num_candidates(size: int, num_candidates: Optional[int] = None) -> int:
+    nc = int(num_candidates or RETRIEVAL_CONFIG.get("num_candidates", 100))
+    return max(size, min(nc, int(RETRIEVAL_CONFIG.get("max_num_candidates", 10000))))
+
+
+def build_script_score_query(query_vector: List[float], size: int, filters: List[Dict],
+                             source: Optional[List[str]] = None) -> Dict[str, Any]:
+    """精确检索：过滤后逐文档计算余弦相似度，得分为 1+cos"""
+    field = RETRIEVAL_CONFIG.get("vector_field", "embedding")
+    return {
+        "size": size,
+        "query": {
+            "script_score": {
+                "query": {
+                    "bool": {
+                        "filter": filters
+                    }
+                },
+                "script": {
+                    "source": f"cosineSimilarity(params.query_vector, '{field}') + 1.0",
+                    "params": {"query_vector": query_vector}
+                }
+            }
+        },
+        "_source": source or CHUNK_SOURCE_FIELDS,
+    }
+
+
+def build_knn_query(query_vector: List[float], size: int, filters: List[Dict],
+                    num_candidates: Optional[int] = None,
+                    source: Optional[List[str]] = None) -> Dict[str, Any]:
+    """近似检索：ES原生kNN，过滤条件在kNN内部生效"""
+    knn: Dict[str, Any] = {
+        "field": RETRIEVAL_CONFIG.get("vector_field", "embedding"),
+        "query_vector": query_vector,
+        "k": size,
+        "num_candidates": resolve_num_candidates(size, num_candidates),
+    }
+    if filters:
+        knn["filter"] = {"bool": {"filter": filters}}
+    return {
+        "size": size,
+        "knn": knn,
+        "_source": source or CHUNK_SOURCE_FIELDS,
+    }
+
+
+def _knn_score_to_script_score(score: float) -> float:
+    """cosine/dot_product 的kNN得分为 (1+cos)/2，换算为 script_score 的 1+cos"""
+    if RETRIEVAL_CONFIG.get("similarity", "cosine") in ("cosine", "dot_product"):
+        return score * 2.0
+    return score
+
+
+def search_chunks(es, index: str, query_vector: List[float], size: int, filters: List[Dict],
+                  mode: Optional[str] = None, num_candidates: Optional[int] = None,
+                  source: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    按检索方式查询ES，返回 {"hits", "mode", "took_ms"}
+    kNN查询失败且允许回退时改用 script_score（mode 为实际使用的方式）
+    """
+    mode = resolve_retrieval_mode(mode)
+    t0 = time.perf_counter()
+    if mode == MODE_KNN:
+        try:
+            response = es.search(index=index, body=build_knn_query(query_vector, size, filters, num_candidates, source))
+            hits = response.get("hits", {}).get("hits", [])
+            for hit in hits:
+                hit["_score"] = _knn_score_to_script_score(hit.get("_score") or 0.0)
+            return {"hits": hits, "mode": mode, "took_ms": (time.perf_counter() - t0) * 1000}
+        except Exception as e:
+            if not RETRIEVAL_CONFIG.get("fallback_to_script_score", True):
+                raise
+            logger.warning(f"kNN检索失败，回退 script_score（请确认 embedding 字段已建向量索引）: {e}")
+            mode = MODE_SCRIPT_SCORE
+    response = es.search(index=index, body=build_script_score_query(query_vector, size, filters, source))
+    hits = response.get("hits", {}).get("hits", [])
+    return {"hits": hits, "mode": mode, "took_ms": (time.perf_counter() - t0) * 1000}
+
+
+def build_bm25_query(query_text: str, size: int, filters: List[Dict],
+                     source: Optional[List[str]] = None) -> Dict[str, Any]:
+    """关键词检索：content 上的 match（BM25），过滤条件同向量检索"""
+    return {
+        "size": size,
+        "query": {
+            "bool": {
+                "must": [{"match": {"content": {"query": query_text}}}],
+                "filter": filters
+            }
+        },
+        "_source": source or CHUNK_SOURCE_FIELDS,
+    }
+
+
+def reciprocal_rank_fusion(legs: Dict[str, Tuple[List[Dict], float]], rrf_k: int, size: int) -> List[Dict]:
+    """
+    倒数排名融合：score(d) = Σ weight / (rrf_k + rank)，rank 从1开始
+    legs: {名称: (按得分降序的hits, 权重)}；同一文档在各路的排名记入 hit["_ranks"]
+    """
+    fused: Dict[str, Dict] = {}
+    for name, (hits, weight) in legs.items():
+        for rank, hit in enumerate(hits, start=1):
+            entry = fused.get(hit["_id"])
+            if entry is None:
+                entry = fused[hit["_id"]] = {"hit": dict(hit), "score": 0.0, "ranks": {}}
+            entry["score"] += weight / (rrf_k + rank)
+            entry["ranks"][name] = rank
+    # 得分相同时，任一路排名更靠前的优先
+    ordered = sorted(fused.values(), key=lambda e: (-e["score"], min(e["ranks"].values())))
+    hits = []
+    for entry in ordered[:size]:
+        hit = entry["hit"]
+        hit["_score"] = entry["score"]
+        hit["_ranks"] = entry["ranks"]
+        hits.append(hit)
+    return hits
+
+
+# 混合检索两路并发用的线程池（进程内共用）
+_leg_pool = None
+_leg_pool_lock = threading.Lock()
+# 服务端 rank.rrf 不可用（版本/许可证）时记下，之后直接客户端融合
+_server_rrf_unavailable = False
+# 表示 rank.rrf 不可用的状态码：400 版本不支持该参数，403 许可证不含该功能
+SERVER_RRF_REJECTED_STATUS = (400, 403)
+
+def get_leg_pool() -> ThreadPoolExecutor:
+    global _leg_pool
+    if _leg_pool is None:
+        with _leg_pool_lock:
+            if _leg_pool is None:
+                workers = int(RETRIEVAL_CONFIG.get("hybrid", {}).get("leg_workers", 8))
+                _leg_pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="retrieval")
+    return _leg_pool
+
+
+def _use_server_rrf(cfg: Dict[str, Any], vector_mode: str) -> bool:
+    """服务端 rank.rrf 只支持 query + knn，且不支持按路加权"""
+    setting = cfg.get("server_side_rrf", "auto")
+    if setting not in (True, "auto") or _server_rrf_unavailable:
+        return False
+    return vector_mode == MODE_KNN and float(cfg.get("bm25_weight", 1.0)) == float(cfg.get("vector_weight", 1.0))
+
+
+def search_hybrid(es, index: str, query_text: str, embed: Callable[[str], Optional[List[float]]],
+                  size: int, filters: List[Dict], num_candidates: Optional[int] = None,
+                  source: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    混合检索，返回 {"hits", "mode", "took_ms", "embedding_ok"}
+    客户端融合时BM25一路在线程池中执行，当前线程同时取问题向量并做向量检索，
+    总耗时约为两路中较慢的一路；向量获取失败时只用BM25结果
+    """
+    global _server_rrf_unavailable
+    cfg = RETRIEVAL_CONFIG.get("hybrid", {})
+    vector_mode = cfg.get("vector_mode", MODE_SCRIPT_SCORE)
+    if vector_mode not in VECTOR_MODES:
+        vector_mode = MODE_SCRIPT_SCORE
+    bm25_size = max(size, int(cfg.get("bm25_size", 20)))
+    vector_size = max(size, int(cfg.get("vector_size", 20)))
+    rrf_k = int(cfg.get("rrf_k", 60))
+    t0 = time.perf_counter()
+
+    vector = None
+    if _use_server_rrf(cfg, vector_mode):
+        vector = embed(query_text)
+        if vector:
+            body = build_bm25_query(query_text, size, filters, source)
+            body["knn"] = build_knn_query(vector, vector_size, filters, num_candidates)["knn"]
+            body["rank"] = {"rrf": {"window_size": max(bm25_size, vector_size), "rank_constant": rrf_k}}
+            try:
+                response = es.search(index=index, body=body)
+                hits = response.get("hits", {}).get("hits", [])
+                for position, hit in enumerate(hits, start=1):
+                    # rank.rrf 的结果 _score 可能为null，按融合排名 _rank 换算
+                    if hit.get("_score") is None:
+                        hit["_score"] = 1.0 / (rrf_k + (hit.get("_rank") or position))
+                return {
+                    "hits": hits,
+                    "mode": f"{MODE_HYBRID}(server_rrf)",
+                    "took_ms": (time.perf_counter() - t0) * 1000,
+                    "embedding_ok": True,
+                }
+            except Exception as e:
+                # 只有请求被拒（版本不支持/许可证不含RRF）才不再尝试；超时等临时错误仅本次改用客户端融合
+                if getattr(e, "status_code", None) in SERVER_RRF_REJECTED_STATUS:
+                    _server_rrf_unavailable = True
+                    logger.warning(f"服务端RRF不可用，之后改用客户端融合: {e}")
+                else:
+                    logger.warning(f"服务端RRF检索失败，本次改用客户端融合: {e}")
+
+    bm25_future = get_leg_pool().submit(
+        lambda: es.search(index=index, body=build_bm25_query(query_text, bm25_size, filters, source))
+    )
+    vector_hits: Optional[List[Dict]] = None
+    vector_error = None
+    try:
+        if vector is None:
+            vector = embed(query_text)
+        if vector:
+            vector_hits = search_chunks(es, index, vector, vector_size, filters, vector_mode, num_candidates, source)["hits"]
+    except Exception as e:
+        vector_error = e
+        logger.warning(f"混合检索向量一路失败: {e}")
+    try:
+        bm25_hits = bm25_future.result().get("hits", {}).get("hits", [])
+    except Exception as e:
+        if vector_hits is None:
+            raise vector_error or e
+        logger.warning(f"混合检索BM25一路失败: {e}")
+        bm25_hits = []
+
+    legs = {"bm25": (bm25_hits, float(cfg.get("bm25_weight", 1.0)))}
+    if vector_hits is not None:
+        legs["vector"] = (vector_hits, float(cfg.get("vector_weight", 1.0)))
+    return {
+        "hits": reciprocal_rank_fusion(legs, rrf_k, size),
+        "mode": MODE_HYBRID,
+        "took_ms": (time.perf_counter() - t0) * 1000,
+        "embedding_ok": bool(vector),
+    }
+
+
+def retrieve(es, index: str, query_text: str, embed: Callable[[str], Optional[List[float]]],
+             size: int, filters: List[Dict], mode: Optional[str] = None,
+             num_candidates: Optional[int] = None, source: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    检索入口，返回 {"hits", "mode", "took_ms", "embedding_ok"}
+    embed 把问题转为向量（失败返回空）；纯向量检索时取不到向量直接返回空结果
+    """
+    mode = resolve_retrieval_mode(mode)
+    if mode == MODE_HYBRID:
+        return search_hybrid(es, index, query_text, embed, size, filters, num_candidates, source)
+    vector = embed(query_text)
+    if not vector:
+        return {"hits": [], "mode": mode, "took_ms": 0.0, "embedding_ok": False}
+    result = search_chunks(es, index, vector, size, filters, mode, num_candidates, source)
+    result["embedding_ok"] = True
+    return result
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+列式span表：PDF提取的span位置信息按列存放，替代每个span一个dict
+- bbox 四列 float32（MuPDF内部坐标即为float，存取无精度损失）
+- 页码/块/行/span序号 int32 列；字体名驻留为字体表下标，字号 float32
+- 所有span文本拼成一个字符串缓冲区，按偏移切取
+- 下标访问返回 SpanRecord，可像dict一样读取（["text"]、.get、dict(record)），现有调用方无需改动；
+  写入ES等需要真正dict的地方用 positions_to_dicts 转换
+大文档上每个span从数百字节的dict+list+str降到几十字节
+"""
+
+from array import array
+from collections.abc import Mapping
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+BASE_FIELDS = ("text", "bbox", "page", "block_idx", "line_idx", "span_idx")
+FONT_FIELDS = ("font", "font_size")
+CHAR_FIELDS = ("char_start", "char_end")
+
+
+class SpanTable:
+    """按列存放的span位置信息"""
+
+    def __init__(self, with_fonts: bool = False):
+        self.with_fonts = with_fonts
+        self.x0 = array("f")
+        self.y0 = array("f")
+        self.x1 = array("f")
+        self.y1 = array("f")
+        self.page = array("i")
+        self.block_idx = array("i")
+        self.line_idx = array("i")
+        self.span_idx = array("i")
+        self.font_id = array("i")
+        self.font_size = array("f")
+        self.fonts: List[str] = []
+        self._font_ids: Dict[str, int] = {}
+        # 文本缓冲区：第 i 个span的文本为 _text[text_offsets[i]:text_offsets[i+1]]
+        self.text_offsets = array("q", [0])
+        self._text = ""
+        self._pending: List[str] = []
+        # 在拼接文本中的字符区间，按需启用（set_char_range）
+        self.char_start: Optional[array] = None
+        self.char_end: Optional[array] = None
+
+    def __len__(self) -> int:
+        return len(self.page)
+
+    def __getitem__(self, i: int) -> "SpanRecord":
+        n = len(self.page)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("span下标越界")
+        return SpanRecord(self, i)
+
+    def __iter__(self) -> Iterator["SpanRecord"]:
+        for i in range(len(self.page)):
+            yield SpanRecord(self, i)
+
+    def __getstate__(self):
+        # 进程池返回结果时只序列化合并后的文本
+        self._flush_text()
+        state = self.__dict__.copy()
+        state.pop("_font_ids")
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._font_ids = {name: i for i, name in enumerate(self.fonts)}
+
+    def _flush_text(self):
+        if self._pending:
+            self._text += "".join(self._pending)
+            self._pending = []
+
+    def intern_font(self, name: str) -> int:
+        font_id = self._font_ids.get(name)
+        if font_id is None:
+            font_id = len(self.fonts)
+            self.fonts.append(name)
+            self._font_ids[name] = font_id
+        return font_id
+
+    def append(self, text: str, bbox: Sequence[float], page: int, block_idx: int = -1,
+               line_idx: int = -1, span_idx: int = -1,
+               font: Optional[str] = None, font_size: Optional[float] = None) -> int:
+        """追加一个span，返回其下标"""
+        x0, y0, x1, y1 = bbox
+        self.x0.append(x0)
+        self.y0.append(y0)
+        self.x1.append(x1)
+        self.y1.append(y1)
+        self.page.append(page)
+        self.block_idx.append(block_idx)
+        self.line_idx.append(line_idx)
+        self.span_idx.append(span_idx)
+        if self.with_fonts:
+            self.font_id.append(self.intern_font(font or ""))
+            self.font_size.append(font_size or 0.0)
+        self._pending.append(text)
+        self.text_offsets.append(self.text_offsets[-1] + len(text))
+        if self.char_start is not None:
+            self.char_start.append(-1)
+            self.char_end.append(-1)
+        return len(self.page) - 1
+
+    def rows(self, start: int, end: int) -> "SpanRows":
+        return SpanRows(self, start, end)
+
+    def text(self, i: int) -> str:
+        self._flush_text()
+        return self._text[self.text_offsets[i]:self.text_offsets[i + 1]]
+
+    def text_len(self, i: int) -> int:
+        return self.text_offsets[i + 1] - self.text_offsets[i]
+
+    def bbox(self, i: int) -> List[float]:
+        return [self.x0[i], self.y0[i], self.x1[i], self.y1[i]]
+
+    def bounds(self, start: int, end: int) -> List[float]:
+        """[start, end) 行的bbox并集"""
+        if end <= start:
+            return [0, 0, 0, 0]
+        return [min(self.x0[start:end]), min(self.y0[start:end]),
+                max(self.x1[start:end]), max(self.y1[start:end])]
+
+    def set_char_range(self, i: int, start: int, end: int):
+        if self.char_start is None:
+            self.char_start = array("q", [-1]) * len(self)
+            self.char_end = array("q", [-1]) * len(self)
+        self.char_start[i] = start
+        self.char_end[i] = end
+
+    def fields(self, i: int) -> tuple:
+        """第 i 行具有的字段名"""
+        names = BASE_FIELDS
+        if self.with_fonts:
+            names += FONT_FIELDS
+        if self.char_start is not None and self.char_start[i] >= 0:
+            names += CHAR_FIELDS
+        return names
+
+    def value(self, i: int, key: str):
+        if key == "text":
+            return self.text(i)
+        if key == "bbox":
+            return self.bbox(i)
+        if key in ("page", "block_idx", "line_idx", "span_idx"):
+            return getattr(self, key)[i]
+        if self.with_fonts:
+            if key == "font":
+                return self.fonts[self.font_id[i]]
+            if key == "font_size":
+                return self.font_size[i]
+        if self.char_start is not None and key in CHAR_FIELDS and self.char_start[i] >= 0:
+            return getattr(self, key)[i]
+        raise KeyError(key)
+
+    def to_dict(self, i: int) -> Dict:
+        return {key: self.value(i, key) for key in self.fields(i)}
+
+    def nbytes(self) -> int:
+        """列数据与文本缓冲区占用的字节数（估算）"""
+        self._flush_text()
+        columns = [self.x0, self.y0, self.x1, self.y1, self.page, self.block_idx, self.line_idx,
+                   self.span_idx, self.font_id, self.font_size, self.text_offsets]
+        if self.char_start is not None:
+            columns += [self.char_start, self.char_end]
+        return sum(c.itemsize * len(c) for c in columns) + len(self._text.encode("utf-8"))
+
+
+class SpanRecord(Mapping):
+    """span表中一行的只读dict视图（字符区间除外，可赋值）"""
+
+    __slots__ = ("table", "index")
+
+    def __init__(self, table: SpanTable, index: int):
+        self.table = table
+        self.index = index
+
+    def __getitem__(self, key: str):
+        return self.table.value(self.index, key)
+
+    def __setitem__(self, key: str, value: int):
+        if key not in CHAR_FIELDS:
+            raise TypeError(f"span记录只读: {key}")
+        table = self.table
+        start = table.char_start[self.index] if table.char_start is not None else -1
+        end = table.char_end[self.index] if table.char_end is not None else -1
+        if key == "char_start":
+            start = value
+        else:
+            end = value
+        table.set_char_range(self.index, start, end)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.table.fields(self.index))
+
+    def __len__(self) -> int:
+        return len(self.table.fields(self.index))
+
+    def copy(self) -> Dict:
+        return self.table.to_dict(self.index)
+
+    def __repr__(self) -> str:
+        return f"SpanRecord({self.copy()!r})"
+
+    def __reduce__(self):
+        return SpanRecord, (self.table, self.index)
+
+
+class SpanRows(Sequence):
+    """span表中连续的若干行（一个文本块的positions）"""
+
+    __slots__ = ("table", "start", "stop")
+
+    def __init__(self, table: SpanTable, start: int, stop: int):
+        self.table = table
+        self.start = start
+        self.stop = stop
+
+    def __len__(self) -> int:
+        return self.stop - self.start
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [SpanRecord(self.table, self.start + j) for j in range(*i.indices(len(self)))]
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("span下标越界")
+        return SpanRecord(self.table, self.start + i)
+
+    def __iter__(self) -> Iterator[SpanRecord]:
+        for i in range(self.start, self.stop):
+            yield SpanRecord(self.table, i)
+
+    def bounds(self) -> List[float]:
+        return self.table.bounds(self.start, self.stop)
+
+    def __reduce__(self):
+        return SpanRows, (self.table, self.start, self.stop)
+
+
+def positions_to_dicts(positions: Iterable) -> List[Dict]:
+    """转换为可JSON序列化的dict列表（普通dict原样保留）"""
+    return [p.copy() if isinstance(p, SpanRecord) else p for p in positions or []]
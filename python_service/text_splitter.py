@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+保留字符偏移的文本分块器
+替代 LangChain RecursiveCharacterTextSplitter：
+- 返回 (start, end, text) 三元组，text == 原文[start:end]，后续位置分配无需再做子串匹配
+- 按 DOCUMENT_CONFIG["splitter_config"] 的分隔符优先级选择切分点，按文档类型取 dynamic_overlap 重叠比例
+- 单次线性扫描：每个chunk只在窗口内做有限次 rfind/find
+"""
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from config import DOCUMENT_CONFIG
+
+Split = Tuple[int, int, str]
+
+
+class Document:
+    """轻量文档对象（page_content + metadata），接口与 langchain Document 一致"""
+
+    def __init__(self, page_content: str, metadata: Optional[Dict[str, Any]] = None):
+        self.page_content = page_content
+        self.metadata = metadata if metadata is not None else {}
+
+    def __repr__(self) -> str:
+        return f"Document(page_content={self.page_content[:30]!r}..., metadata_keys={list(self.metadata.keys())})"
+
+
+class OffsetTextSplitter:
+    """按分隔符优先级切分文本，并保留每个chunk在原文中的字符区间"""
+
+    def __init__(self,
+                 chunk_size: int = 1000,
+                 chunk_overlap: int = 200,
+                 separators: Optional[Sequence[str]] = None,
+                 keep_separator: bool = True,
+                 strip_whitespace: bool = True):
+        if chunk_overlap >= chunk_size:
+            raise ValueError(f"chunk_overlap({chunk_overlap}) 必须小于 chunk_size({chunk_size})")
+        self.chunk_size = int(chunk_size)
+        self.chunk_overlap = max(0, int(chunk_overlap))
+        self.separators = [s for s in (separators or ["\n\n", "\n", " "]) if s]
+        self.keep_separator = keep_separator
+        self.strip_whitespace = strip_whitespace
+
+    def split_text(self, text: str) -> List[str]:
+        return [t for _, _, t in self.split_with_offsets(text)]
+
+    def split_with_offsets(self, text: str) -> List[Split]:
+        """返回 [(start, end, chunk_text)]，按起点升序"""
+        n = len(text)
+        splits: List[Split] = []
+        pos = 0
+        while pos < n:
+            if self.strip_whitespace:
+                while pos < n and text[pos].isspace():
+                    pos += 1
+                if pos >= n:
+                    break
+
+            limit = pos + self.chunk_size
+            end = n if limit >= n else self._find_break(text, pos, limit)
+
+            s, e = pos, end
+            if self.strip_whitespace:
+                while e > s and text[e - 1].isspace():
+                    e -= 1
+            if e > s:
+                splits.append((s, e, text[s:e]))
+
+            if end >= n:
+                break
+            next_pos = max(end - self.chunk_overlap, pos + 1)
+            if self.chunk_overlap and next_pos < end:
+                next_pos = self._align_start(text, next_pos, end)
+            pos = next_pos
+        return splits
+
+    def _find_break(self, text: str, start: int, limit: int) -> int:
+        """在窗口后半段按分隔符优先级寻找切分点，找不到时在窗口末尾硬切"""
+        lo = start + self.chunk_size // 2
+        for sep in self.separators:
+            idx = text.rfind(sep, lo, limit)
+            if idx >= 0:
+                cut = idx + len(sep) if self.keep_separator else idx
+                if cut > start:
+                    return cut
+        return limit
+
+    def _align_start(self, text: str, start: int, end: int) -> int:
+        """
+        将重叠起点对齐到分隔符之后：优先在重叠区前半段寻找高优先级分隔符，
+        保证实际重叠不少于配置值的一半；都找不到时保持原起点
+        """
+        half = start + max(1, (end - start) // 2)
+        earliest = None
+        for sep in self.separators:
+            idx = text.find(sep, start, end)
+            if idx < 0:
+                continue
+            cand = idx + len(sep)
+            if cand >= end:
+                continue
+            if cand <= half:
+                return cand
+            if earliest is None or cand < earliest:
+                earliest = cand
+        return earliest if earliest is not None else start
+
+
+def make_text_splitter(doc_type: str = "default", chunk_size: Optional[int] = None) -> OffsetTextSplitter:
+    """按文档类型创建分块器：分隔符取 splitter_config，重叠比例取 dynamic_overlap"""
+    splitter_config = DOCUMENT_CONFIG.get("splitter_config", {})
+    overlap_config = DOCUMENT_CONFIG.get("dynamic_overlap", {})
+    size = int(chunk_size or splitter_config.get("chunk_size", 1000))
+    ratio = overlap_config.get(doc_type, overlap_config.get("default", 0.2))
+    return OffsetTextSplitter(
+        chunk_size=size,
+        chunk_overlap=int(size * ratio),
+        separators=splitter_config.get("separators"),
+        keep_separator=splitter_config.get("keep_separator", True),
+    )
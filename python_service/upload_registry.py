@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+上传文件去重登记表
+sha256 → (knowledge_id, source_file, chunk ID 列表, 转换后PDF路径)，持久化到本地sqlite，
+内容完全相同的文件再次上传时可直接复用已入库的chunks，并累计去重命中次数。
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from config import DEDUP_CONFIG
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class UploadRegistry:
+    """文件哈希登记表"""
+
+    def __init__(self, db_path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS upload_registry (
+                sha256 TEXT PRIMARY KEY,
+                knowledge_id INTEGER,
+                source_file TEXT NOT NULL,
+                chunk_ids TEXT NOT NULL,
+                converted_pdf TEXT,
+                file_size INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS dedup_stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.commit()
+
+    def lookup(self, sha256: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM upload_registry WHERE sha256 = ?", (sha256,)).fetchone()
+        if not row:
+            return None
+        entry = dict(row)
+        entry["chunk_ids"] = json.loads(entry["chunk_ids"] or "[]")
+        return entry
+
+    def register(self, sha256: str, knowledge_id: Optional[int], source_file: str, chunk_ids: List[str],
+                 converted_pdf: Optional[str] = None, file_size: int = 0):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO upload_registry (sha256, knowledge_id, source_file, chunk_ids, converted_pdf, file_size, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(sha256) DO UPDATE SET
+                    knowledge_id = excluded.knowledge_id,
+                    source_file = excluded.source_file,
+                    chunk_ids = excluded.chunk_ids,
+                    converted_pdf = excluded.converted_pdf,
+                    file_size = excluded.file_size,
+                    updated_at = excluded.updated_at
+                """,
+                (sha256, knowledge_id, source_file, json.dumps(chunk_ids), converted_pdf, int(file_size), now, now),
+            )
+            self._conn.commit()
+
+    def forget(self, sha256: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM upload_registry WHERE sha256 = ?", (sha256,))
+            self._conn.commit()
+
+    def record_hit(self, mode: str, file_size: int, chunk_count: int):
+        """累计去重命中：次数、节省的上传字节数与复用的chunk数"""
+        increments = {"hits": 1, f"hits_{mode}": 1, "bytes_saved": int(file_size), "chunks_reused": int(chunk_count)}
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO dedup_stats (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                list(increments.items()),
+            )
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = {r["name"]: r["value"] for r in self._conn.execute("SELECT name, value FROM dedup_stats")}
+            files = self._conn.execute("SELECT COUNT(*) FROM upload_registry").fetchone()[0]
+        return {"registered_files": files, **counters}
+
+
+# 全局登记表实例
+upload_registry = None
+
+def init_upload_registry() -> Optional[UploadRegistry]:
+    """初始化上传去重登记表（配置关闭时返回None）"""
+    global upload_registry
+    if not DEDUP_CONFIG.get("enabled", True):
+        logger.info("上传去重已关闭")
+        return None
+    upload_registry = UploadRegistry(DEDUP_CONFIG["db_path"])
+    logger.info(f"上传去重登记表初始化成功: {DEDUP_CONFIG['db_path']}")
+    return upload_registry
+
+def get_upload_registry() -> Optional[UploadRegistry]:
+    """获取上传去重登记表实例（未启用时为None）"""
+    global upload_registry
+    if upload_registry is None and DEDUP_CONFIG.get("enabled", True):
+        upload_registry = init_upload_registry()
+    return upload_registry
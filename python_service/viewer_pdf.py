@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+回显PDF延迟生成
+- DOCX/PPTX/XLSX 原生解析的切分文本不依赖PDF，入库后再生成回显PDF，不占用入库耗时
+- 待生成任务持久化到sqlite，源文件按sha256保留副本（上传的临时文件在处理后即删除）
+- background：提交到后台线程生成；on_demand：首次请求下载接口时生成；同一文件的并发请求只生成一次
+- 生成经转换PDF内容寻址缓存，完成后回调 on_ready(task, meta)（如回填chunk坐标）
+"""
+
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from config import VIEWER_PDF_CONFIG, CONVERTED_PDF_CONFIG
+from converted_pdf_store import get_converted_pdf_store, convert_with_cache, hash_file, viewer_pdf_path, find_viewer_pdf
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 任务状态
+VIEWER_PENDING = "pending"
+VIEWER_READY = "ready"
+VIEWER_FAILED = "failed"
+
+# renderer(src_path, out_path) -> meta：生成PDF到 out_path，返回值作为元数据随产物缓存
+Renderer = Callable[[str, str], Optional[Dict[str, Any]]]
+
+
+def _named_path(knowledge_id: Any, filename: str) -> str:
+    """回显PDF路径：<root>/<knowledge_id>/<filename>.pdf"""
+    store = get_converted_pdf_store()
+    if store is not None:
+        return store.named_path(knowledge_id, filename)
+    return viewer_pdf_path(CONVERTED_PDF_CONFIG["root"], knowledge_id, filename)
+
+
+class ViewerPdfTaskStore:
+    """基于sqlite的回显PDF任务存储，(knowledge_id, filename) 唯一"""
+
+    def __init__(self, db_path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS viewer_pdf_tasks (
+                knowledge_id TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                source_path TEXT NOT NULL,
+                source_sha256 TEXT NOT NULL,
+                converter TEXT NOT NULL,
+                status TEXT NOT NULL,
+                background INTEGER NOT NULL DEFAULT 1,
+                payload TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (knowledge_id, filename)
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_viewer_pdf_tasks_status ON viewer_pdf_tasks(status)")
+        self._conn.commit()
+
+    def upsert(self, knowledge_id: Any, filename: str, source_path: str, source_sha256: str,
+               converter: str, payload: Optional[Dict[str, Any]] = None, background: bool = True):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO viewer_pdf_tasks "
+                "(knowledge_id, filename, source_path, source_sha256, converter, status, background, payload, error, "
+                "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, NULL, ?, ?)",
+                (str(knowledge_id), filename, source_path, source_sha256, converter, VIEWER_PENDING, int(background),
+                 json.dumps(payload, ensure_ascii=False) if payload else None, now, now),
+            )
+            self._conn.commit()
+
+    def get(self, knowledge_id: Any, filename: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM viewer_pdf_tasks WHERE knowledge_id = ? AND filename = ?",
+                (str(knowledge_id), filename),
+            ).fetchone()
+        return self._to_dict(row) if row else None
+
+    def update(self, knowledge_id: Any, filename: str, **fields):
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{k} = ?" for k in fields)
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE viewer_pdf_tasks SET {assignments} WHERE knowledge_id = ? AND filename = ?",
+                (*fields.values(), str(knowledge_id), filename),
+            )
+            self._conn.commit()
+
+    def list_pending(self, background_only: bool = False) -> List[Dict[str, Any]]:
+        sql = "SELECT * FROM viewer_pdf_tasks WHERE status = ?" + (" AND background = 1" if background_only else "")
+        with self._lock:
+            rows = self._conn.execute(sql + " ORDER BY created_at ASC", (VIEWER_PENDING,)).fetchall()
+        return [self._to_dict(r) for r in rows]
+
+    def source_in_use(self, source_path: str) -> bool:
+        """源文件副本是否仍被未完成的任务引用"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM viewer_pdf_tasks WHERE source_path = ? AND status != ? LIMIT 1",
+                (source_path, VIEWER_READY),
+            ).fetchone()
+        return row is not None
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) AS n FROM viewer_pdf_tasks GROUP BY status").fetchall()
+        return {r["status"]: r["n"] for r in rows}
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        task = dict(row)
+        task["payload"] = json.loads(task["payload"]) if task.get("payload") else {}
+        task["background"] = bool(task.get("background"))
+        return task
+
+
+class ViewerPdfService:
+    """
+    回显PDF延迟生成服务
+
+    renderers: {converter: renderer}，converter 同时作为转换PDF缓存的key
+    on_ready(task, meta)：PDF生成（或缓存命中）后调用，异常只记录日志
+    """
+
+    def __init__(self,
+                 task_store: ViewerPdfTaskStore,
+                 renderers: Dict[str, Renderer],
+                 on_ready: Optional[Callable[[Dict[str, Any], Optional[Dict[str, Any]]], None]] = None,
+                 sources_dir: str = "",
+                 mode: str = "background",
+                 workers: int = 1,
+                 wait_timeout: float = 300):
+        self.task_store = task_store
+        self.renderers = renderers
+        self.on_ready = on_ready
+        self.sources_dir = sources_dir
+        self.mode = mode
+        self.wait_timeout = wait_timeout
+        os.makedirs(sources_dir, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix="viewer-pdf") \
+            if mode == "background" else None
+        self._lock = threading.Lock()
+        self._inflight: Dict[tuple, threading.Event] = {}
+        self._stats = {"scheduled": 0, "generated": 0, "cache_hits": 0, "on_demand": 0, "failed": 0}
+
+    def schedule(self, knowledge_id: Any, filename: str, src_path: str, converter: str,
+                 payload: Optional[Dict[str, Any]] = None,
+                 source_sha256: Optional[str] = None,
+                 background: bool = True) -> Optional[str]:
+        """
+        登记待生成的回显PDF：保留源文件副本，background 模式下立即提交后台生成
+        （background=False 的任务只在首次请求时生成）
+        回显PDF已是同一内容的产物时不再登记，返回其路径；其余返回None
+        """
+        if converter not in self.renderers:
+            raise ValueError(f"未注册的回显PDF转换器: {converter}")
+        store = get_converted_pdf_store()
+        sha = source_sha256 or hash_file(src_path)
+        if store is not None:
+            cas_key = store.make_key(sha, converter)
+            named = store.named_path(knowledge_id, filename)
+            if store.resolve(knowledge_id, filename) == cas_key and os.path.exists(named):
+                return named
+
+        source_path = self._keep_source(src_path, sha)
+        self.task_store.upsert(knowledge_id, filename, source_path, sha, converter, payload, background)
+        with self._lock:
+            self._stats["scheduled"] += 1
+
+        # 已有缓存产物时只需物化链接与回调，直接完成
+        if store is not None and store.lookup(sha, converter):
+            return self._generate(knowledge_id, filename)
+        if background and self._executor is not None:
+            self._executor.submit(self._generate_quietly, knowledge_id, filename)
+        return None
+
+    def relink(self, src_knowledge_id: Any, src_filename: str, knowledge_id: Any, filename: str,
+               id_map: Optional[Dict[str, str]] = None) -> bool:
+        """
+        上传去重复用时，将尚未生成的任务复制到新的 (knowledge_id, filename)
+        id_map 为 {原chunk ID: 新chunk ID}，待回填位置的chunk改为复制出的新chunk
+        """
+        task = self.task_store.get(src_knowledge_id, src_filename)
+        if not task or task["status"] == VIEWER_READY or not os.path.exists(task["source_path"]):
+            return False
+        payload = task["payload"]
+        if payload and id_map and payload.get("chunks"):
+            payload = {**payload, "chunks": [[id_map.get(ref[0], ref[0])] + list(ref[1:]) for ref in payload["chunks"]]}
+        self.task_store.upsert(knowledge_id, filename, task["source_path"], task["source_sha256"],
+                               task["converter"], payload, task["background"])
+        if task["background"] and self._executor is not None:
+            self._executor.submit(self._generate_quietly, knowledge_id, filename)
+        return True
+
+    def ensure(self, knowledge_id: Any, filename: str) -> Optional[str]:
+        """
+        返回可用的回显PDF路径，尚未生成时同步生成（同一文件的并发请求等待同一次生成）
+        未登记且不存在时返回None
+        """
+        task = self.task_store.get(knowledge_id, filename)
+        if task is None or task["status"] == VIEWER_READY:
+            # 改动前生成的回显PDF仍按 <stem>.pdf 查找
+            return find_viewer_pdf(CONVERTED_PDF_CONFIG["root"], knowledge_id, filename)
+        with self._lock:
+            self._stats["on_demand"] += 1
+        return self._generate(knowledge_id, filename)
+
+    def _generate_quietly(self, knowledge_id: Any, filename: str):
+        try:
+            self._generate(knowledge_id, filename)
+        except Exception:
+            # 错误已记录到任务，留待下次请求时重试
+            pass
+
+    def _generate(self, knowledge_id: Any, filename: str) -> Optional[str]:
+        key = (str(knowledge_id), filename)
+        with self._lock:
+            event = self._inflight.get(key)
+            owner = event is None
+            if owner:
+                event = self._inflight[key] = threading.Event()
+        if not owner:
+            event.wait(self.wait_timeout)
+            task = self.task_store.get(knowledge_id, filename)
+            named = _named_path(knowledge_id, filename)
+            return named if task and task["status"] == VIEWER_READY and os.path.exists(named) else None
+
+        try:
+            task = self.task_store.get(knowledge_id, filename)
+            if task is None:
+                return None
+            if task["status"] == VIEWER_READY:
+                return _named_path(knowledge_id, filename)
+            return self._run(task)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    def _run(self, task: Dict[str, Any]) -> str:
+        knowledge_id, filename = task["knowledge_id"], task["filename"]
+        renderer = self.renderers[task["converter"]]
+        store = get_converted_pdf_store()
+        cached = store is not None and store.lookup(task["source_sha256"], task["converter"]) is not None
+        started = time.time()
+        try:
+            pdf_path, meta = convert_with_cache(
+                store,
+                task["source_path"],
+                knowledge_id,
+                filename,
+                task["converter"],
+                lambda out_path: renderer(task["source_path"], out_path),
+                source_sha256=task["source_sha256"],
+            )
+        except Exception as e:
+            logger.error(f"回显PDF生成失败 {filename}（知识ID {knowledge_id}）: {e}")
+            self.task_store.update(knowledge_id, filename, status=VIEWER_FAILED, error=str(e))
+            with self._lock:
+                self._stats["failed"] += 1
+            raise
+
+        if self.on_ready is not None:
+            try:
+                self.on_ready(task, meta)
+            except Exception as e:
+                logger.warning(f"回显PDF生成后回调失败 {filename}: {e}")
+        self.task_store.update(knowledge_id, filename, status=VIEWER_READY, error=None)
+        with self._lock:
+            self._stats["cache_hits" if cached else "generated"] += 1
+        self._release_source(task["source_path"])
+        logger.info(f"回显PDF已生成: {pdf_path}，耗时 {time.time() - started:.2f}s")
+        return pdf_path
+
+    def _keep_source(self, src_path: str, sha: str) -> str:
+        """按sha256保留源文件副本（同内容只存一份）"""
+        target = os.path.join(self.sources_dir, sha + Path(src_path).suffix.lower())
+        if os.path.abspath(src_path) == os.path.abspath(target) or os.path.exists(target):
+            return target
+        tmp = target + ".tmp"
+        try:
+            os.link(src_path, tmp)
+        except OSError:
+            shutil.copyfile(src_path, tmp)
+        os.replace(tmp, target)
+        return target
+
+    def _release_source(self, source_path: str):
+        if not self.task_store.source_in_use(source_path):
+            try:
+                os.remove(source_path)
+            except OSError:
+                pass
+
+    def resume(self) -> int:
+        """background 模式下重新提交上次未完成的任务"""
+        if self._executor is None:
+            return 0
+        pending = self.task_store.list_pending(background_only=True)
+        for task in pending:
+            self._executor.submit(self._generate_quietly, task["knowledge_id"], task["filename"])
+        if pending:
+            logger.info(f"恢复 {len(pending)} 个待生成的回显PDF")
+        return len(pending)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["mode"] = self.mode
+        stats["tasks"] = self.task_store.counts()
+        return stats
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# 全局服务实例
+viewer_pdf_service = None
+
+def init_viewer_pdf_service(renderers: Dict[str, Renderer],
+                            on_ready: Optional[Callable[[Dict[str, Any], Optional[Dict[str, Any]]], None]] = None
+                            ) -> Optional[ViewerPdfService]:
+    """初始化回显PDF服务并恢复未完成的任务（配置关闭或 eager 模式时返回None）"""
+    global viewer_pdf_service
+    if not VIEWER_PDF_CONFIG.get("enabled", True) or VIEWER_PDF_CONFIG.get("mode") == "eager":
+        logger.info("回显PDF延迟生成未启用，解析时同步生成")
+        return None
+    viewer_pdf_service = ViewerPdfService(
+        ViewerPdfTaskStore(VIEWER_PDF_CONFIG["db_path"]),
+        renderers,
+        on_ready=on_ready,
+        sources_dir=VIEWER_PDF_CONFIG["sources_dir"],
+        mode=VIEWER_PDF_CONFIG.get("mode", "background"),
+        workers=VIEWER_PDF_CONFIG.get("workers", 1),
+        wait_timeout=VIEWER_PDF_CONFIG.get("wait_timeout", 300),
+    )
+    viewer_pdf_service.resume()
+    return viewer_pdf_service
+
+def get_viewer_pdf_service() -> Optional[ViewerPdfService]:
+    """获取回显PDF服务实例（未启用时为None）"""
+    return viewer_pdf_service
+
+def shutdown_viewer_pdf_service():
+    """停止后台生成线程（未完成的任务保留，下次启动时恢复）"""
+    global viewer_pdf_service
+    if viewer_pdf_service is not None:
+        viewer_pdf_service.shutdown()
+        viewer_pdf_service = None
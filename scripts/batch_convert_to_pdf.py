@@ -6,26 +6,31 @@
 - 默认扫描: python_service/file
 - 默认knowledge_id: 29
 - 依赖: 已安装LibreOffice(soffice)，以及 PyMuPDF
+- Office文件交给常驻 soffice 进程池并发转换（--workers 指定进程数），不再逐个冷启动soffice
 
 用法（PowerShell，逐条执行）：
   python scripts/batch_convert_to_pdf.py
   # 或者自定义参数：
   python scripts/batch_convert_to_pdf.py --input-dir python_service/file --knowledge-id 29 --out-root python_service/static/converted --soffice "C:\\Program Files\\LibreOffice\\program\\soffice.exe"
+  python scripts/batch_convert_to_pdf.py --workers 4 --timeout 300
 """
 
 import argparse
 import os
 import sys
-import subprocess
 import tempfile
 from pathlib import Path
 
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'python_service'))
+
 try:
     import fitz  # PyMuPDF
 except Exception:
     print("缺少依赖: PyMuPDF，请先安装: pip install pymupdf")
     sys.exit(1)
 
+from libreoffice_pool import LibreOfficePool  # noqa: E402
+
 COMMON_SOFFICE_CANDIDATES = [
     r"C:\\Program Files\\LibreOffice\\program\\soffice.exe",
     r"C:\\Program Files (x86)\\LibreOffice\\program\\soffice.exe",
@@ -48,31 +53,6 @@ def find_soffice(explicit: str | None) -> str:
     raise FileNotFoundError("未找到soffice，请安装LibreOffice或通过 --soffice 指定路径。可用 winget 安装: winget install TheDocumentFoundation.LibreOffice")
 
 
-def convert_with_libreoffice(src_path: str, soffice_path: str, out_dir: str, timeout_sec: int = 300) -> str:
-    os.makedirs(out_dir, exist_ok=True)
-    cmd = [
-        soffice_path,
-        "--headless",
-        "--norestore",
-        "--nolockcheck",
-        "--convert-to", "pdf",
-        "--outdir", out_dir,
-        os.path.abspath(src_path),
-    ]
-    cp = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout_sec)
-    if cp.returncode != 0:
-        raise RuntimeError(f"LibreOffice 转换失败: rc={cp.returncode}\nstdout={cp.stdout}\nstderr={cp.stderr}")
-    expected = os.path.join(out_dir, Path(src_path).with_suffix('.pdf').name)
-    if os.path.exists(expected):
-        return expected
-    # 兜底找最新pdf
-    pdfs = [p for p in os.listdir(out_dir) if p.lower().endswith('.pdf')]
-    if not pdfs:
-        raise RuntimeError(f"未找到输出PDF。stdout={cp.stdout}\nstderr={cp.stderr}")
-    pdfs.sort(key=lambda n: os.path.getmtime(os.path.join(out_dir, n)), reverse=True)
-    return os.path.join(out_dir, pdfs[0])
-
-
 def simple_txt_to_pdf(src_path: str, out_path: str) -> str:
     with open(src_path, 'r', encoding='utf-8', errors='ignore') as f:
         text = f.read()
@@ -100,6 +80,8 @@ def main():
     ap.add_argument('--knowledge-id', type=int, default=29)
     ap.add_argument('--out-root', default='python_service/static/converted', help='输出根目录')
     ap.add_argument('--soffice', default=None, help='LibreOffice soffice.exe 路径，留空自动探测')
+    ap.add_argument('--workers', type=int, default=2, help='常驻 soffice 进程数')
+    ap.add_argument('--timeout', type=int, default=300, help='单个文件转换超时（秒）')
     args = ap.parse_args()
 
     input_dir = args.input_dir
@@ -119,9 +101,22 @@ def main():
 
     support_exts = {'.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', '.txt'}
 
+    pool = None
+    if soffice:
+        pool = LibreOfficePool(
+            soffice,
+            workers=args.workers,
+            queue_size=max(32, args.workers * 4),
+            queue_wait=None,
+            job_timeout=args.timeout,
+            profile_root=tempfile.mkdtemp(prefix='lo_batch_profiles_'),
+        )
+        pool.start()
+
     print(f"开始转换: {input_dir} → {out_dir}")
     converted = []
     failed = []
+    pending = []
 
     for name in os.listdir(input_dir):
         src = os.path.join(input_dir, name)
@@ -137,11 +132,21 @@ def main():
             if ext == '.txt':
                 target = os.path.join(out_dir, Path(name).with_suffix('.pdf').name)
                 pdf_path = simple_txt_to_pdf(src, target)
+                pages = validate_pages(pdf_path)
+                converted.append((name, pdf_path, pages))
+                print(f"✅ {name} → {pdf_path}  页数: {pages}")
             else:
-                if not soffice:
+                if not pool:
                     raise RuntimeError("未检测到LibreOffice，无法转换此类型。")
-                pdf_path = convert_with_libreoffice(src, soffice, out_dir)
+                # 先全部提交，由进程池并发转换；队列满时在此等待
+                pending.append((name, pool.submit(src, out_dir)))
+        except Exception as e:
+            failed.append((name, str(e)))
+            print(f"❌ {name} 转换失败: {e}")
 
+    for name, future in pending:
+        try:
+            pdf_path = future.result()
             pages = validate_pages(pdf_path)
             converted.append((name, pdf_path, pages))
             print(f"✅ {name} → {pdf_path}  页数: {pages}")
@@ -149,6 +154,11 @@ def main():
             failed.append((name, str(e)))
             print(f"❌ {name} 转换失败: {e}")
 
+    if pool:
+        stats = pool.stats()
+        pool.shutdown()
+        print(f"进程池: worker {stats['workers']} 个，UNO={'是' if stats['uno'] else '否'}，超时 {stats['timeouts']} 个，重启 {stats['restarts']} 次")
+
     print("\n转换完成：")
     print(f"成功: {len(converted)} 个，失败: {len(failed)} 个")
     if converted:
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PDF提取配置档基准：各配置档（以及改动前默认的 get_text("dict")）的提取吞吐与内存
+- 吞吐：页/秒（多轮取最好成绩）
+- 峰值RSS：每个配置档在独立子进程中运行，报告子进程峰值RSS及相对导入后的增量
+- 输出规模：文本块、span、图片块数量
+
+用法：
+  python scripts/bench_pdf_extract_profiles.py                                  # 使用 python_service/file 下的样例PDF
+  python scripts/bench_pdf_extract_profiles.py --input a.pdf b.pdf --repeat 5
+  python scripts/bench_pdf_extract_profiles.py --profiles text fonts
+"""
+
+import argparse
+import glob
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+SERVICE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python_service')
+sys.path.insert(0, SERVICE_DIR)
+
+# 改动前的提取方式：默认标志位（含图片）+ 字体字段
+LEGACY_PROFILE = "legacy"
+
+
+def peak_rss_mb():
+    """当前进程峰值RSS（MB）；无法获取时返回None"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 单位为KB，macOS 为字节
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / (1024 * 1024)
+    except ImportError:
+        return None
+
+
+def run_profile(args):
+    """子进程：用指定配置档提取全部PDF，返回耗时与输出规模"""
+    profile_name, pdf_paths, repeat = args
+    sys.path.insert(0, SERVICE_DIR)
+    import fitz
+    from pdf_extraction import extract_blocks_serial, get_extract_profile
+
+    def legacy_extract(doc):
+        blocks = spans = 0
+        for page in doc:
+            for block in page.get_text("dict")["blocks"]:
+                if "lines" in block:
+                    blocks += 1
+                    spans += sum(1 for line in block["lines"] for span in line["spans"] if span["text"].strip())
+        return blocks, spans, 0
+
+    profile = None if profile_name == LEGACY_PROFILE else get_extract_profile(profile_name)
+
+    def profile_extract(doc):
+        documents = extract_blocks_serial(doc, profile=profile)
+        images = sum(1 for d in documents if d.get("block_type") == "image")
+        spans = sum(len(d["positions"]) for d in documents)
+        return len(documents) - images, spans, images
+
+    extract = legacy_extract if profile is None else profile_extract
+    base_rss = peak_rss_mb()
+    pages = 0
+    best = 0.0
+    counts = (0, 0, 0)
+    for path in pdf_paths:
+        doc = fitz.open(path)
+        pages += len(doc)
+        file_best = float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            counts_one = extract(doc)
+            file_best = min(file_best, time.perf_counter() - t0)
+        best += file_best
+        counts = tuple(a + b for a, b in zip(counts, counts_one))
+        doc.close()
+    return {
+        "profile": profile_name,
+        "pages": pages,
+        "seconds": best,
+        "blocks": counts[0],
+        "spans": counts[1],
+        "images": counts[2],
+        "base_rss": base_rss,
+        "peak_rss": peak_rss_mb(),
+    }
+
+
+def main():
+    from config import PDF_EXTRACT_PROFILES
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--input", nargs="*", default=None, help="PDF文件，留空使用 python_service/file 下的PDF")
+    ap.add_argument("--profiles", nargs="*", default=None, help="要测试的配置档，默认全部并附带改动前的提取方式")
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    pdf_paths = args.input or sorted(glob.glob(os.path.join(SERVICE_DIR, "file", "*.pdf")))
+    if not pdf_paths:
+        print("❌ 未找到PDF样例，请用 --input 指定")
+        sys.exit(2)
+    profiles = args.profiles or [LEGACY_PROFILE] + list(PDF_EXTRACT_PROFILES)
+    print(f"样例: {', '.join(os.path.basename(p) for p in pdf_paths)}，每个文件取 {args.repeat} 轮最好成绩")
+
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    for name in profiles:
+        # 每个配置档独立进程，峰值RSS互不影响
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+            results.append(pool.submit(run_profile, (name, pdf_paths, args.repeat)).result())
+
+    def fmt_mb(v):
+        return f"{v:.1f}" if v is not None else "n/a"
+
+    print(f"{'配置档':<8} {'页/秒':>10} {'耗时ms':>10} {'文本块':>8} {'span':>8} {'图片块':>6} {'峰值RSS MB':>11} {'增量MB':>8}")
+    for r in results:
+        delta = r["peak_rss"] - r["base_rss"] if r["peak_rss"] is not None and r["base_rss"] is not None else None
+        pps = r["pages"] / r["seconds"] if r["seconds"] > 0 else float("inf")
+        print(f"{r['profile']:<10} {pps:>10.1f} {r['seconds'] * 1000:>10.1f} {r['blocks']:>8} {r['spans']:>8} "
+              f"{r['images']:>6} {fmt_mb(r['peak_rss']):>11} {fmt_mb(delta):>8}")
+
+
+if __name__ == "__main__":
+    main()
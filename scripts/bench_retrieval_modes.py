@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+RAG检索方式基准：script_score（精确余弦）与 knn（HNSW近似）的延迟与召回对比
+- 查询向量：在与检索相同的过滤条件内随机抽取含embedding的文档向量，可叠加高斯噪声模拟真实问题（不调用embedding接口）
+- 召回：以 script_score 的 TopK 为标准答案，计算 knn 在不同 num_candidates 下的 recall@K
+- 延迟：客户端往返耗时 p50/p95 与ES返回的 took
+
+用法：
+  python scripts/bench_retrieval_modes.py
+  python scripts/bench_retrieval_modes.py --queries 100 --k 5 --num-candidates 50 100 200 500 --noise 0.02
+  python scripts/bench_retrieval_modes.py --source-file 安联美元.pdf
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+SERVICE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python_service')
+sys.path.insert(0, SERVICE_DIR)
+
+from elasticsearch import Elasticsearch  # noqa: E402
+
+from chat_stream import percentile  # noqa: E402
+from config import ES_CONFIG, RETRIEVAL_CONFIG  # noqa: E402
+from retrieval import build_knn_query, build_script_score_query  # noqa: E402
+
+
+def build_es_client() -> Elasticsearch:
+    return Elasticsearch(
+        [f"http://{ES_CONFIG['host']}:{ES_CONFIG['port']}"],
+        basic_auth=(ES_CONFIG["username"], ES_CONFIG["password"]) if ES_CONFIG.get("username") else None,
+        verify_certs=ES_CONFIG.get("verify_certs", False),
+        request_timeout=60,
+    )
+
+
+def sample_query_vectors(es, index: str, n: int, noise: float, seed: int, filters: list):
+    """在过滤条件内随机抽取n个文档向量作为查询，noise>0 时逐维叠加高斯噪声"""
+    field = RETRIEVAL_CONFIG.get("vector_field", "embedding")
+    res = es.search(index=index, body={
+        "size": n,
+        "query": {"function_score": {
+            "query": {"bool": {"filter": [{"exists": {"field": field}}] + filters}},
+            "random_score": {"seed": seed, "field": "_seq_no"},
+        }},
+        "_source": [field],
+    })
+    rng = random.Random(seed)
+    vectors = []
+    for hit in res.get("hits", {}).get("hits", []):
+        vec = hit["_source"].get(field)
+        if vec:
+            vectors.append([v + rng.gauss(0.0, noise) for v in vec] if noise > 0 else vec)
+    return vectors
+
+
+def timed_search(es, index: str, body: dict):
+    t0 = time.perf_counter()
+    res = es.search(index=index, body=body)
+    elapsed = (time.perf_counter() - t0) * 1000
+    ids = [hit["_id"] for hit in res.get("hits", {}).get("hits", [])]
+    return ids, elapsed, res.get("took", 0)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--index", default=ES_CONFIG["index"])
+    ap.add_argument("--queries", type=int, default=50, help="查询数")
+    ap.add_argument("--k", type=int, default=5, help="返回条数（与 /api/rag/chat 一致为5）")
+    ap.add_argument("--num-candidates", type=int, nargs="*", default=[50, 100, 200, 500])
+    ap.add_argument("--noise", type=float, default=0.01, help="查询向量逐维高斯噪声标准差")
+    ap.add_argument("--source-file", default=None, help="按文件名过滤（验证kNN内部过滤）")
+    ap.add_argument("--warmup", type=int, default=3)
+    ap.add_argument("--seed", type=int, default=42)
+    args = ap.parse_args()
+
+    es = build_es_client()
+    filters = [{"term": {"chunk_type": "content"}}]
+    if args.source_file:
+        filters.append({"term": {"source_file": args.source_file}})
+
+    total = es.count(index=args.index, query={"bool": {"filter": filters}}).get("count", 0)
+    vectors = sample_query_vectors(es, args.index, args.queries, args.noise, args.seed, filters)
+    if not vectors:
+        print("❌ 过滤后没有含embedding的文档")
+        sys.exit(2)
+    print(f"索引: {args.index}，过滤后文档数: {total}，查询数: {len(vectors)}，K={args.k}，噪声={args.noise}")
+
+    source = ["source_file"]
+    modes = [("script_score", None)] + [("knn", nc) for nc in args.num_candidates]
+
+    def body_for(mode, nc, vec):
+        if mode == "script_score":
+            return build_script_score_query(vec, args.k, filters, source)
+        return build_knn_query(vec, args.k, filters, nc, source)
+
+    # 预热（加载向量/HNSW图到页缓存）
+    for mode, nc in modes:
+        for vec in vectors[:args.warmup]:
+            timed_search(es, args.index, body_for(mode, nc, vec))
+
+    exact = []
+    stats = {}
+    for mode, nc in modes:
+        latencies, tooks, recalls = [], [], []
+        for qi, vec in enumerate(vectors):
+            try:
+                ids, elapsed, took = timed_search(es, args.index, body_for(mode, nc, vec))
+            except Exception as e:
+                print(f"❌ {mode} 查询失败（knn 需要 embedding 字段已建向量索引，见 setup_es_knowledge_chunks.py --migrate-knn）: {e}")
+                sys.exit(1)
+            latencies.append(elapsed)
+            tooks.append(took)
+            if mode == "script_score":
+                exact.append(set(ids))
+            elif exact[qi]:
+                recalls.append(len(exact[qi] & set(ids)) / len(exact[qi]))
+        stats[(mode, nc)] = (latencies, tooks, recalls)
+
+    print(f"{'检索方式':<18} {'p50 ms':>9} {'p95 ms':>9} {'均值 ms':>9} {'ES took':>9} {'recall@K':>9}")
+    for mode, nc in modes:
+        latencies, tooks, recalls = stats[(mode, nc)]
+        name = mode if nc is None else f"knn nc={nc}"
+        recall = f"{statistics.mean(recalls):.3f}" if recalls else ("1.000" if mode == "script_score" else "n/a")
+        print(f"{name:<20} {percentile(latencies, 50):>9.1f} {percentile(latencies, 95):>9.1f} "
+              f"{statistics.mean(latencies):>9.1f} {statistics.mean(tooks):>9.1f} {recall:>9}")
+
+
+if __name__ == "__main__":
+    main()
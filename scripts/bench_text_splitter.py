@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分块器基准：项目内 OffsetTextSplitter vs LangChain RecursiveCharacterTextSplitter
+- 吞吐：MB/s（多轮取最好成绩）
+- 输出对比：chunk数量、平均/最大长度、chunk能否在原文中定位、两者切分点重合比例
+
+用法：
+  python scripts/bench_text_splitter.py                       # 使用内置的中英混合样本
+  python scripts/bench_text_splitter.py --input some.txt      # 指定文本文件
+  python scripts/bench_text_splitter.py --doc-type pdf --repeat 5
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'python_service'))
+
+from text_splitter import make_text_splitter  # noqa: E402
+from chunk_positions import locate_chunk_ranges  # noqa: E402
+
+try:
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    LANGCHAIN_AVAILABLE = True
+except Exception:
+    LANGCHAIN_AVAILABLE = False
+
+
+SAMPLE_PARAGRAPHS = [
+    "安联美元高收益基金的投资目标是透过主要投资于美国债券市场的高收益评级企业债券，以达致长期资本增值及收益。",
+    "基金总值：4.4377亿美元；资产净值：5.7741美元；成立日期：2010年8月2日；管理费：每年1.19%。",
+    "The fund seeks long-term capital growth and income by investing primarily in high yield rated corporate bonds of the US bond markets.",
+    "投资涉及风险，过往业绩并不代表将来的表现。投资者在作出任何投资决定前，应详细阅读销售文件，包括风险因素。",
+    "Fund managers: Justin Kass, David Oberto, Michael Yee. Distribution: monthly. Financial year end: 30 September.",
+]
+
+
+def build_sample(target_chars: int) -> str:
+    parts = []
+    size = 0
+    i = 0
+    while size < target_chars:
+        para = SAMPLE_PARAGRAPHS[i % len(SAMPLE_PARAGRAPHS)]
+        # 段落与行混排，覆盖不同优先级的分隔符
+        sep = "\n\n" if i % 3 == 0 else "\n"
+        parts.append(para + sep)
+        size += len(para) + len(sep)
+        i += 1
+    return "".join(parts)
+
+
+def time_best(fn, text: str, repeat: int):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn(text)
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def describe(name: str, chunks, seconds: float, text: str):
+    mb = len(text.encode("utf-8")) / (1024 * 1024)
+    lengths = [len(c) for c in chunks] or [0]
+    print(f"[{name}] 耗时 {seconds * 1000:.1f} ms，吞吐 {mb / seconds:.2f} MB/s，"
+          f"chunks {len(chunks)}，平均长度 {sum(lengths) / len(lengths):.0f}，最大长度 {max(lengths)}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--input", default=None, help="文本文件路径，留空使用内置样本")
+    ap.add_argument("--size", type=int, default=2_000_000, help="内置样本字符数")
+    ap.add_argument("--doc-type", default="pdf", help="文档类型（决定重叠比例）")
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    if args.input:
+        with open(args.input, "r", encoding="utf-8", errors="ignore") as f:
+            text = f.read()
+    else:
+        text = build_sample(args.size)
+
+    splitter = make_text_splitter(args.doc_type)
+    print(f"文本长度 {len(text)} 字符，chunk_size={splitter.chunk_size}，chunk_overlap={splitter.chunk_overlap}")
+
+    native_sec, native_splits = time_best(splitter.split_with_offsets, text, args.repeat)
+    native_chunks = [t for _, _, t in native_splits]
+    describe("OffsetTextSplitter", native_chunks, native_sec, text)
+    assert all(text[s:e] == t for s, e, t in native_splits), "偏移与文本不一致"
+
+    if not LANGCHAIN_AVAILABLE:
+        print("未安装 LangChain，跳过对比")
+        return
+
+    lc = RecursiveCharacterTextSplitter(
+        chunk_size=splitter.chunk_size,
+        chunk_overlap=splitter.chunk_overlap,
+        separators=splitter.separators,
+        keep_separator=True,
+        length_function=len,
+    )
+    lc_sec, lc_chunks = time_best(lc.split_text, text, args.repeat)
+    describe("LangChain", lc_chunks, lc_sec, text)
+
+    # LangChain 不返回偏移，需要再做一次定位（这正是旧流程的额外开销）
+    t0 = time.perf_counter()
+    lc_ranges = locate_chunk_ranges(text, lc_chunks)
+    locate_sec = time.perf_counter() - t0
+    located = sum(1 for r in lc_ranges if r is not None)
+    print(f"[LangChain] 事后定位偏移耗时 {locate_sec * 1000:.1f} ms，可定位 {located}/{len(lc_chunks)}")
+
+    native_ends = {e for _, e, _ in native_splits}
+    lc_ends = {r[1] for r in lc_ranges if r is not None}
+    common = len(native_ends & lc_ends)
+    print(f"切分点重合: {common}/{len(native_ends)}（本实现） / {len(lc_ends)}（LangChain）")
+    print(f"速度比: {(lc_sec + locate_sec) / native_sec:.1f}x（含LangChain事后定位）")
+
+
+if __name__ == "__main__":
+    main()
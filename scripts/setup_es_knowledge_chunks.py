@@ -2,15 +2,38 @@
 # -*- coding: utf-8 -*-
 """
 一键创建/重建 ES 索引（knowledge_chunks），用于存储"知识+附件"分块
-- 支持 dense_vector(1536)
+- 支持 dense_vector(1536)，向量字段建HNSW索引，可用原生kNN检索（RETRIEVAL_CONFIG["mode"] = "knn"）
 - 支持页码、位置（char_start/char_end）、元信息块（knowledge_meta）
+
+用法：
+  python scripts/setup_es_knowledge_chunks.py                       # 删除并重建索引
+  python scripts/setup_es_knowledge_chunks.py --migrate-knn         # 已有数据迁移到向量建索引的新索引（_reindex）
+  python scripts/setup_es_knowledge_chunks.py --migrate-knn --swap  # 迁移后删除旧索引，并以旧索引名建别名指向新索引
 """
-import requests
+import argparse
 import json
+import sys
+import time
+
+import requests
 
 ES_BASE = "http://localhost:9200"
 INDEX = "knowledge_base_new"  # 使用新名称避免冲突
 AUTH = ("elastic", "password")
+HEADERS = {"Content-Type": "application/json"}
+
+# 向量字段的HNSW索引参数（与 python_service/config.py 的 RETRIEVAL_CONFIG 保持一致）
+EMBEDDING_DIMS = 1536
+EMBEDDING_SIMILARITY = "cosine"
+HNSW_INDEX_OPTIONS = {"type": "hnsw", "m": 16, "ef_construction": 100}
+
+EMBEDDING_MAPPING = {
+    "type": "dense_vector",
+    "dims": EMBEDDING_DIMS,
+    "index": True,
+    "similarity": EMBEDDING_SIMILARITY,
+    "index_options": HNSW_INDEX_OPTIONS,
+}
 
 mapping = {
     "settings": {
@@ -34,7 +57,7 @@ mapping = {
             "bbox": {"type": "float"},  # 新的边界框字段 [x0, y0, x1, y1]
             "positions": {"type": "object", "enabled": False},  # 新的位置信息字段
             "content": {"type": "text"},
-            "embedding": {"type": "dense_vector", "dims": 1536}
+            "embedding": EMBEDDING_MAPPING
         }
     }
 }
@@ -44,8 +67,7 @@ def delete_index():
     print("DELETE", r.status_code, r.text)
 
 def create_index():
-    headers = {"Content-Type": "application/json"}
-    r = requests.put(f"{ES_BASE}/{INDEX}", auth=AUTH, headers=headers, data=json.dumps(mapping))
+    r = requests.put(f"{ES_BASE}/{INDEX}", auth=AUTH, headers=HEADERS, data=json.dumps(mapping))
     print("PUT", r.status_code, r.text)
 
 def show_mapping():
@@ -53,7 +75,97 @@ def show_mapping():
     print("GET _mapping", r.status_code)
     print(r.text)
 
+def resolve_index(name: str) -> str:
+    """别名解析为实际索引名"""
+    r = requests.get(f"{ES_BASE}/{name}/_mapping", auth=AUTH)
+    r.raise_for_status()
+    return next(iter(r.json()))
+
+def get_properties(index: str) -> dict:
+    r = requests.get(f"{ES_BASE}/{index}/_mapping", auth=AUTH)
+    r.raise_for_status()
+    return next(iter(r.json().values()))["mappings"].get("properties", {})
+
+def count_docs(index: str) -> int:
+    requests.post(f"{ES_BASE}/{index}/_refresh", auth=AUTH)
+    r = requests.get(f"{ES_BASE}/{index}/_count", auth=AUTH)
+    r.raise_for_status()
+    return r.json().get("count", 0)
+
+def migrate_knn(target: str, swap: bool, batch_size: int):
+    """
+    已有索引的 embedding 未建向量索引时，无法原地修改映射：
+    新建向量建索引的目标索引（其余字段映射沿用原索引），_reindex 复制数据，核对文档数
+    swap 时在同一个 _aliases 请求中删除旧索引并以旧索引名建别名，服务无需改配置
+    迁移期间写入旧索引的数据不会被复制，请先暂停入库
+    """
+    source = resolve_index(INDEX)
+    properties = get_properties(source)
+    current = properties.get("embedding", {})
+    if current.get("index") and current.get("similarity"):
+        print(f"✅ {source} 的 embedding 已建向量索引（similarity={current['similarity']}），无需迁移")
+        return
+    if current.get("dims") and current["dims"] != EMBEDDING_DIMS:
+        print(f"❌ 向量维度不一致：索引为 {current['dims']}，脚本为 {EMBEDDING_DIMS}")
+        sys.exit(1)
+
+    target = target or f"{source}_knn"
+    target_mapping = {
+        "settings": mapping["settings"],
+        "mappings": {"properties": {**properties, "embedding": EMBEDDING_MAPPING}},
+    }
+    r = requests.put(f"{ES_BASE}/{target}", auth=AUTH, headers=HEADERS, data=json.dumps(target_mapping))
+    print("PUT", target, r.status_code, r.text)
+    if r.status_code >= 300:
+        sys.exit(1)
+
+    body = {"source": {"index": source, "size": batch_size}, "dest": {"index": target}}
+    r = requests.post(f"{ES_BASE}/_reindex?wait_for_completion=false", auth=AUTH, headers=HEADERS, data=json.dumps(body))
+    r.raise_for_status()
+    task_id = r.json()["task"]
+    print(f"reindex 任务: {task_id}")
+    while True:
+        time.sleep(2)
+        task = requests.get(f"{ES_BASE}/_tasks/{task_id}", auth=AUTH).json()
+        status = task.get("task", {}).get("status", {})
+        print(f"  已复制 {status.get('created', 0) + status.get('updated', 0)}/{status.get('total', '?')}")
+        if task.get("completed"):
+            failures = task.get("response", {}).get("failures") or []
+            if task.get("error") or failures:
+                print(f"❌ reindex 失败: {task.get('error') or failures[:3]}")
+                sys.exit(1)
+            break
+
+    src_count, dst_count = count_docs(source), count_docs(target)
+    print(f"文档数: {source}={src_count}, {target}={dst_count}")
+    if src_count != dst_count:
+        print("❌ 文档数不一致，保留旧索引，请检查后重试")
+        sys.exit(1)
+
+    if not swap:
+        print(f"✅ 迁移完成。确认无误后加 --swap 切换，或将 ES_CONFIG['index'] 改为 {target}")
+        return
+    # INDEX 为实际索引或指向旧索引的别名时都适用：旧索引删除后，别名指向新索引
+    actions = {"actions": [
+        {"remove_index": {"index": source}},
+        {"add": {"index": target, "alias": INDEX}},
+    ]}
+    r = requests.post(f"{ES_BASE}/_aliases", auth=AUTH, headers=HEADERS, data=json.dumps(actions))
+    print("POST _aliases", r.status_code, r.text)
+
 if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--migrate-knn", action="store_true", help="将已有数据迁移到向量建HNSW索引的新索引")
+    ap.add_argument("--target", default=None, help="迁移目标索引名，默认 <原索引>_knn")
+    ap.add_argument("--swap", action="store_true", help="迁移后删除旧索引，并以旧索引名建别名指向新索引")
+    ap.add_argument("--batch-size", type=int, default=500, help="reindex 每批文档数（1536维向量文档较大）")
+    args = ap.parse_args()
+
+    if args.migrate_knn:
+        migrate_knn(args.target, args.swap, args.batch_size)
+        show_mapping()
+        sys.exit(0)
+
     try:
         delete_index()
     except Exception as e:
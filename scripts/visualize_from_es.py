@@ -81,15 +81,10 @@ def convert_office_to_pdf(src_path: str, out_dir: str) -> str:
 
 
 def create_simple_pdf_from_txt(src_path: str, out_path: str) -> str:
-    with open(src_path, 'r', encoding='utf-8', errors='ignore') as f:
-        text = f.read()
-    os.makedirs(os.path.dirname(out_path), exist_ok=True)
-    doc = fitz.open()
-    page = doc.new_page(width=595, height=842)
-    rect = fitz.Rect(40, 50, 555, 800)
-    page.insert_textbox(rect, text[:50000], fontsize=11, fontname="helv", align=0)
-    doc.save(out_path)
-    doc.close()
+    # 与入库时相同的排版，保证ES中记录的bbox能对上
+    add_python_service_to_path()
+    from pdf_layout import render_text_lines, iter_text_file_lines
+    render_text_lines(iter_text_file_lines(src_path), out_path)
     return out_path
 
 
@@ -118,6 +113,11 @@ def ensure_pdf(source_file: str, pdf_path_arg: str | None, knowledge_id: int | N
         return convert_office_to_pdf(src, out_dir)
 
     if ext == '.txt':
+        # 优先使用入库时生成的回显PDF
+        if knowledge_id is not None:
+            persisted = os.path.join(repo_root, 'python_service', 'static', 'converted', str(knowledge_id), Path(source_file).with_suffix('.pdf').name)
+            if os.path.exists(persisted):
+                return persisted
         out_path = os.path.join(repo_root, 'python_service', 'static', 'converted', 'vis', Path(source_file).with_suffix('.pdf').name)
         src = src_default if os.path.exists(src_default) else src_alt
         if not os.path.exists(src):
@@ -187,6 +187,8 @@ def query_es_hits(knowledge_id: int, source_file: str) -> List[Dict[str, Any]]:
 
 
 def draw_hits(pdf_path: str, hits: List[Dict[str, Any]], limit: int = 5) -> List[str]:
+    add_python_service_to_path()
+    from font_registry import get_font_registry
     out_dir = Path('rag_visualization')
     out_dir.mkdir(exist_ok=True)
     base_doc = fitz.open(pdf_path)
@@ -201,25 +203,10 @@ def draw_hits(pdf_path: str, hits: List[Dict[str, Any]], limit: int = 5) -> List
         # 新建独立文档用于绘制，避免“source document must not equal target”错误
         page = base_doc.load_page(page_num - 1)
         new_doc = fitz.open()
-        # 注册中文字体，避免覆盖文字出现问号
-        def _register_cjk_font(_doc: fitz.Document) -> str:
-            try:
-                candidates = [
-                    r"C:\\Windows\\Fonts\\msyh.ttc",
-                    r"C:\\Windows\\Fonts\\msyh.ttf",
-                    r"C:\\Windows\\Fonts\\simsun.ttc",
-                    r"C:\\Windows\\Fonts\\simhei.ttf",
-                ]
-                for p in candidates:
-                    if os.path.exists(p):
-                        _doc.insert_font(fontname="CJK", fontfile=p)
-                        return "CJK"
-            except Exception:
-                pass
-            return "helv"
-        cjk_font = _register_cjk_font(new_doc)
         new_page = new_doc.new_page(width=page.rect.width, height=page.rect.height)
         new_page.show_pdf_page(new_page.rect, base_doc, page_num - 1)
+        # 注册中文字体，避免覆盖文字出现问号
+        cjk_font = get_font_registry().insert_font(new_page)
 
         if isinstance(bbox, list) and len(bbox) == 4:
             x0, y0, x1, y1 = bbox
@@ -124,6 +124,8 @@ public class KnowledgeService {
         
         // 从ES删除
         elasticsearchService.deleteKnowledge(id);
+        // 作废引用了该知识的缓存答案
+        pythonService.invalidateAnswerCache(id, null);
         
         log.info("知识删除成功: ID={}, 名称={}", id, knowledge.getName());
     }
@@ -152,6 +154,8 @@ public class KnowledgeService {
         } catch (Exception e) {
             log.warn("ES删除附件相关chunks失败: knowledgeId={}, fileName={}, error={}", knowledgeId, attachment.getFileName(), e.getMessage());
         }
+        // 作废引用了该附件的缓存答案
+        pythonService.invalidateAnswerCache(knowledgeId, attachment.getFileName());
 
         log.info("附件软删除成功: knowledgeId={}, attachmentId={}", knowledgeId, attachmentId);
     }
@@ -175,6 +175,31 @@ public class PythonService {
         }
     }
     
+    /**
+     * 通知Python服务作废引用了已删除知识/附件的缓存答案（失败只记录日志，不影响删除）
+     */
+    public void invalidateAnswerCache(Long knowledgeId, String sourceFile) {
+        try {
+            String url = pythonServiceUrl + "/api/cache/answers/invalidate";
+            
+            Map<String, Object> requestBody = new HashMap<>();
+            requestBody.put("knowledge_id", knowledgeId);
+            if (sourceFile != null && !sourceFile.trim().isEmpty()) {
+                requestBody.put("source_file", sourceFile);
+            }
+            
+            HttpHeaders headers = new HttpHeaders();
+            headers.setContentType(MediaType.APPLICATION_JSON);
+            
+            HttpEntity<Map<String, Object>> request = new HttpEntity<>(requestBody, headers);
+            
+            ResponseEntity<String> response = restTemplate.postForEntity(url, request, String.class);
+            log.info("答案缓存作废完成: knowledgeId={}, sourceFile={}, 响应={}", knowledgeId, sourceFile, response.getBody());
+        } catch (Exception e) {
+            log.warn("通知Python服务作废答案缓存失败: knowledgeId={}, sourceFile={}, error={}", knowledgeId, sourceFile, e.getMessage());
+        }
+    }
+    
     /**
      * 检查Python服务健康状态
      */